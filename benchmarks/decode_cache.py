@@ -0,0 +1,52 @@
+"""Hit and miss statistics of the CPU decoded-instruction cache.
+
+Runs the test ROMs through the interpreter and reports, for each of them, how
+many executed instructions were found in the cache, how many had to be decoded
+and how many times cached instructions were invalidated by writes or bank
+switches.
+
+Run from the repository root with: python -m benchmarks.decode_cache
+"""
+from nes.console import Console
+from nes.cpu import InterruptType
+import os
+import time
+
+
+ROMS = ['nestest.nes', 'color_test.nes']
+FRAMES = 10
+
+
+def _abs_path(path):
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(_dir, path)
+
+
+def run(rom, frames=FRAMES):
+    console = Console(_abs_path(os.path.join('../tests', rom)))
+    cpu = console.cpu
+    instructions = 0
+    t = time.perf_counter()
+    while console.ppu.frame < frames:
+        if cpu.wait_cycles == 0 and \
+                cpu.interrupt_status is InterruptType.interruptNone:
+            instructions += 1
+        console.step()
+    elapsed = time.perf_counter() - t
+    return instructions, cpu.decode_misses, cpu.decode_invalidations, elapsed
+
+
+def main():
+    print('{0:<16}{1:>14}{2:>10}{3:>10}{4:>15}{5:>12}'.format(
+        'ROM', 'instructions', 'hits', 'misses', 'invalidations', 'instr/s'
+    ))
+    for rom in ROMS:
+        instructions, misses, invalidations, elapsed = run(rom)
+        print('{0:<16}{1:>14,}{2:>9.1%}{3:>10,}{4:>15,}{5:>12,.0f}'.format(
+            rom, instructions, (instructions - misses) / instructions, misses,
+            invalidations, instructions / elapsed
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Runs Klaus Dormann's 6502 functional test on the CPU alone, over a flat
+64kB memory, and reports where it stopped and the instructions per second.
+
+The test loops forever on a jump or branch to itself (a trap) when a check
+fails, and at SUCCESS_ADDRESS once all of them passed. The number of the
+running test is kept at TEST_NUMBER_ADDRESS. The last tests check the decimal
+mode, which the NES CPU does not have: the run passes once they are reached.
+
+Run from the repository root with: python -m benchmarks.functional_test
+"""
+from nes.cpu import CPU
+from nes.memory import FlatMemory
+import os
+import sys
+import time
+
+
+START_ADDRESS = 0x0400
+SUCCESS_ADDRESS = 0x3469
+TEST_NUMBER_ADDRESS = 0x0200
+DECIMAL_TEST_NUMBER = 0x2A
+MAX_INSTRUCTIONS = 100000000
+
+
+def _abs_path(path):
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(_dir, path)
+
+
+def run(max_instructions=MAX_INSTRUCTIONS):
+    """Returns the address of the trap reached, the number of the test it
+    belongs to, the number of instructions executed and the time it took."""
+    with open(_abs_path('../tests/6502_functional_test.bin'), 'rb') as f:
+        cpu = CPU(None, memory=FlatMemory(f.read()))
+    cpu.pc = START_ADDRESS
+    cpu.sp = 0xFF
+    cpu.setFlags(0x24)
+    step = cpu.step
+    instructions = 0
+    t = time.perf_counter()
+    pc = cpu.pc
+    while instructions < max_instructions:
+        step()
+        instructions += 1
+        if cpu.pc == pc:
+            break
+        pc = cpu.pc
+    elapsed = time.perf_counter() - t
+    return pc, cpu.memory.read(TEST_NUMBER_ADDRESS), instructions, elapsed
+
+
+def main():
+    pc, test, instructions, elapsed = run()
+    passed = pc == SUCCESS_ADDRESS or test >= DECIMAL_TEST_NUMBER
+    if pc == SUCCESS_ADDRESS:
+        print('Success')
+    elif passed:
+        print('Success, up to the decimal mode tests (trapped at ${0:04X})'.format(pc))
+    else:
+        print('Trapped at ${0:04X} in test ${1:02X}'.format(pc, test))
+    print('{0:,} instructions in {1:.1f}s: {2:,.0f} instructions/s'.format(
+        instructions, elapsed, instructions / elapsed
+    ))
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
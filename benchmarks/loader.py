@@ -0,0 +1,63 @@
+"""Time taken by parse_nes_file to load ROMs of increasing sizes.
+
+Synthetic iNES files are written to a temporary directory, from NROM-sized
+ROMs up to the largest MMC3 and NES 2.0 ones.
+
+Run from the repository root with: python -m benchmarks.loader
+"""
+from nes.utility import parse_nes_file
+import os
+import tempfile
+import time
+
+
+# (name, PRG ROM 16kB units, CHR ROM 8kB units, NES 2.0)
+SIZES = [
+    ('NROM-256', 2, 1, False),
+    ('UxROM', 16, 0, False),
+    ('MMC1', 32, 16, False),
+    ('MMC3', 32, 32, False),
+    ('NES 2.0 4MB', 128, 256, True),
+]
+REPEAT = 20
+
+
+def make_rom(path, prg_units, chr_units, nes2=False):
+    f7 = 0b1000 if nes2 else 0
+    # NES 2.0 keeps the upper bits of the sizes in byte 9
+    f9 = (chr_units >> 8) << 4 | prg_units >> 8 if nes2 else 0
+    header = bytes([
+        0x4e, 0x45, 0x53, 0x1a, prg_units & 0xFF, chr_units & 0xFF, 0, f7, 0,
+        f9, 0, 0, 0, 0, 0, 0
+    ])
+    size = prg_units * 0x4000 + chr_units * 0x2000
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(bytes(i & 0xFF for i in range(size)))
+    return size
+
+
+def load_time(path, repeat=REPEAT):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        with open(path, 'rb') as f:
+            parse_nes_file(f)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    print('{0:<14}{1:>10}{2:>12}{3:>12}'.format('ROM', 'size', 'time', 'MB/s'))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, prg_units, chr_units, nes2 in SIZES:
+            path = os.path.join(directory, 'rom.nes')
+            size = make_rom(path, prg_units, chr_units, nes2)
+            elapsed = load_time(path)
+            print('{0:<14}{1:>9}k{2:>10.2f}ms{3:>12,.0f}'.format(
+                name, size // 1024, elapsed * 1000, size / elapsed / 2**20
+            ))
+
+
+if __name__ == '__main__':
+    main()
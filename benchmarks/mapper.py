@@ -0,0 +1,70 @@
+"""Reads of the PRG ROM and of the pattern tables, and cost of a bank switch,
+for each mapper. The banks are views of the cartridge memories (see
+Mapper.map_prg_rom and Mapper.map_chr), so reads should be as fast as on
+NROM whatever the mapper.
+
+The ROMs are generated, with 128kB of PRG ROM and 32kB of CHR ROM (CHR RAM
+for the boards without CHR switching).
+
+Run from the repository root with: python -m benchmarks.mapper
+"""
+from benchmarks.memory import reads_per_second
+from nes.console import Console
+import os
+import tempfile
+import time
+
+
+PRG_BANKS = 8
+CHR_BANKS = 4
+SWITCHES = 10000
+# (name, mapper id, has CHR ROM, register writes switching to a bank and
+# back)
+MAPPERS = [
+    ('NROM', 0, True, None),
+    ('MMC1', 1, True, ([(0xE000, 1)] + [(0xE000, 0)] * 4, [(0xE000, 0)] * 5)),
+    ('UxROM', 2, False, ([(0x8000, 1)], [(0x8000, 0)])),
+    ('CNROM', 3, True, ([(0x8000, 1)], [(0x8000, 0)])),
+    ('MMC3', 4, True, ([(0x8000, 6), (0x8001, 2)], [(0x8000, 6), (0x8001, 0)])),
+    ('AxROM', 7, False, ([(0x8000, 1)], [(0x8000, 0)])),
+]
+
+
+def _nes_file(directory, mapper_id, chr_rom):
+    chr_banks = CHR_BANKS if chr_rom else 0
+    prg_banks = 2 if mapper_id == 0 else PRG_BANKS
+    header = bytes([
+        0x4e, 0x45, 0x53, 0x1a, prg_banks, chr_banks,
+        (mapper_id & 0x0F) << 4, mapper_id & 0xF0,
+    ]) + bytes(8)
+    path = os.path.join(directory, 'mapper_{}.nes'.format(mapper_id))
+    with open(path, 'wb') as f:
+        f.write(header + bytes(prg_banks * 0x4000 + chr_banks * 0x2000))
+    return path
+
+
+def us_per_switch(console, writes, switches=SWITCHES):
+    """Alternates between two banks."""
+    write = console.cpu.memory.write
+    writes = writes[0] + writes[1]
+    t = time.perf_counter()
+    for _ in range(switches // 2):
+        for address, value in writes:
+            write(address, value)
+    return (time.perf_counter() - t) * 1e6 / switches
+
+
+def main():
+    print('{0:<8}{1:>16}{2:>16}{3:>14}'.format('', 'PRG reads/s', 'CHR reads/s', 'us/switch'))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, mapper_id, chr_rom, writes in MAPPERS:
+            console = Console(_nes_file(directory, mapper_id, chr_rom))
+            prg = reads_per_second(console.cpu.memory, 0x8000, 0x10000)
+            chr_ = reads_per_second(console.ppu.memory, 0x0000, 0x2000)
+            # NROM has no banks to switch
+            switch = '{0:.2f}'.format(us_per_switch(console, writes)) if writes else '-'
+            print('{0:<8}{1:>16,.0f}{2:>16,.0f}{3:>14}'.format(name, prg, chr_, switch))
+
+
+if __name__ == '__main__':
+    main()
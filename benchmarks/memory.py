@@ -0,0 +1,60 @@
+"""Micro-benchmark of CPUMemory and PPUMemory reads, by region of the address
+spaces.
+
+Run from the repository root with: python -m benchmarks.memory
+"""
+from nes.console import Console
+import os
+import time
+
+
+REGIONS = [
+    ('RAM', 0x0000, 0x0800),
+    ('RAM (mirrors)', 0x0800, 0x2000),
+    ('PPU status', 0x2002, 0x2003),
+    ('APU registers', 0x4000, 0x4014),
+    ('PRG RAM', 0x6000, 0x8000),
+    ('PRG ROM', 0x8000, 0x10000),
+]
+PPU_REGIONS = [
+    ('Pattern tables', 0x0000, 0x2000),
+    ('Name tables', 0x2000, 0x3000),
+    ('Palette', 0x3F00, 0x4000),
+]
+READS = 100000
+REPEAT = 5
+
+
+def _abs_path(path):
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(_dir, path)
+
+
+def reads_per_second(memory, begin, end, reads=READS):
+    size = end - begin
+    addresses = [begin + (i * 7) % size for i in range(reads)]
+    read = memory.read
+    best = None
+    for _ in range(REPEAT):
+        t = time.perf_counter()
+        for address in addresses:
+            read(address)
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return reads / best
+
+
+def main():
+    console = Console(_abs_path('../tests/nestest.nes'))
+    for memory, regions in [
+        (console.cpu.memory, REGIONS), (console.ppu.memory, PPU_REGIONS)
+    ]:
+        print(type(memory).__name__)
+        for name, begin, end in regions:
+            print('  {0:<16}{1:>12,.0f} reads/s'.format(
+                name, reads_per_second(memory, begin, end)
+            ))
+
+
+if __name__ == '__main__':
+    main()
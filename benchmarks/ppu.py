@@ -0,0 +1,113 @@
+"""Time spent in the PPU per frame:
+    - rendering dot by dot (PPU.step),
+    - rendering line by line (PPU.run, see PPU.render_line),
+    - idem, cropping the background out of pre-rendered name tables (see
+      background.py),
+    - with rendering disabled, where PPU.run skips the idle steps at once.
+And cost of loading one tile row in the background shift register
+(PPU.load_background_data), with the former bit by bit loop and with the
+lookup table.
+
+Run from the repository root with: python -m benchmarks.ppu
+"""
+from nes.background import BackgroundLayer
+from nes.console import Console
+from nes.ppu import PPU
+import os
+import time
+
+
+ROM = 'color_test.nes'
+FRAMES = 5
+FRAME_DOTS = PPU.CLOCK_CYCLE * (PPU.PRE_RENDER_SCAN_LINE + 1)
+TILES = 100000
+REPEAT = 5
+
+
+def _abs_path(path):
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(_dir, path)
+
+
+def _console():
+    """Returns a console whose PPU is rendering."""
+    console = Console(_abs_path(os.path.join('../tests', ROM)))
+    while console.ppu.frame < 10:
+        console.step()
+    console.catch_up()
+    return console
+
+
+def step_frames(ppu, frames=FRAMES):
+    step = ppu.step
+    for _ in range(frames * FRAME_DOTS):
+        step()
+
+
+def run_frames(ppu, frames=FRAMES):
+    ppu.run(frames * FRAME_DOTS)
+
+
+def run_frames_layer(ppu, frames=FRAMES):
+    ppu.background_layer = BackgroundLayer(ppu)
+    ppu.run(frames * FRAME_DOTS)
+
+
+def run_frames_disabled(ppu, frames=FRAMES):
+    ppu.PPUMASK.write(0)
+    ppu.run(frames * FRAME_DOTS)
+
+
+def ms_per_frame(function, frames=FRAMES):
+    ppu = _console().ppu
+    t = time.perf_counter()
+    function(ppu, frames)
+    return (time.perf_counter() - t) * 1000 / frames
+
+
+def load_background_data_loop(ppu):
+    """PPU.load_background_data before the lookup table."""
+    data = 0
+    a = ppu.attribute_table_byte
+    for i in range(8):
+        b = (ppu.high_tile_byte & 0x80) >> 6
+        c = (ppu.low_tile_byte & 0x80) >> 7
+        data <<= 4
+        ppu.high_tile_byte <<= 1
+        ppu.low_tile_byte <<= 1
+        data |= (a | b | c)
+    ppu.background_data |= data
+
+
+def ns_per_tile(function, tiles=TILES):
+    ppu = _console().ppu
+    bytes_ = [(i * 7) & 0xFF for i in range(tiles)]
+    best = None
+    for _ in range(REPEAT):
+        t = time.perf_counter()
+        for byte in bytes_:
+            ppu.low_tile_byte = ppu.high_tile_byte = byte
+            ppu.background_data = 0
+            function(ppu)
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e9 / tiles
+
+
+def main():
+    for name, function in [
+        ('dot by dot', step_frames),
+        ('line by line', run_frames),
+        ('background layer', run_frames_layer),
+        ('disabled', run_frames_disabled),
+    ]:
+        print('{0:<18}{1:>10.2f} ms/frame'.format(name, ms_per_frame(function)))
+    for name, function in [
+        ('loop', load_background_data_loop),
+        ('lookup table', PPU.load_background_data),
+    ]:
+        print('{0:<18}{1:>10.0f} ns/tile'.format(name, ns_per_tile(function)))
+
+
+if __name__ == '__main__':
+    main()
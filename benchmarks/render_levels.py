@@ -0,0 +1,47 @@
+"""Frames per second of the whole console for each render level, with and
+without frameskip (see Console).
+
+Run from the repository root with: python -m benchmarks.render_levels
+"""
+from nes.console import Console
+from nes.ppu import RenderLevel
+import os
+import time
+
+
+ROM = 'color_test.nes'
+FRAMES = 30
+FRAMESKIPS = [0, 3]
+
+
+def _abs_path(path):
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(_dir, path)
+
+
+def frames_per_second(render_level, frameskip, frames=FRAMES):
+    console = Console(
+        _abs_path(os.path.join('../tests', ROM)),
+        render_level=render_level, frameskip=frameskip,
+    )
+    # Past the boot
+    while console.ppu.frame < 5:
+        console.step()
+    last_frame = console.ppu.frame + frames
+    t = time.perf_counter()
+    while console.ppu.frame < last_frame:
+        console.step()
+    return frames / (time.perf_counter() - t)
+
+
+def main():
+    print('{0:<12}{1:>12}{2:>12}'.format('level', 'frameskip', 'frames/s'))
+    for render_level in RenderLevel:
+        for frameskip in FRAMESKIPS:
+            print('{0:<12}{1:>12}{2:>12.1f}'.format(
+                render_level.name, frameskip, frames_per_second(render_level, frameskip)
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Memory use and time per frame of the rewind buffer (see rewind.py), by
+keyframe interval and zlib level, with the minutes of history fitting in
+32MB at 60 frames per second.
+
+Run from the repository root with: python -m benchmarks.rewind
+"""
+from nes.console import Console
+from nes.ppu import RenderLevel
+from nes.rewind import Rewind
+import os
+
+
+ROM = 'nestest.nes'
+FRAMES = 600
+BUDGET = 32 * 2**20
+SETTINGS = [(1, 1), (15, 1), (60, 1), (240, 1), (60, 6)]
+
+
+def _abs_path(path):
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(_dir, path)
+
+
+def record(keyframe_interval, level, frames=FRAMES):
+    console = Console(_abs_path(os.path.join('../tests', ROM)), render_level=RenderLevel.none)
+    rewind = Rewind(console, capacity=frames, keyframe_interval=keyframe_interval, level=level)
+    for _ in range(frames):
+        frame = console.ppu.frame
+        while console.ppu.frame == frame:
+            console.step()
+        rewind.record()
+    return rewind.stats()
+
+
+def main():
+    print('{0:>9}{1:>7}{2:>14}{3:>14}{4:>14}'.format(
+        'interval', 'level', 'bytes/frame', 'ms/record', 'minutes/32MB'
+    ))
+    for keyframe_interval, level in SETTINGS:
+        stats = record(keyframe_interval, level)
+        frame_bytes = stats['bytes'] / stats['frames']
+        print('{0:>9}{1:>7}{2:>14,.0f}{3:>14.3f}{4:>14,.0f}'.format(
+            keyframe_interval, level, frame_bytes, stats['ms_per_record'],
+            BUDGET / frame_bytes / 60 / 60
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Savestates per second: Console.save_state into a reused buffer, and
+Console.load_state, in the middle of a frame (see state.py).
+
+Run from the repository root with: python -m benchmarks.state
+"""
+from nes.console import Console
+import os
+import time
+
+
+ROMS = ['nestest.nes', 'color_test.nes']
+COUNT = 10000
+REPEAT = 5
+
+
+def _abs_path(path):
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(_dir, path)
+
+
+def per_second(function, count=COUNT):
+    best = None
+    for _ in range(REPEAT):
+        t = time.perf_counter()
+        for _ in range(count):
+            function()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+
+def main():
+    print('{0:<16}{1:>8}{2:>14}{3:>14}'.format('ROM', 'bytes', 'saves/s', 'loads/s'))
+    for rom in ROMS:
+        console = Console(_abs_path(os.path.join('../tests', rom)))
+        while console.ppu.frame < 10 or console.ppu.scan_line < 100:
+            console.step()
+        state = console.save_state()
+        out = bytearray(len(state))
+        saves = per_second(lambda: console.save_state(out))
+        loads = per_second(lambda: console.load_state(state))
+        print('{0:<16}{1:>8}{2:>14,.0f}{3:>14,.0f}'.format(rom, len(state), saves, loads))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,3 @@
-import numpy as np
-
-
 class APUError(Exception):
     pass
 
@@ -8,7 +5,7 @@ class APUError(Exception):
 class APU:
 
     def __init__(self, console):
-        self.registers = np.zeros(24, dtype='uint8')
+        self.registers = bytearray(24)
         self.status = 0x00
         self.frame_counter = 0x00
         self.console = console
@@ -0,0 +1,99 @@
+import numpy as np
+
+
+class BackgroundLayer:
+    """The four name tables pre-rendered into a 512x480 plane of background
+    pixels, for PPU.render_line to crop lines out of instead of decoding
+    their tiles again.
+
+    The plane holds the 4-bit pixels of the shift registers (palette << 2 |
+    pixel, see PPU.load_background_data), so palette changes do not affect
+    it. Only the tiles whose name table or attribute byte was written to
+    (PPUMemory.name_table_writes) are rendered again. Changes of the pattern
+    table used by the background, of the CHR tiles or of the mirroring make
+    all of them dirty.
+
+    The name tables are laid out as on screen: $2000 top left, $2400 top
+    right, $2800 bottom left, $2C00 bottom right.
+    """
+    TILE_ROWS = 30
+    TILE_COLUMNS = 32
+    WIDTH = 512
+    HEIGHT = 480
+    # Pixels of a line cropped out of the plane: the first two tiles of the
+    # line come from the shift register
+    LINE_WIDTH = 31 * 8
+
+    def __init__(self, ppu):
+        self._ppu = ppu
+        self._memory = ppu.memory
+        self._memory.watch_name_tables()
+        self.plane = np.zeros((BackgroundLayer.HEIGHT, BackgroundLayer.WIDTH), dtype='uint8')
+        # plane as [table Y, table X, tile row, tile column, fine Y, fine X]
+        self._tiles_view = self.plane.reshape(
+            2, BackgroundLayer.TILE_ROWS, 8, 2, BackgroundLayer.TILE_COLUMNS, 8
+        ).transpose(0, 3, 1, 4, 2, 5)
+        # Dirty tiles of each physical name table
+        self._dirty = np.ones(
+            (4, BackgroundLayer.TILE_ROWS, BackgroundLayer.TILE_COLUMNS), dtype=bool
+        )
+        # Physical name table shown at each of the four positions
+        self._tables = None
+        # State the whole plane depends on: (mirroring, pattern table, CHR)
+        self._state = None
+        self._columns = np.arange(BackgroundLayer.LINE_WIDTH)
+        self.rendered_tiles = 0
+
+    def refresh(self):
+        """Renders the dirty tiles again."""
+        mirroring = self._memory.mirroring
+        tiles = self._memory.tiles
+        tiles.refresh()
+        state = (mirroring, self._ppu.PPUCTRL.background_table_flag, tiles.generation)
+        if state != self._state:
+            self._state = state
+            self._tables = np.array(self._memory.name_table_offsets) >> 10
+            self._dirty[:] = True
+        writes = self._memory.name_table_writes
+        if writes:
+            for offset in writes:
+                table, offset = offset >> 10, offset & 0x3FF
+                if offset < 0x3C0:
+                    self._dirty[table, offset >> 5, offset & 0x1F] = True
+                else:
+                    # An attribute byte covers 4x4 tiles
+                    row, column = (offset - 0x3C0) >> 3 << 2, (offset & 0x7) << 2
+                    self._dirty[table, row:row + 4, column:column + 4] = True
+            writes.clear()
+        dirty = self._dirty[self._tables]
+        if dirty.any():
+            self._render(*np.nonzero(dirty))
+            self._dirty[:] = False
+
+    def _render(self, positions, rows, columns):
+        name_table = np.frombuffer(self._memory._name_table, dtype='uint8')
+        tables = self._tables[positions] << 10
+        names = name_table[tables | rows << 5 | columns].astype(int)
+        attributes = name_table[tables | 0x3C0 | rows >> 2 << 3 | columns >> 2]
+        palettes = (attributes >> ((rows & 2) << 1 | columns & 2)) & 0x3
+        tiles = self._memory.tiles
+        pixels = tiles.pixels[tiles.bank_tiles[names | self._ppu.PPUCTRL.background_table_flag << 8]]
+        pixels |= (palettes << 2).astype('uint8')[:, np.newaxis, np.newaxis]
+        self._tiles_view[positions >> 1, positions & 1, rows, columns] = pixels
+        self.rendered_tiles += len(positions)
+
+    def invalidate(self):
+        """Renders all the tiles again on the next refresh."""
+        self._state = None
+
+    def line(self, v):
+        """Returns the pixels of the tiles 2 to 32 of a line starting with the
+        given VRAM address, or None if its coarse Y scroll points in the
+        attribute table."""
+        coarse_y = (v >> 5) & 0x1F
+        if coarse_y >= BackgroundLayer.TILE_ROWS:
+            return None
+        self.refresh()
+        y = ((v >> 11) & 1) * 240 + coarse_y * 8 + ((v >> 12) & 0x7)
+        x = ((v >> 10) & 1) * 256 + (v & 0x1F) * 8
+        return self.plane[y, (x + self._columns) & (BackgroundLayer.WIDTH - 1)]
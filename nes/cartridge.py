@@ -1,5 +1,8 @@
-import numpy as np
+from enum import IntEnum
 import logging
+import os
+
+import numpy as np
 
 
 log = logging.getLogger('nes.' + __name__)
@@ -9,25 +12,51 @@ class CartridgeError(Exception):
     """Base error class"""
 
 
+class SaveFlush(IntEnum):
+    """When the battery-backed PRG RAM is written back to its save file. The
+    file is memory-mapped, so writes never wait for the disk: flushing only
+    forces the operating system to write the changed pages."""
+    manual = 0   # Only through Cartridge.flush (Console.flush_save)
+    exit = 1     # When the console is closed
+    frame = 2    # Also at the end of every frame
+
+
 class Cartridge:
     """A NES cartridge has at least two memory chips:
         - PRG (connected to CPU)
         - CHR (connected to PPU)
     There is at least a PRG ROM. The other components may, or may not be
     present.
+
+    When a save file is given, the PRG RAM is battery-backed: it is mapped
+    onto the file (created if needed), which keeps its content.
     """
     def __init__(self, prg_rom, chr_rom=[],
-                prg_ram_size=0,  chr_ram_size=0):
+                prg_ram_size=0,  chr_ram_size=0, save_file=None):
         self.prg_rom_size = len(prg_rom)
         self.chr_rom_size = len(chr_rom)
         self.prg_ram_size = prg_ram_size
         self.chr_ram_size = chr_ram_size
-        self.PRG_ROM = prg_rom
-        self.CHR_ROM = chr_rom
+        # Memories are bytearrays: indexing them returns Python ints. Use
+        # memory.as_array for NumPy views. Bytearrays are used as is.
+        self.PRG_ROM = _as_bytearray(prg_rom)
+        self.CHR_ROM = _as_bytearray(chr_rom)
         if chr_ram_size:
-            self.CHR_RAM = np.zeros(chr_ram_size, dtype='uint8')
-        if prg_ram_size:
-            self.PRG_RAM = np.zeros(prg_ram_size, dtype='uint8')
+            self.CHR_RAM = bytearray(chr_ram_size)
+        self.save_file = save_file if prg_ram_size else None
+        self._save = None
+        if self.save_file is not None:
+            self._save = _map_save_file(save_file, prg_ram_size)
+            # Indexing the memoryview returns Python ints, as a bytearray
+            self.PRG_RAM = memoryview(self._save)
+        elif prg_ram_size:
+            self.PRG_RAM = bytearray(prg_ram_size)
+
+    def flush(self):
+        """Writes the changes of the battery-backed PRG RAM to the save file,
+        if any."""
+        if self._save is not None:
+            self._save.flush()
 
     def read_prg_rom(self, address):
         try:
@@ -68,3 +97,25 @@ class Cartridge:
             self.CHR_ROM[address] = value
         except IndexError:
             raise CartridgeError("Trying to write CHR_ROM at {}".format(hex(address)))
+
+    def write_chr_ram(self, address, value):
+        try:
+            self.CHR_RAM[address] = value
+        except IndexError:
+            raise CartridgeError("Trying to write CHR_RAM at {}".format(hex(address)))
+
+
+def _as_bytearray(data):
+    return data if isinstance(data, bytearray) else bytearray(data)
+
+
+def _map_save_file(path, size):
+    """Returns a memory map of the size first bytes of the given file, which
+    is created or padded with zeros if needed."""
+    with open(path, 'ab') as f:
+        missing = size - f.tell()
+        if missing > 0:
+            f.write(bytes(missing))
+    if os.path.getsize(path) > size:
+        log.warning('Ignoring the data after %s bytes of %s.', size, path)
+    return np.memmap(path, dtype='uint8', mode='r+', shape=(size,))
@@ -1,31 +1,167 @@
 from nes.apu.apu import APU
+from nes.cartridge import SaveFlush
 from nes.cpu import CPU
-from nes.ppu import PPU
+from nes.ppu import PPU, RenderLevel
 from nes.mapper import Mapper
+from nes.translator import Translator
+from nes.idle import IdleLoopSkipper
+from nes.background import BackgroundLayer
+from nes.state import StateLayout
 
 class Console:
-    def __init__(self, file_name, debug=False):
+    def __init__(self, file_name, debug=False, translate=False, skip_idle=False,
+                 exact_timing=False, background_layer=False,
+                 render_level=RenderLevel.indices, frameskip=0, save_file=None,
+                 save_flush=SaveFlush.exit):
+        """Args:
+            translate: execute PRG ROM code through the basic block translator
+                (see translator.py) instead of the interpreter. Ignored in
+                debug mode.
+            skip_idle: skip the iterations of the loops waiting for the PPU
+                (see idle.py). Ignored in debug mode.
+            exact_timing: step the PPU after every CPU instruction instead of
+                letting it catch up with the CPU only when needed (see
+                catch_up). Both give the same results. Always on in debug mode.
+            background_layer: crop the background of the lines rendered at
+                once out of pre-rendered name tables (see background.py),
+                only rendering again the tiles that change.
+            render_level: what the PPU produces for the rendered frames (see
+                ppu.RenderLevel): nothing, palette indexes in
+                ppu.frame_buffer, or RGB colors as well in
+                ppu.rgb_frame_buffer.
+            frameskip: number of frames skipped after each rendered one.
+                Skipped frames produce nothing, but still update what the CPU
+                can observe: sprite zero hits, sprite overflows, vertical blank
+                and NMI timing.
+            save_file: file holding the battery-backed PRG RAM of the
+                cartridge, if it has a battery. Defaults to the ROM file with
+                a .sav extension.
+            save_flush: when the battery-backed PRG RAM is flushed to the save
+                file (see cartridge.SaveFlush): only through flush_save, also
+                in close, or also at the end of every frame.
+        """
         self._debug = debug
         if debug:
             self.debugger = Debugger()
-        self.cpu = CPU(self)
+        self.cpu = CPU(self, debug=debug)
         self.ppu = PPU(self)
         self.apu = APU(self)
-        self.mapper = Mapper.from_nes_file(file_name)
+        self.mapper = Mapper.from_nes_file(file_name, save_file)
+        self.save_flush = SaveFlush(save_flush)
+        if self.save_flush == SaveFlush.frame:
+            self.ppu.frame_callback = self.mapper.flush_save
+        self.mapper.catch_up = self.catch_up
+        self.mapper.acknowledge_irq = self.cpu.acknowledgeIRQ
+        self.ppu.scan_line_counter = self.mapper.clock_scan_line
+        if background_layer:
+            self.ppu.background_layer = BackgroundLayer(self.ppu)
+        self.ppu.render_level = RenderLevel(render_level)
+        self.ppu.frameskip = frameskip
+        self.translator = Translator(self) if translate and not debug else None
+        self.idle_loops = IdleLoopSkipper(self) if skip_idle and not debug else None
+        self.exact_timing = exact_timing or debug
+        # Number of PPU cycles the PPU is behind the CPU
+        self._ppu_debt = 0
+        # Debt from which the PPU must catch up
+        self._ppu_deadline = 0
+        # Blocks of the translator must not run past an NMI, the PPU is
+        # kept up to date when one of them may reach the deadline
+        self._catch_up_margin = 3 * Translator.MAX_BLOCK_CYCLES if self.translator else 0
+        # Layout of the savestates, built on first use
+        self._state_layout = None
+        self.cpu.memory.power_on()
+        self.ppu.memory.power_on()
         self.cpu.reset()
         self.ppu.reset()
+        self.catch_up()
 
     def step(self):
-        cpu_steps = self.cpu.step(self._debug)
+        if self.idle_loops is not None:
+            skipped_cycles = self.idle_loops.skip()
+            if skipped_cycles:
+                # The PPU already ran for the skipped cycles
+                self.catch_up()
+                return skipped_cycles
+        if self.translator is not None:
+            cpu_steps = self.translator.step()
+        else:
+            cpu_steps = self.cpu.step(self._debug)
         ppu_steps = 3*cpu_steps # 3.2 pour PAL
-        for _ in range(ppu_steps):
-            self.ppu.step()
+        if self.exact_timing:
+            for _ in range(ppu_steps):
+                self.ppu.step()
+        else:
+            self._ppu_debt += ppu_steps
+            if self._ppu_debt >= self._ppu_deadline:
+                self.catch_up()
 
         # for _ in range(cpu_steps):
         #     self.apu.step()
 
         return cpu_steps
 
+    def save_state(self, out=None):
+        """Returns a savestate: the whole state of the console in a bytearray
+        (or in out, a writable buffer of the same size), see state.py."""
+        if self._state_layout is None:
+            self._state_layout = StateLayout(self)
+        self.catch_up()
+        return self._state_layout.save(out)
+
+    def load_state(self, state):
+        """Restores a savestate returned by save_state."""
+        if self._state_layout is None:
+            self._state_layout = StateLayout(self)
+        self._state_layout.load(state)
+
+    def flush_save(self):
+        """Writes the battery-backed PRG RAM to the save file, if any."""
+        self.mapper.flush_save()
+
+    def close(self):
+        """Flushes the save file, unless flushing is manual."""
+        if self.save_flush != SaveFlush.manual:
+            self.flush_save()
+
+    def catch_up(self):
+        """Runs the PPU up to the current CPU cycle, then schedules the next
+        catch up.
+
+        The PPU only needs to be up to date when the CPU accesses its
+        registers (the memory calls catch_up before them), when it may raise an
+        NMI, and at the end of each frame, for the frame counter. Sprite zero
+        hits and other PPUSTATUS changes are only visible through register
+        reads. Does nothing in exact timing mode.
+        """
+        if self.exact_timing:
+            return
+        ppu = self.ppu
+        dots = self._ppu_debt
+        if dots:
+            self._ppu_debt = 0
+            ppu.run(dots)
+        deadline = min(
+            ppu.dots_until(PPU.POST_RENDER_SCAN_LINE, 1),
+            ppu.dots_until(0, 0),
+        )
+        if ppu.nmi_delay > 0:
+            deadline = min(deadline, ppu.nmi_delay)
+        irq_dots = self.dots_until_irq()
+        if irq_dots is not None:
+            deadline = min(deadline, irq_dots)
+        self._ppu_deadline = deadline - self._catch_up_margin
+
+    def dots_until_irq(self):
+        """Returns the number of PPU steps up to the one where the scan line
+        counter of the mapper raises its next IRQ, or None if none is coming
+        (see PPU.clock_scan_line_counter). The CPU never polls for it: the
+        PPU catches up right after this step."""
+        clocks = self.mapper.irq_clocks()
+        ppu = self.ppu
+        if clocks is None or not (ppu.PPUMASK.background_flag or ppu.PPUMASK.sprites_flag):
+            return None
+        return ppu.dots_until_counter(clocks)
+
 
 class Debugger:
     def __init__(self):
@@ -176,10 +176,35 @@ INSTRUCTION_IS_VALID = [
     True , True , False, False, False, True , True , False,
 ]
 
+# Addressing modes whose operand is fully known when decoding
+_STATIC_MODES = {
+    AddressingMode.modeAbsolute, AddressingMode.modeImmediate,
+    AddressingMode.modeAccumulator, AddressingMode.modeImplied,
+    AddressingMode.modeRelative, AddressingMode.modeZeroPage,
+}
+
+
+def zn_flags(z, n):
+    """Returns a result value whose Z and N flags are z and n.
+
+    The CPU does not store Z and N, only the last result they would be computed
+    from (cpu.zn): Z is set if its low byte is 0, N if bit 7 or bit 8 is set.
+    Bit 8 allows a result with both flags set (BIT, PLP, RTI).
+    """
+    if z:
+        return 0x100 if n else 0
+    return 0x80 if n else 1
+
 class CPU:
-    def __init__(self, console):
+    def __init__(self, console, memory=None, debug=False):
+        """Args:
+            memory: memory the CPU works on, the console's CPUMemory by
+                default (see memory.FlatMemory to run the CPU alone).
+            debug: keep the result of each instruction, shown in the
+                mneumonic of the traces of step(debug=True).
+        """
         self._console = console
-        self.memory = CPUMemory(console)
+        self.memory = memory if memory is not None else CPUMemory(console)
         self.step_cycles = 0
         self.pc = 0 # Program counter
         self.sp = 0 # Stack Pointer
@@ -188,23 +213,39 @@ class CPU:
         self.Y = 0  # Index Register Y
         # PROCESSOR FLAGS
         self.C = False  # Carry Flag
-        self.Z = False  # Zero Flag
+        # Z and N are evaluated lazily from the last result, see zn_flags
+        self.zn = 1
         self.I = False  # Interrupt Disable
         self.D = False  # Decimal Mode
         self.B = False  # Break command
         self.U = False  # Not used
         self.O = False  # Overflow flag
-        self.N = False  # Negative flag
         #ENDOF PROCESSOR FLAGS
         self.instruction_table = [getattr(self, i) if hasattr(self, i) else None  for i in INSTRUCTION_NAMES]
+        # Result of the last instruction, only kept in debug mode
+        self.result = None
+        if debug:
+            self.instruction_table = [
+                self._keep_result(i) if i is not None else None for i in self.instruction_table
+            ]
         self.wait_cycles = 0
         self.interrupt_status = InterruptType.interruptNone
+        # One decoder per opcode, see _build_decoder
+        self.decoders = [self._build_decoder(opcode) for opcode in range(256)]
+        # Decoded instruction cache: for each address, the function executing
+        # the instruction located there, or None. See decode.
+        self.decoded = [None] * 0x10000
+        self.decode_misses = 0
+        self.decode_invalidations = 0
+        # Pages of the decoded instructions, watched by the cache
+        self._code_pages = [False] * CPUMemory.PAGE_COUNT
+        self.memory.remap_callback = self._remapped
 
     def read_uint8(self, address):
         """Reads a byte from the memory at the given address
         """
 
-        return int(self.memory.read(address))
+        return self.memory.read(address)
 
     def read_uint16_bug(self, address):
         """Reads an uint16 from the memory the buggy way because the processor does not work correctly
@@ -213,14 +254,14 @@ class CPU:
         b = (a & 0xFF00) | ((a+1) & 0x00FF)
         lo = self.memory.read(a)
         hi = self.memory.read(b)
-        return int(hi << 8 | lo)
+        return hi << 8 | lo
 
     def read_uint16(self, address):
         """Reads an uint16 from the memory
         """
         lo = self.memory.read(address)
         hi = self.memory.read(address + 1)
-        return int(hi << 8 | lo)
+        return hi << 8 | lo
 
     def push_uint8(self, val):
         """Push the given val onto the stack
@@ -228,7 +269,7 @@ class CPU:
 
         stack_ad = self.memory.get_stack_address(self.sp)
         self.memory.write(stack_ad, val)
-        self.sp = self.sp - 1
+        self.sp = (self.sp - 1) & 0xFF
 
     def push_uint16(self, val):
         """Push a given uint16 onto the stack
@@ -239,37 +280,37 @@ class CPU:
         self.push_uint8(lo)
 
     def pop_uint8(self):
-        self.sp = self.sp + 1
+        self.sp = (self.sp + 1) & 0xFF
         stack_ad = self.memory.get_stack_address(self.sp)
-        return int(self.memory.read(stack_ad))
+        return self.memory.read(stack_ad)
 
     def pop_uint16(self):
         """Pops two bytes as one number from the stack"""
         lo = self.pop_uint8()
         hi = self.pop_uint8()
-        return int(hi << 8 | lo)
+        return hi << 8 | lo
 
     def getFlags(self):
         flags = 0x00
         flags |= self.C << 0
-        flags |= self.Z << 1
+        zn = self.zn
+        flags |= (zn & 0xFF == 0) << 1
         flags |= self.I << 2
         flags |= self.D << 3
         flags |= self.B << 4
         flags |= self.U << 5 # Not used
         flags |= self.O << 6
-        flags |= self.N << 7
+        flags |= (zn & 0x180 != 0) << 7
         return flags
 
     def setFlags(self, flags):
         self.C = (flags >> 0) & 1
-        self.Z = (flags >> 1) & 1
         self.I = (flags >> 2) & 1
         self.D = (flags >> 3) & 1
         self.B = (flags >> 4) & 1
         self.U = 1 #Not used
         self.O = (flags >> 6) & 1
-        self.N = (flags >> 7) & 1
+        self.zn = zn_flags((flags >> 1) & 1, (flags >> 7) & 1)
 
     def reset(self):
         self.pc = self.read_uint16(0xFFFC)
@@ -410,22 +451,24 @@ class CPU:
             self.wait_cycles -= 1
             return 1
 
-        if self.interrupt_status == InterruptType.interruptNMI:
-            self.nmi()
-            self.interrupt_status = InterruptType.interruptNone
-            return 0
-
-        elif self.interrupt_status == InterruptType.interruptIRQ:
-            self.irq()
+        if self.interrupt_status is not InterruptType.interruptNone:
+            if self.interrupt_status == InterruptType.interruptNMI:
+                self.nmi()
+            else:
+                self.irq()
             self.interrupt_status = InterruptType.interruptNone
             return 0
 
-        opcode = self.read_uint8(self.pc)
-        mode = INSTRUCTION_MODES[opcode]
+        pc = self.pc
+        handler = self.decoded[pc]
+        if handler is None:
+            handler = self.decode(pc)
         if(debug):
-            args = [self.read_uint8(self.pc+i) for i in range(1, INSTRUCTION_SIZES[opcode])]
+            opcode = self.read_uint8(pc)
+            mode = INSTRUCTION_MODES[opcode]
+            args = [self.read_uint8(pc+i) for i in range(1, INSTRUCTION_SIZES[opcode])]
             debug_data = {
-                'PC': '{0:04X}'.format(self.pc),
+                'PC': '{0:04X}'.format(pc),
                 'opcode': '{0:02X}'.format(opcode),
                 'args': ['{0:02X}'.format(a) for a in args],
                 'mneumonic': self._get_mneumonic_safe(opcode, mode, args),
@@ -435,76 +478,220 @@ class CPU:
                 'P': 'P:{0:02X}'.format(self.getFlags()),
                 'SP': 'SP:{0:02X}'.format(self.sp)
             }
-
-        page_crossed = False # Set to true when an underlying addition between a uint16 and a uint8 carries to the high byte
-        self.step_cycles = 0
-
-        if mode == AddressingMode.modeAbsolute:
-            arg = self.read_uint16(self.pc + 1)
+            self.result = None
+            debug_data['cycles'] = handler()
+            if self.result is not None:
+                debug_data['mneumonic'] = debug_data['mneumonic'].replace("RESULT", self.result)
+            # self._console.debugger.log_data(debug_data)
+            return debug_data['cycles']
+        return handler()
+
+    def _keep_result(self, instruction):
+        """Wraps an instruction to keep its result in self.result, as the
+        decoded instructions drop it."""
+        def keep_result(address, mode):
+            self.result = instruction(address, mode)
+            return self.result
+        return keep_result
+
+    def _build_decoder(self, opcode):
+        """Returns a function decoding the instruction of the given opcode
+        located at a given address. It returns a function executing that
+        instruction: the static part of the operand is resolved once, the
+        function only computes the indexed or indirect part, sets the program
+        counter to the next instruction, executes the instruction and returns
+        the number of cycles it took.
+        """
+        mode = INSTRUCTION_MODES[opcode]
+        size = INSTRUCTION_SIZES[opcode]
+        cycles = INSTRUCTION_CYCLES[opcode]
+        page_cycles = INSTRUCTION_PAGE_CYCLES[opcode]
+        instruction = self.instruction_table[opcode]
+        read = self.memory.read
+        read_uint16_bug = self.read_uint16_bug
+
+        if instruction is None:
+            def decode(pc):
+                def handler():
+                    raise NotImplementedError(
+                        'Unsupported opcode {0:02X} ({1}) at address={2}'.format(
+                            opcode, INSTRUCTION_NAMES[opcode], hex(pc)
+                        )
+                    )
+                return handler
+        elif mode in _STATIC_MODES:
+            def decode(pc):
+                if mode == AddressingMode.modeAbsolute:
+                    arg = read(pc + 1) | read(pc + 2) << 8
+                elif mode == AddressingMode.modeImmediate:
+                    arg = pc + 1
+                elif mode == AddressingMode.modeZeroPage:
+                    arg = read(pc + 1)
+                elif mode == AddressingMode.modeRelative:
+                    branch_offset = read(pc + 1)
+                    if branch_offset & 0b10000000:
+                        branch_offset = branch_offset - 256
+                    arg = pc + 2 + branch_offset
+                else:
+                    # Works on the registers directly, there is no operand
+                    arg = 0
+                next_pc = pc + size
+                def handler():
+                    self.pc = next_pc
+                    self.step_cycles = cycles
+                    instruction(arg, mode)
+                    return self.step_cycles
+                return handler
         elif mode == AddressingMode.modeAbsoluteX:
-            uint16_address = self.read_uint16(self.pc + 1)
-            uint8_index_register = self.X
-
-            arg = uint16_address + uint8_index_register
-            page_crossed = self.pagesDiffer(uint16_address, arg)
+            def decode(pc):
+                uint16_address = read(pc + 1) | read(pc + 2) << 8
+                page = uint16_address & 0xFF00
+                next_pc = pc + size
+                def handler():
+                    arg = uint16_address + self.X
+                    self.pc = next_pc
+                    self.step_cycles = cycles
+                    if page_cycles and page != arg & 0xFF00:
+                        self.step_cycles += page_cycles
+                    instruction(arg, mode)
+                    return self.step_cycles
+                return handler
         elif mode == AddressingMode.modeAbsoluteY:
-            uint16_address = self.read_uint16(self.pc + 1)
-            uint8_index_register = self.Y
-
-            arg = (uint16_address + uint8_index_register) & 0xFFFF
-            page_crossed = self.pagesDiffer(uint16_address, arg)
-        elif mode == AddressingMode.modeAccumulator:
-            # Works on self.A directly
-            arg = 0
-        elif mode == AddressingMode.modeImmediate:
-            arg = self.pc+1
-        elif mode == AddressingMode.modeImplied:
-            # For many 6502 instructions the source and destination of the information to be
-            # manipulated is implied directly by the function of the instruction itself and
-            # no further operand needs to be specified. Operations like 'Clear Carry Flag'
-            # (CLC) and 'Return from Subroutine' (RTS) are implicit.
-            arg = 0
+            def decode(pc):
+                uint16_address = read(pc + 1) | read(pc + 2) << 8
+                page = uint16_address & 0xFF00
+                next_pc = pc + size
+                def handler():
+                    arg = (uint16_address + self.Y) & 0xFFFF
+                    self.pc = next_pc
+                    self.step_cycles = cycles
+                    if page_cycles and page != arg & 0xFF00:
+                        self.step_cycles += page_cycles
+                    instruction(arg, mode)
+                    return self.step_cycles
+                return handler
         elif mode == AddressingMode.modeIndexedIndirect:
-            # Warning, there's a bug, the addition with X does not carry. TODO Need to be implemented
-            arg = self.read_uint16_bug((self.read_uint8(self.pc+1) + self.X) & 0xFF)
+            # Warning, there's a bug, the addition with X does not carry.
+            def decode(pc):
+                zero_page_address = read(pc + 1)
+                next_pc = pc + size
+                def handler():
+                    arg = read_uint16_bug((zero_page_address + self.X) & 0xFF)
+                    self.pc = next_pc
+                    self.step_cycles = cycles
+                    instruction(arg, mode)
+                    return self.step_cycles
+                return handler
         elif mode == AddressingMode.modeIndirect:
             # Same bug
-            arg = self.read_uint16_bug(self.read_uint16(self.pc + 1))
+            def decode(pc):
+                pointer = read(pc + 1) | read(pc + 2) << 8
+                next_pc = pc + size
+                def handler():
+                    arg = read_uint16_bug(pointer)
+                    self.pc = next_pc
+                    self.step_cycles = cycles
+                    instruction(arg, mode)
+                    return self.step_cycles
+                return handler
         elif mode == AddressingMode.modeIndirectIndexed:
             # Same bug
-            arg = (self.read_uint16_bug(self.read_uint8(self.pc + 1)) + self.Y) & 0xFFFF
-            page_crossed = self.pagesDiffer(arg - self.Y, arg)
-        elif mode == AddressingMode.modeRelative:
-            branch_offset = self.read_uint8(self.pc + 1)
-            if(branch_offset & 0b10000000):
-                branch_offset = branch_offset - 256
-
-            arg = self.pc + 2 + branch_offset
-        elif mode == AddressingMode.modeZeroPage:
-            arg = self.read_uint8(self.pc + 1)
+            def decode(pc):
+                zero_page_address = read(pc + 1)
+                next_pc = pc + size
+                def handler():
+                    uint16_address = read_uint16_bug(zero_page_address)
+                    arg = (uint16_address + self.Y) & 0xFFFF
+                    self.pc = next_pc
+                    self.step_cycles = cycles
+                    if page_cycles and (arg - self.Y) & 0xFF00 != arg & 0xFF00:
+                        self.step_cycles += page_cycles
+                    instruction(arg, mode)
+                    return self.step_cycles
+                return handler
         elif mode == AddressingMode.modeZeroPageX:
             # Wraps around to stay on Zero page
-            arg = (self.read_uint8(self.pc + 1) + self.X) & 0xff
+            def decode(pc):
+                zero_page_address = read(pc + 1)
+                next_pc = pc + size
+                def handler():
+                    arg = (zero_page_address + self.X) & 0xFF
+                    self.pc = next_pc
+                    self.step_cycles = cycles
+                    instruction(arg, mode)
+                    return self.step_cycles
+                return handler
         elif mode == AddressingMode.modeZeroPageY:
             # Wraps around to stay on Zero page
-            arg = (self.read_uint8(self.pc + 1) + self.Y) & 0xff
+            def decode(pc):
+                zero_page_address = read(pc + 1)
+                next_pc = pc + size
+                def handler():
+                    arg = (zero_page_address + self.Y) & 0xFF
+                    self.pc = next_pc
+                    self.step_cycles = cycles
+                    instruction(arg, mode)
+                    return self.step_cycles
+                return handler
         else:
             raise Exception("Unknown mode (%d)" % mode)
-
-        # Increment program counter
-        self.pc += INSTRUCTION_SIZES[opcode]
-        self.step_cycles += INSTRUCTION_CYCLES[opcode]
-
-        if page_crossed:
-            self.step_cycles += INSTRUCTION_PAGE_CYCLES[opcode]
-
-        rval = self.execute_instruction(opcode, arg, mode)
-        if debug:
-            debug_data['cycles'] = self.step_cycles
-            if rval is not None:
-                debug_data['mneumonic'] = debug_data['mneumonic'].replace("RESULT", rval)
-            # self._console.debugger.log_data(debug_data)
-        return self.step_cycles
+        return decode
+
+    def decode(self, address):
+        """Decodes the instruction at the given address and caches it, unless
+        it is not read from a buffer (e.g. I/O registers). Returns a function
+        executing it, see _build_decoder."""
+        opcode = self.memory.read(address)
+        handler = self.decoders[opcode](address)
+        first_page = address >> 8
+        last_page = (address + (INSTRUCTION_SIZES[opcode] or 1) - 1) >> 8
+        code_pages = self._code_pages
+        if not code_pages[first_page] or not code_pages[last_page]:
+            if not self._watch_code_page(first_page) or \
+                    not self._watch_code_page(last_page):
+                return handler
+        self.decoded[address] = handler
+        self.decode_misses += 1
+        return handler
+
+    def invalidate_decoded(self, address, size):
+        """Drops the cached instructions overlapping size bytes at address."""
+        start = max(address - 2, 0)
+        end = min(address + size, len(self.decoded))
+        self.decoded[start:end] = [None] * (end - start)
+        self.decode_invalidations += 1
+
+    def _watch_code_page(self, page):
+        # Writes to the code in RAM must invalidate the cache, there is no
+        # need to watch ROM: switching banks remaps the pages
+        if page >= CPUMemory.PAGE_COUNT or not self.memory.is_buffer_page(page):
+            return False
+        self.memory.watch_writes(page, self._code_written)
+        self._code_pages[page] = True
+        return True
+
+    def _remapped(self, address, size):
+        # Called by the memory when pages are remapped
+        self.invalidate_code(address, size)
+
+    def invalidate_code(self, address, size):
+        """Drops the cached instructions of the pages overlapping size bytes
+        at address. Only the code pages hold decoded instructions: the
+        others cost nothing."""
+        code_pages = self._code_pages
+        for page in range(address >> 8, (address + size - 1 >> 8) + 1):
+            if code_pages[page]:
+                self.invalidate_decoded(page << 8, CPUMemory.PAGE_SIZE)
+                code_pages[page] = False
+
+    def _code_written(self, address):
+        # Called by the memory after writes to a page holding decoded code
+        decoded = self.decoded
+        for mirror in self.memory.mirrors(address):
+            # Instructions of up to 3 bytes may overlap the written byte
+            window = decoded[max(mirror - 2, 0):mirror + 1]
+            if window.count(None) != len(window):
+                self.invalidate_decoded(mirror, 1)
 
     def execute_instruction(self, opcode, address, mode):
         # log.debug('opcode=%s, address=%s', opcode, hex(address))
@@ -514,17 +701,21 @@ class CPU:
     def pagesDiffer(a1, a2):
         return 0xFF00 & a1 != 0xFF00 & a2
 
-    def set_N(self, val):
-        # sets negative flag if val negative (bit 7 set)
-        self.N = 1 if val & 0x80 else 0
+    @property
+    def Z(self):
+        return 1 if self.zn & 0xFF == 0 else 0
+
+    @Z.setter
+    def Z(self, value):
+        self.zn = zn_flags(value, self.N)
 
-    def set_Z(self, val):
-        # sets zero flag if val is 0
-        self.Z = 1 if val == 0 else 0
+    @property
+    def N(self):
+        return 1 if self.zn & 0x180 else 0
 
-    def set_ZN(self, val):
-        self.set_Z(val)
-        self.set_N(val)
+    @N.setter
+    def N(self, value):
+        self.zn = zn_flags(self.Z, value)
 
     def triggerNMI(self):
         # self.I -> 0: /IRQ and /NMI get through; 1: only /NMI gets through)
@@ -532,9 +723,15 @@ class CPU:
 
     def triggerIRQ(self):
         # self.I -> 0: /IRQ and /NMI get through; 1: only /NMI gets through)
-        if(self.I == 0):
+        # A pending NMI takes precedence
+        if(self.I == 0) and self.interrupt_status is InterruptType.interruptNone:
             self.interrupt_status = InterruptType.interruptIRQ
 
+    def acknowledgeIRQ(self):
+        # The mapper stops pulling /IRQ down before the CPU serves it
+        if self.interrupt_status is InterruptType.interruptIRQ:
+            self.interrupt_status = InterruptType.interruptNone
+
     def nmi(self):
         self.push_uint16(self.pc)
         self.PHP(None, None)
@@ -554,7 +751,7 @@ class CPU:
         b = self.read_uint8(address)
         c = int(self.C)
         self.A = (a + b + c) & 0xFF
-        self.set_ZN(self.A)
+        self.zn = self.A
         self.C =  (a + b + c) > 255 # set carry if overflow happens
         self.O = (a^b) & 0b10000000 == 0 and (a^self.A) & 0b10000000 != 0
         return '{0:02X}'.format(b)
@@ -562,19 +759,19 @@ class CPU:
     def AND(self, address, mode):
         val = self.read_uint8(address)
         self.A = self.A & val
-        self.set_ZN(self.A)
+        self.zn = self.A
         return '{0:02X}'.format(val)
 
     def ASL(self, address, mode):
         if mode == AddressingMode.modeAccumulator:
             self.C = (self.A >> 7) & 1
             self.A = (self.A << 1) & 0xFF # force register to stay on 8 bits
-            self.set_ZN(self.A)
+            self.zn = self.A
         else:
             value = self.read_uint8(address)
             self.C = (value >> 7) & 1
             value = (value << 1) & 0xFF
-            self.set_ZN(value)
+            self.zn = value
             self.memory.write(address, value)
 
     def BCC(self, address, mode):
@@ -590,39 +787,40 @@ class CPU:
             self.step_cycles += 1 + 2*page_crossed
 
     def BEQ(self, address, mode):
-        if(self.Z):
+        if(not self.zn & 0xFF):
             page_crossed = self.pagesDiffer(self.pc, address)
             self.pc = address
             self.step_cycles += 1 + page_crossed
 
     def BIT(self, address, mode):
         value = self.read_uint8(address)
-        self.set_Z(self.A & value)
-        self.set_N(value)
+        self.zn = (self.A & value) | (value & 0x80) << 1
         self.O = (value >> 6) & 1
 
     def BMI(self, address, mode):
-        if(self.N):
+        if(self.zn & 0x180):
             page_crossed = self.pagesDiffer(self.pc, address)
             self.pc = address
             self.step_cycles += 1 + 2*page_crossed
 
     def BNE(self, address, mode):
-        if(not self.Z):
+        if(self.zn & 0xFF):
             page_crossed = self.pagesDiffer(self.pc, address)
             self.pc = address
             self.step_cycles += 1 + 2*page_crossed
 
     def BPL(self, address, mode):
-        if(not self.N):
+        if(not self.zn & 0x180):
             page_crossed = self.pagesDiffer(self.pc, address)
             self.pc = address
             self.step_cycles += 1 + 2*page_crossed
 
     def BRK(self, address, mode):
         self.B = 1
-        self.push_uint16(self.pc)
+        # BRK is followed by a padding byte, skipped on return
+        self.push_uint16(self.pc + 1)
         self.push_uint8(self.getFlags())
+        self.I = 1
         self.pc = self.read_uint16(0xFFFE)
 
     def BVC(self, address, mode):
@@ -653,18 +851,18 @@ class CPU:
     def CMP(self, address, mode):
         mem_val = self.read_uint8(address)
         self.C = self.A >= mem_val
-        self.set_ZN(self.A - mem_val)
+        self.zn = (self.A - mem_val) & 0xFF
         return '{0:02X}'.format(mem_val)
 
     def CPX(self, address, mode):
         mem_val = self.read_uint8(address)
         self.C = self.X >= mem_val
-        self.set_ZN(self.X - mem_val)
+        self.zn = (self.X - mem_val) & 0xFF
 
     def CPY(self, address, mode):
         mem_val = self.read_uint8(address)
         self.C = self.Y >= mem_val
-        self.set_ZN(self.Y - mem_val)
+        self.zn = (self.Y - mem_val) & 0xFF
 
     def DCP(self, address, mode):
         old_val = self.read_uint8(address)
@@ -675,34 +873,34 @@ class CPU:
     def DEC(self, address, mode):
         new_val = (self.read_uint8(address) - 1) & 0xFF
         self.memory.write(address, new_val)
-        self.set_ZN(new_val)
+        self.zn = new_val
 
     def DEX(self, address, mode):
         self.X = (self.X - 1) & 0xFF
-        self.set_ZN(self.X)
+        self.zn = self.X
 
     def DEY(self, address, mode):
         self.Y = (self.Y - 1) & 0xFF
-        self.set_ZN(self.Y)
+        self.zn = self.Y
 
     def EOR(self, address, mode):
         val = self.read_uint8(address)
         self.A = self.A ^ val
-        self.set_ZN(self.A)
+        self.zn = self.A
         return '{0:02X}'.format(val)
 
     def INC(self, address, mode):
         new_val = (self.read_uint8(address) + 1) & 0xFF
         self.memory.write(address, new_val)
-        self.set_ZN(new_val)
+        self.zn = new_val
 
     def INX(self, address, mode):
         self.X = (self.X + 1) & 0xFF
-        self.set_ZN(self.X)
+        self.zn = self.X
 
     def INY(self, address, mode):
         self.Y = (self.Y + 1) & 0xFF
-        self.set_ZN(self.Y)
+        self.zn = self.Y
 
     def ISB(self, address, mode):
         old_val = self.read_uint8(address)
@@ -724,28 +922,28 @@ class CPU:
 
     def LDA(self, address, mode):
         self.A = self.read_uint8(address)
-        self.set_ZN(self.A)
+        self.zn = self.A
         return '{0:02X}'.format(self.A)
 
     def LDX(self, address, mode):
         self.X = self.read_uint8(address)
-        self.set_ZN(self.X)
+        self.zn = self.X
 
     def LDY(self, address, mode):
         self.Y = self.read_uint8(address)
-        self.set_ZN(self.Y)
+        self.zn = self.Y
 
     def LSR(self, address, mode):
         if mode == AddressingMode.modeAccumulator:
             self.C = self.A & 1
             self.A = self.A >> 1
-            self.set_ZN(self.A)
+            self.zn = self.A
         else:
             value = self.read_uint8(address)
             self.C = value & 1
             value = value >> 1
             self.memory.write(address, value)
-            self.set_ZN(value)
+            self.zn = value
 
     def NOP(self, address, mode):
         pass
@@ -753,7 +951,7 @@ class CPU:
     def ORA(self, address, mode):
         val = self.read_uint8(address)
         self.A |= val
-        self.set_ZN(self.A)
+        self.zn = self.A
         return '{0:02X}'.format(val)
 
     def PHA(self, address, mode):
@@ -764,7 +962,7 @@ class CPU:
 
     def PLA(self, address, mode):
         self.A = self.pop_uint8()
-        self.set_ZN(self.A)
+        self.zn = self.A
 
     def PLP(self, address, mode):
         self.setFlags(self.pop_uint8()&0xEF | 0x20)
@@ -780,28 +978,28 @@ class CPU:
             hi_a = (self.A & 0b10000000) >> 7
             self.A = ((self.A << 1) & 0xFF) | (self.C)
             self.C = hi_a
-            self.set_ZN(self.A)
+            self.zn = self.A
         else:
             value = self.read_uint8(address)
             hi_a = (value & 0b10000000) >> 7
             value = ((value << 1) & 0xFF) | (self.C)
             self.C = hi_a
             self.memory.write(address, value)
-            self.set_ZN(value)
+            self.zn = value
 
     def ROR(self, address, mode):
         if mode == AddressingMode.modeAccumulator:
             lo_a = self.A & 1
             self.A = (self.A >> 1) | (self.C << 7)
             self.C = lo_a
-            self.set_ZN(self.A)
+            self.zn = self.A
         else:
             value = self.read_uint8(address)
             lo_a = value & 1
             value = (value >> 1) | (self.C << 7)
             self.C = lo_a
             self.memory.write(address, value)
-            self.set_ZN(value)
+            self.zn = value
 
     def RRA(self, address, mode):
         old_val = self.read_uint8(address)
@@ -823,12 +1021,12 @@ class CPU:
         return '{0:02X}'.format(old_val)
 
     def SBC(self, address, mode):
-        a = int(self.A)
-        b = int(self.read_uint8(address))
+        a = self.A
+        b = self.read_uint8(address)
         c = int(self.C)
         result = a - b - (1 - c)
         self.A = result & 0xFF
-        self.set_ZN(self.A)
+        self.zn = self.A
 
         self.C = 1 if result >= 0 else 0
         self.O = (a^b) & 0b10000000 != 0 and (a^self.A) & 0b10000000 != 0
@@ -864,23 +1062,23 @@ class CPU:
 
     def TAX(self, address, mode):
         self.X = self.A
-        self.set_ZN(self.X)
+        self.zn = self.X
 
     def TAY(self, address, mode):
         self.Y = self.A
-        self.set_ZN(self.Y)
+        self.zn = self.Y
 
     def TSX(self, address, mode):
         self.X = self.sp
-        self.set_ZN(self.X)
+        self.zn = self.X
 
     def TXA(self, address, mode):
         self.A = self.X
-        self.set_ZN(self.A)
+        self.zn = self.A
 
     def TXS(self, address, mode):
         self.sp = self.X
 
     def TYA(self, address, mode):
         self.A = self.Y
-        self.set_ZN(self.A)
+        self.zn = self.A
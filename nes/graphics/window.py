@@ -1,6 +1,8 @@
 import pygame
 from pygame.locals import *
 from nes.console import Console
+from nes.ppu import PPU
+from nes.rewind import Rewind
 import sys
 import time
 import os
@@ -12,39 +14,35 @@ def _abs_path(path):
 
 def main():
     console = Console(_abs_path('../../tests/color_test.nes'), debug=True)
+    # Hold backspace to go back in time
+    rewind = Rewind(console)
     t = time.time()
     pygame.init()
 
-    size = (320, 240)
-
-    width = size[0]
-    height = size[1]
-
-    black = (0, 0, 0)
+    size = (PPU.WIDTH, PPU.HEIGHT)
 
     screen = pygame.display.set_mode(size)
     pixels = pygame.Surface(size).convert()
     pixels.fill((0, 0, 0)) # Black
 
     screen.blit(pixels, (0, 0))
-    is_frame_even = 0
     while 1:
         for event in pygame.event.get():
             if event.type == QUIT:
+                console.close()
                 sys.exit(0)
 
+        if pygame.key.get_pressed()[K_BACKSPACE]:
+            # Frames are not saved: go back two frames and render one again
+            rewind.step_back(2)
         old_frame_val = console.ppu.frame
         while console.ppu.frame == old_frame_val:
             console.step()
+        rewind.record()
 
-        for i in range(size[0]):
-            for j in range(size[1]):
-                if is_frame_even:
-                    pixels.set_at((i, j), Color(255, 255, 255, 1))
-                else:
-                    pixels.set_at((i, j), Color(0, 0, 0, 1))
+        # surfarray arrays are indexed by x first
+        pygame.surfarray.blit_array(pixels, console.ppu.rgb_frame().swapaxes(0, 1))
         screen.blit(pixels, (0, 0))
         pygame.display.flip()
-        is_frame_even = not is_frame_even
 
-main()
\ No newline at end of file
+main()
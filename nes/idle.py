@@ -0,0 +1,213 @@
+import logging
+
+from nes.cpu import (
+    AddressingMode, InterruptType, INSTRUCTION_NAMES, INSTRUCTION_MODES,
+    INSTRUCTION_SIZES, INSTRUCTION_CYCLES
+)
+from nes.ppu import PPU
+
+
+log = logging.getLogger('nes.' + __name__)
+
+
+# Value cached by IdleLoopSkipper._loops for addresses that are not idle loops
+_NOT_A_LOOP = False
+
+# Instructions reading memory without writing anything but registers
+_READS = {
+    'LDA', 'LDX', 'LDY', 'BIT', 'CMP', 'CPX', 'CPY', 'AND', 'ORA', 'EOR',
+    'ADC', 'SBC',
+}
+# Addressing modes whose address is known statically and never crosses a page
+_STATIC_MODES = {
+    AddressingMode.modeZeroPage, AddressingMode.modeAbsolute,
+}
+_ZERO_PAGE_INDEXED_MODES = {
+    AddressingMode.modeZeroPageX, AddressingMode.modeZeroPageY,
+}
+# Instructions working on registers and flags only
+_REGISTER_OPS = {
+    'TAX', 'TAY', 'TXA', 'TYA', 'TSX', 'TXS', 'CLC', 'SEC', 'CLV', 'CLI',
+    'SEI', 'CLD', 'SED',
+}
+_BRANCHES = {'BCC', 'BCS', 'BEQ', 'BNE', 'BMI', 'BPL', 'BVC', 'BVS'}
+_OFFICIAL_NOP = 0xEA
+
+
+class _Loop:
+    """Wait loop found in PRG ROM.
+
+    The loop runs from start to end, the instruction at end jumping back to
+    start. head is the address at which iterations are compared: the PPUSTATUS
+    read if there is one, so that its value is known before it is read.
+    """
+    def __init__(self, start, end, head, cycles, reads_status):
+        self.start = start
+        self.end = end
+        self.head = head
+        self.cycles = cycles
+        self.reads_status = reads_status
+
+
+class IdleLoopSkipper:
+    """Detects the loops in which the CPU waits for the PPU and skips their
+    iterations up to the next PPU event.
+
+    A candidate loop is a short backward branch or jump in PRG ROM whose body
+    only reads RAM, PRG memory or PPUSTATUS into registers (see find_loop).
+    When the CPU comes back to the head of such a loop with the same registers
+    and reads the same PPUSTATUS value, the iteration has no effect and the
+    next ones are identical until something else changes memory or the status
+    register. That can only happen through an NMI or a PPU event: iterations
+    are skipped as a whole up to the step before the next vblank change or
+    NMI, while the PPU keeps running. With rendering enabled, sprite zero hits
+    and overflows cannot be predicted: PPUSTATUS is then checked before every
+    skipped iteration.
+
+    The state of the console after skipped iterations is the one the
+    interpreter reaches after the same number of cycles.
+    """
+    # Longest loop body, in bytes
+    MAX_LOOP_SIZE = 16
+
+    def __init__(self, console):
+        self._console = console
+        self._cpu = console.cpu
+        self._loops = {}
+        self._loop = None
+        self._state = None
+        self._last_pc = 0
+        self.skipped_cycles = 0
+
+    def skip(self):
+        """Must be called before each CPU step. Returns the number of CPU cycles
+        skipped, the PPU having run for as long, or 0 if the CPU must step."""
+        cpu = self._cpu
+        pc = cpu.pc
+        last_pc = self._last_pc
+        self._last_pc = pc
+        loop = self._loop
+        if loop is not None:
+            if loop.start <= pc <= loop.end:
+                if pc == loop.head:
+                    return self._arrive(loop)
+                return 0
+            # Left the loop or interrupted
+            self._loop = self._state = None
+        if pc <= last_pc <= pc + IdleLoopSkipper.MAX_LOOP_SIZE and pc >= 0x8000:
+            key = (pc, self._console.mapper.prg_bank(pc))
+            loop = self._loops.get(key)
+            if loop is None:
+                loop = self._loops[key] = self.find_loop(pc)
+            if loop is not _NOT_A_LOOP:
+                self._loop = loop
+                if pc == loop.head:
+                    return self._arrive(loop)
+        return 0
+
+    def forget(self):
+        """Forgets the current loop, e.g. after loading a savestate."""
+        self._loop = self._state = None
+        self._last_pc = 0
+
+    def find_loop(self, start):
+        """Decodes the loop starting at the given address. Returns a _Loop, or
+        _NOT_A_LOOP if the code may have side effects or is not a loop."""
+        read_uint8 = self._cpu.read_uint8
+        pc = start
+        cycles = 0
+        status_reads = []
+        exits = []
+        while pc < start + IdleLoopSkipper.MAX_LOOP_SIZE:
+            opcode = read_uint8(pc)
+            name = INSTRUCTION_NAMES[opcode]
+            mode = INSTRUCTION_MODES[opcode]
+            size = INSTRUCTION_SIZES[opcode]
+            next_pc = pc + size
+            cycles += INSTRUCTION_CYCLES[opcode]
+            if name in _BRANCHES:
+                offset = read_uint8(pc + 1)
+                if offset & 0x80:
+                    offset -= 256
+                target = next_pc + offset
+                if target == start:
+                    page_crossed = next_pc & 0xFF00 != target & 0xFF00
+                    if name == 'BEQ':
+                        cycles += 1 + page_crossed
+                    else:
+                        cycles += 1 + 2*page_crossed
+                    break
+                exits.append(target)
+            elif name == 'JMP' and mode == AddressingMode.modeAbsolute:
+                if read_uint8(pc + 1) | read_uint8(pc + 2) << 8 == start:
+                    break
+                return _NOT_A_LOOP
+            elif name in _READS and mode in _STATIC_MODES:
+                address = read_uint8(pc + 1)
+                if mode == AddressingMode.modeAbsolute:
+                    address |= read_uint8(pc + 2) << 8
+                if 0x2000 <= address < 0x4000 and address & 0x7 == 0x2:
+                    status_reads.append(pc)
+                elif 0x2000 <= address < 0x6000:
+                    return _NOT_A_LOOP
+            elif name in _READS and mode in _ZERO_PAGE_INDEXED_MODES:
+                pass
+            elif name in _READS and mode == AddressingMode.modeImmediate:
+                pass
+            elif name not in _REGISTER_OPS and opcode != _OFFICIAL_NOP:
+                return _NOT_A_LOOP
+            pc = next_pc
+        else:
+            return _NOT_A_LOOP
+
+        if len(status_reads) > 1 or any(start <= t <= pc for t in exits):
+            return _NOT_A_LOOP
+        head = status_reads[0] if status_reads else start
+        log.debug('Idle loop at $%04X-$%04X, %d cycles', start, pc, cycles)
+        return _Loop(start, pc, head, cycles, bool(status_reads))
+
+    def _arrive(self, loop):
+        """Called at the head of the current loop."""
+        self._console.catch_up()
+        cpu = self._cpu
+        if cpu.wait_cycles > 0 or cpu.interrupt_status is not InterruptType.interruptNone:
+            self._state = None
+            return 0
+        status = self._console.ppu.PPUSTATUS.peek() if loop.reads_status else None
+        state = (cpu.A, cpu.X, cpu.Y, cpu.sp, cpu.getFlags(), status)
+        if state != self._state:
+            self._state = state
+            return 0
+        return self._fast_forward(loop, status)
+
+    def _fast_forward(self, loop, status):
+        """Skips iterations of loop up to the next PPU event. Returns the number
+        of CPU cycles skipped."""
+        ppu = self._console.ppu
+        dots = min(
+            ppu.dots_until(PPU.POST_RENDER_SCAN_LINE, 1),
+            ppu.dots_until(PPU.PRE_RENDER_SCAN_LINE, 1),
+        )
+        if ppu.nmi_delay > 0:
+            dots = min(dots, ppu.nmi_delay)
+        irq_dots = self._console.dots_until_irq()
+        if irq_dots is not None:
+            dots = min(dots, irq_dots)
+        iteration_dots = 3 * loop.cycles
+        # Stop right before the step raising the event
+        count = (dots - 1) // iteration_dots
+        if count <= 0:
+            return 0
+        rendering_enabled = ppu.PPUMASK.background_flag or ppu.PPUMASK.sprites_flag
+        if loop.reads_status and rendering_enabled:
+            peek = ppu.PPUSTATUS.peek
+            for i in range(count):
+                if peek() != status:
+                    count = i
+                    break
+                ppu.run(iteration_dots)
+        else:
+            ppu.run(count * iteration_dots)
+        cycles = count * loop.cycles
+        self.skipped_cycles += cycles
+        return cycles
@@ -1,6 +1,9 @@
 from nes.utility import parse_nes_file
 from nes.cartridge import Cartridge
+from nes.mirror import Mirroring
+from nes.tiles import TileCache
 import logging
+import os
 
 
 log = logging.getLogger('nes.' + __name__)
@@ -8,9 +11,120 @@ log = logging.getLogger('nes.' + __name__)
 
 class Mapper:
     """Base Mapper class. Extend to create a new mapper"""
+    PRG_WINDOW = 0x2000
+    CHR_WINDOW = 0x400
+    # Called by the PPU once per rendered scan line (see
+    # PPU.clock_scan_line_counter), returns whether it raises an IRQ. None
+    # for the boards without a scan line counter.
+    clock_scan_line = None
+    # Attributes saved in savestates (see state.py): integers (0 - 255) and
+    # bytearrays of the bank registers and counters
+    STATE = ()
+    STATE_BUFFERS = ()
+
     def __init__(self, cartridge, mirror_id):
         self._cartridge = cartridge
         self.mirror_id = mirror_id
+        self._cpu_memory = None
+        self._ppu_memory = None
+        self._chr_memory = cartridge.CHR_RAM if cartridge.chr_ram_size else cartridge.CHR_ROM
+        # Decoded tiles of the CHR memory, see tiles.py, kept up to date by
+        # map_chr and the PPU memory
+        self.tiles = TileCache(self._chr_memory)
+        # Offsets of the banks shown in the 8kB windows of $8000 - $FFFF and
+        # in the 1kB windows of the pattern tables, None until mapped
+        self._prg_offsets = [None] * 4
+        self._chr_offsets = [None] * 8
+        # Brings the PPU up to date with the CPU before the pattern tables,
+        # the mirroring or the scan line counter change, set by the console
+        self.catch_up = lambda: None
+        # Clears a pending IRQ of the mapper, set by the console
+        self.acknowledge_irq = lambda: None
+
+    def map_prg(self, memory):
+        """Installs the $6000 - $FFFF pages of the CPU memory. The default
+        goes through read_prg and write_prg on every access; mappers should
+        map their banks directly with map_prg_rom."""
+        self._cpu_memory = memory
+        memory.map_handlers(0x6000, 0xA000, self.read_prg, self.write_prg)
+
+    def map_ppu(self, memory):
+        """Installs the pattern tables and name tables of the PPU memory, see
+        map_chr_banks and set_mirroring."""
+        self._ppu_memory = memory
+        memory.set_mirroring(self.mirror_id)
+        self.map_chr_banks()
+
+    def map_banks(self):
+        """Maps the banks selected by the registers again, e.g. after loading
+        a savestate."""
+        self.map_prg_banks()
+        self.map_chr_banks()
+
+    def map_prg_banks(self):
+        """Maps the current PRG ROM banks. The default has none to switch."""
+
+    def map_chr_banks(self):
+        """Maps the current CHR banks. The default shows the first 8kB of CHR
+        memory."""
+        size = min(len(self._chr_memory), 0x2000)
+        if size:
+            for address in range(0x0000, 0x2000, size):
+                self.map_chr(address, 0, size)
+
+    def map_prg_ram(self, memory):
+        """Maps the PRG RAM at $6000 - $7FFF. Without PRG RAM, reads return
+        the open bus (the high byte of the address) and writes are lost."""
+        size = min(self._cartridge.prg_ram_size, 0x2000)
+        if not size:
+            memory.map_handlers(0x6000, 0x2000, lambda address: address >> 8,
+                                lambda address, value: None)
+            return
+        prg_ram = memoryview(self._cartridge.PRG_RAM)
+        for address in range(0x6000, 0x8000, size):
+            memory.map_buffer(address, prg_ram[:size], writable=True)
+
+    def map_prg_rom(self, address, offset, size):
+        """Shows size bytes of the PRG ROM, from offset, at the given CPU
+        address. Offsets are taken modulo the ROM size: -0x4000 is the last
+        16kB bank, and a 16kB ROM fills a 32kB window twice. Only the pages
+        of the windows whose bank changes are pointed at the new views,
+        nothing is copied."""
+        prg_rom = memoryview(self._cartridge.PRG_ROM)
+        offset %= len(prg_rom)
+        first = (address >> 13) & 3
+        for i in range(size // Mapper.PRG_WINDOW):
+            window_offset = (offset + i * Mapper.PRG_WINDOW) % len(prg_rom)
+            if self._prg_offsets[first + i] != window_offset:
+                self._prg_offsets[first + i] = window_offset
+                self._cpu_memory.map_buffer(
+                    address + i * Mapper.PRG_WINDOW,
+                    prg_rom[window_offset:window_offset + Mapper.PRG_WINDOW]
+                )
+
+    def map_chr(self, address, offset, size):
+        """Shows size bytes of the CHR memory, from offset (modulo the CHR
+        size), at the given pattern table address. Nothing happens if these
+        banks are already shown."""
+        offset %= len(self._chr_memory)
+        first, last = address // Mapper.CHR_WINDOW, (address + size) // Mapper.CHR_WINDOW
+        offsets = list(range(offset, offset + size, Mapper.CHR_WINDOW))
+        if self._ppu_memory is not None:
+            if self._chr_offsets[first:last] == offsets:
+                return
+            self.catch_up()
+            self._chr_offsets[first:last] = offsets
+        self.tiles.map_chr(address, offset, size)
+        if self._ppu_memory is not None:
+            chr_memory = memoryview(self._chr_memory)
+            self._ppu_memory.map_chr(address, chr_memory[offset:offset + size], offset)
+
+    def set_mirroring(self, mirror_id):
+        """Switches the name table mirroring, see mirror.Mirroring."""
+        self.mirror_id = mirror_id
+        if self._ppu_memory is not None and self._ppu_memory.mirroring != mirror_id:
+            self.catch_up()
+            self._ppu_memory.set_mirroring(mirror_id)
 
     def read_prg(self, address):
         raise NotImplementedError
@@ -18,22 +132,39 @@ class Mapper:
     def write_prg(self, address, value):
         raise NotImplementedError
 
-    def read_chr(self, address):
-        raise NotImplementedError
+    def irq_clocks(self):
+        """Returns the number of clock_scan_line calls up to the one raising
+        the next IRQ, or None if none is coming."""
+        return None
 
-    def write_chr(self, address, value):
-        raise NotImplementedError
+    def prg_bank(self, address):
+        """Returns an identifier of the PRG ROM bank currently mapped at the
+        given CPU address."""
+        if address < 0x8000:
+            return 0
+        return self._prg_offsets[(address >> 13) & 3]
+
+    def flush_save(self):
+        """Writes the battery-backed PRG RAM to its save file, if any."""
+        self._cartridge.flush()
 
     @staticmethod
-    def from_nes_file(nesfile):
+    def from_nes_file(nesfile, save_file=None):
         """Create a Mapper and associeted Cartridge from a NES file. For more
-        info, see utility.py"""
+        info, see utility.py
+
+        The PRG RAM of the cartridges with a battery is mapped onto
+        save_file, by default the NES file with a .sav extension."""
         with open(nesfile, 'rb') as f:
             data = parse_nes_file(f)
         metadata = data[0]
         mapper_id, mirror_id = metadata['mapper_id'], metadata['mirror_id']
         klass = MAPPER_BY_ID[mapper_id] if mapper_id in MAPPER_BY_ID else Mapper
-        cartridge = Cartridge(*data[1:])
+        if metadata['battery']:
+            save_file = save_file or os.path.splitext(nesfile)[0] + '.sav'
+        else:
+            save_file = None
+        cartridge = Cartridge(*data[1:], save_file=save_file)
         return klass(cartridge, mirror_id)
 
 
@@ -48,34 +179,286 @@ class NROMMapper(Mapper):
         super().__init__(cartridge, mirror_id)
         self.is_nrom_128 = cartridge.prg_rom_size == 0x4000
 
+    def map_prg(self, memory):
+        self._cpu_memory = memory
+        self.map_prg_ram(memory)
+        # NROM-128 shows its 16kB twice
+        self.map_prg_rom(0x8000, 0, 0x8000)
+        memory.map_write_handler(0x8000, 0x8000, self.write_prg)
+
     def read_prg(self, address):
         # Careful, this spams...
         # log.debug('Reading PRG at %s', hex(address))
-        if address < 0x8000:
-            return self._cartridge.read_prg_ram(address - 0x6000)
+        pointer = address - 0x8000
+        if self.is_nrom_128:
+            return self._cartridge.read_prg_rom(pointer % 0x4000)
+        return self._cartridge.read_prg_rom(pointer)
+
+    def write_prg(self, address, value):
+        raise NotImplementedError("Trying to write prg at {}".format(hex(address)))
+
+
+class UxROMMapper(Mapper):
+    """UNROM / UOROM boards (mapper 2). Banks are as follows:
+        $6000 - $7FFF : PRG RAM
+        $8000 - $BFFF : PRG ROM, switchable 16kB bank
+        $C000 - $FFFF : PRG ROM, last 16kB bank
+    Writes to $8000 - $FFFF select the bank. CHR is not switchable.
+    """
+    STATE = ('bank',)
+
+    def __init__(self, cartridge, mirror_id):
+        super().__init__(cartridge, mirror_id)
+        self.bank = 0
+
+    def map_prg(self, memory):
+        self._cpu_memory = memory
+        self.map_prg_ram(memory)
+        self.map_prg_banks()
+        self.map_prg_rom(0xC000, -0x4000, 0x4000)
+        memory.map_write_handler(0x8000, 0x8000, self.write_prg)
+
+    def map_prg_banks(self):
+        self.map_prg_rom(0x8000, self.bank * 0x4000, 0x4000)
+
+    def write_prg(self, address, value):
+        self.bank = value
+        self.map_prg_banks()
+
+
+class CNROMMapper(NROMMapper):
+    """CNROM boards (mapper 3): NROM whose 8kB of CHR ROM are switched by
+    writes to $8000 - $FFFF.
+    """
+    STATE = ('chr_bank',)
+
+    def __init__(self, cartridge, mirror_id):
+        super().__init__(cartridge, mirror_id)
+        self.chr_bank = 0
+
+    def map_chr_banks(self):
+        self.map_chr(0x0000, self.chr_bank * 0x2000, 0x2000)
+
+    def write_prg(self, address, value):
+        self.chr_bank = value
+        self.map_chr_banks()
+
+
+class AxROMMapper(Mapper):
+    """AxROM boards (mapper 7). Banks are as follows:
+        $6000 - $7FFF : PRG RAM
+        $8000 - $FFFF : PRG ROM, switchable 32kB bank
+    Writes to $8000 - $FFFF select the bank (bits 0 - 2) and the name table
+    shown on the whole screen (bit 4). CHR is not switchable.
+    """
+    STATE = ('bank',)
+
+    def __init__(self, cartridge, mirror_id):
+        super().__init__(cartridge, Mirroring.single_screen_lower)
+        self.bank = 0
+
+    def map_prg(self, memory):
+        self._cpu_memory = memory
+        self.map_prg_ram(memory)
+        self.map_prg_banks()
+        memory.map_write_handler(0x8000, 0x8000, self.write_prg)
+
+    def map_prg_banks(self):
+        self.map_prg_rom(0x8000, self.bank * 0x8000, 0x8000)
+
+    def write_prg(self, address, value):
+        self.bank = value & 0x07
+        self.map_prg_banks()
+        self.set_mirroring(
+            Mirroring.single_screen_upper if value & 0x10 else Mirroring.single_screen_lower
+        )
+
+
+class MMC1Mapper(Mapper):
+    """SxROM boards (mapper 1). The MMC1 has four 5-bit registers, written
+    one bit at a time through a shift register: five writes to $8000 - $FFFF
+    fill it, the address of the last one selects the register.
+        $8000 - $9FFF : control (mirroring, PRG and CHR bank modes)
+        $A000 - $BFFF : CHR bank 0
+        $C000 - $DFFF : CHR bank 1
+        $E000 - $FFFF : PRG bank
+    A write with bit 7 set resets the shift register. PRG ROM is switched in
+    32kB, or in 16kB with the other half fixed to the first or last bank.
+    CHR is switched in 8kB or in two 4kB banks. Boards of 512kB of PRG ROM
+    (SUROM) select their 256kB half with bit 4 of CHR bank 0.
+    See https://wiki.nesdev.com/w/index.php/MMC1.
+    """
+    MIRRORINGS = [
+        Mirroring.single_screen_lower, Mirroring.single_screen_upper,
+        Mirroring.vertical, Mirroring.horizontal,
+    ]
+    STATE = ('shift', 'control', 'chr_bank_0', 'chr_bank_1', 'prg_register')
+
+    def __init__(self, cartridge, mirror_id):
+        super().__init__(cartridge, mirror_id)
+        # The set bit reaches bit 0 when the shift register is full
+        self.shift = 0x10
+        # PRG mode 3 at power on: the last bank is at $C000
+        self.control = 0x0C
+        self.chr_bank_0 = 0
+        self.chr_bank_1 = 0
+        self.prg_register = 0
+
+    def map_prg(self, memory):
+        self._cpu_memory = memory
+        self.map_prg_ram(memory)
+        self.map_prg_banks()
+        memory.map_write_handler(0x8000, 0x8000, self.write_prg)
+
+    def map_prg_banks(self):
+        bank = self.prg_register & 0x0F
+        outer = (self.chr_bank_0 & 0x10) << 14 if self._cartridge.prg_rom_size > 0x40000 else 0
+        mode = (self.control >> 2) & 0x3
+        if mode < 2:
+            self.map_prg_rom(0x8000, outer + (bank >> 1) * 0x8000, 0x8000)
+        elif mode == 2:
+            self.map_prg_rom(0x8000, outer, 0x4000)
+            self.map_prg_rom(0xC000, outer + bank * 0x4000, 0x4000)
         else:
-            pointer = address - 0x8000
-            if self.is_nrom_128:
-                return self._cartridge.read_prg_rom(pointer % 0x4000)
-            return self._cartridge.read_prg_rom(pointer)
+            self.map_prg_rom(0x8000, outer + bank * 0x4000, 0x4000)
+            self.map_prg_rom(0xC000, outer + 0x3C000, 0x4000)
+
+    def map_chr_banks(self):
+        if self.control & 0x10:
+            self.map_chr(0x0000, self.chr_bank_0 * 0x1000, 0x1000)
+            self.map_chr(0x1000, self.chr_bank_1 * 0x1000, 0x1000)
+        else:
+            self.map_chr(0x0000, (self.chr_bank_0 >> 1) * 0x2000, 0x2000)
 
     def write_prg(self, address, value):
-        if 0x6000 <= address < 0x8000:
-            self._cartridge.write_prg_ram(address - 0x6000)
+        if value & 0x80:
+            self.shift = 0x10
+            self.control |= 0x0C
+            self.map_prg_banks()
+            return
+        full = self.shift & 1
+        self.shift = (self.shift >> 1) | (value & 1) << 4
+        if not full:
+            return
+        value, self.shift = self.shift, 0x10
+        register = (address >> 13) & 0x3
+        if register == 0:
+            self.control = value
+            self.set_mirroring(MMC1Mapper.MIRRORINGS[value & 0x3])
+        elif register == 1:
+            self.chr_bank_0 = value
+        elif register == 2:
+            self.chr_bank_1 = value
         else:
-            raise NotImplementedError("Trying to write prg at {}".format(hex(address)))
+            self.prg_register = value
+        self.map_prg_banks()
+        self.map_chr_banks()
+
+
+class MMC3Mapper(Mapper):
+    """TxROM boards (mapper 4). Registers go by pairs of even and odd
+    addresses:
+        $8000 - $9FFE : bank select (register number, PRG and CHR modes)
+        $8001 - $9FFF : bank data of the selected register
+        $A000 - $BFFE : mirroring
+        $A001 - $BFFF : PRG RAM protection (not emulated)
+        $C000 - $DFFE : IRQ latch
+        $C001 - $DFFF : IRQ reload
+        $E000 - $FFFE : IRQ disable and acknowledge
+        $E001 - $FFFF : IRQ enable
+    Registers 0 - 5 select two 2kB and four 1kB CHR banks, swapped between
+    the two pattern tables by bit 7 of the bank select. Registers 6 and 7
+    select 8kB PRG banks at $8000 (or $C000, by bit 6 of the bank select)
+    and $A000, the other windows show the second last and last banks.
+
+    The scan line counter is reloaded from the latch when it is 0, and
+    decremented otherwise. It raises an IRQ when it becomes 0, if enabled.
+    See https://wiki.nesdev.com/w/index.php/MMC3.
+    """
+    STATE = ('bank_select', 'irq_latch', 'irq_counter', 'irq_reload', 'irq_enabled')
+    STATE_BUFFERS = ('registers',)
 
-    def read_chr(self, address):
-        return self._cartridge.read_chr_rom(address)
+    def __init__(self, cartridge, mirror_id):
+        super().__init__(cartridge, mirror_id)
+        self.bank_select = 0
+        self.registers = bytearray([0, 2, 4, 5, 6, 7, 0, 1])
+        self.irq_latch = 0
+        self.irq_counter = 0
+        self.irq_reload = False
+        self.irq_enabled = False
 
-    def write_chr(self, address, value):
-        return self._cartridge.write_chr_rom(address, value)
+    def map_prg(self, memory):
+        self._cpu_memory = memory
+        self.map_prg_ram(memory)
+        self.map_prg_banks()
+        memory.map_write_handler(0x8000, 0x8000, self.write_prg)
+
+    def map_prg_banks(self):
+        swapped = 0x4000 if self.bank_select & 0x40 else 0
+        self.map_prg_rom(0x8000 ^ swapped, self.registers[6] * 0x2000, 0x2000)
+        self.map_prg_rom(0xA000, self.registers[7] * 0x2000, 0x2000)
+        self.map_prg_rom(0xC000 ^ swapped, -0x4000, 0x2000)
+        self.map_prg_rom(0xE000, -0x2000, 0x2000)
+
+    def map_chr_banks(self):
+        inverted = 0x1000 if self.bank_select & 0x80 else 0
+        for i in range(2):
+            self.map_chr((i * 0x800) ^ inverted, (self.registers[i] & 0xFE) * 0x400, 0x800)
+        for i in range(4):
+            self.map_chr((0x1000 + i * 0x400) ^ inverted, self.registers[2 + i] * 0x400, 0x400)
+
+    def write_prg(self, address, value):
+        odd = address & 1
+        if address < 0xA000:
+            if odd:
+                self.registers[self.bank_select & 0x7] = value
+            else:
+                self.bank_select = value
+            self.map_prg_banks()
+            self.map_chr_banks()
+        elif address < 0xC000:
+            if not odd and self.mirror_id != Mirroring.four_screen:
+                self.set_mirroring(Mirroring.horizontal if value & 1 else Mirroring.vertical)
+        else:
+            # Run the counter up to now with the old registers
+            self.catch_up()
+            if address < 0xE000:
+                if odd:
+                    self.irq_counter = 0
+                    self.irq_reload = True
+                else:
+                    self.irq_latch = value
+            else:
+                self.irq_enabled = bool(odd)
+                if not odd:
+                    self.acknowledge_irq()
+            # Not redundant: there is no debt left to run, but the deadline
+            # computed above is for the old registers, and the next IRQ may
+            # now come before it
+            self.catch_up()
+
+    def clock_scan_line(self):
+        if self.irq_counter == 0 or self.irq_reload:
+            self.irq_counter = self.irq_latch
+            self.irq_reload = False
+        else:
+            self.irq_counter -= 1
+        return self.irq_enabled and self.irq_counter == 0
+
+    def irq_clocks(self):
+        if not self.irq_enabled:
+            return None
+        if self.irq_counter == 0 or self.irq_reload:
+            return self.irq_latch + 1
+        return self.irq_counter
 
 
 # Map of supported Mappers. See https://wiki.nesdev.com/w/index.php/Mapper.
 MAPPER_BY_ID = {
     0: NROMMapper,
+    1: MMC1Mapper,
+    2: UxROMMapper,
+    3: CNROMMapper,
+    4: MMC3Mapper,
+    7: AxROMMapper,
 }
-
-
-
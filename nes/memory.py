@@ -2,7 +2,7 @@ import numpy as np
 import pdb
 import logging
 
-from nes.mirror import mirrored_address
+from nes.mirror import TABLE_SIZE, mirror_map
 
 
 log = logging.getLogger('nes.' + __name__)
@@ -18,6 +18,13 @@ class PPUMemoryError(MemError):
     """Raise on PPUMemory Error"""
 
 
+def as_array(buffer):
+    """Returns a zero-copy NumPy view of the given bytearray (or memoryview),
+    for bulk operations. Single byte accesses should go through the buffer
+    itself, which returns Python ints."""
+    return np.frombuffer(buffer, dtype='uint8')
+
+
 class CPUMemory(object):
     """CPU Memory structure:
         $0000
@@ -42,91 +49,269 @@ class CPUMemory(object):
         $10000
     """
     RAM_SIZE = 0x0800
+    PAGE_SIZE = 0x0100
+    PAGE_COUNT = 0x0100
 
     def __init__(self, console):
-        self._RAM = np.zeros(CPUMemory.RAM_SIZE, dtype='uint8')
+        self._RAM = bytearray(CPUMemory.RAM_SIZE)
         self._console = console
+        # Page tables: for each of the 256 pages of the address space, an
+        # object indexed by the 8 lowest bits of the address. It is either a
+        # view on a buffer (RAM, cartridge memory) or an _IOPage.
+        self._read_pages = [None] * CPUMemory.PAGE_COUNT
+        self._write_pages = [None] * CPUMemory.PAGE_COUNT
+        # Address in the host memory of each page mapped on a buffer, which
+        # tells mirrors apart
+        self._page_origins = [None] * CPUMemory.PAGE_COUNT
+        # Write watches, by page origin, see watch_writes
+        self._watches = {}
+        # Base addresses of the mirrors of each page, computed on demand
+        self._mirror_bases = {}
+        # Called with (address, size) when pages are remapped
+        self.remap_callback = None
+
+    def power_on(self):
+        """Builds the page tables. The PRG pages are installed by the mapper,
+        which keeps them up to date when switching banks."""
+        # 2kb, mirrored 4 times
+        for address in range(0x0000, 0x2000, CPUMemory.RAM_SIZE):
+            self.map_buffer(address, memoryview(self._RAM), writable=True)
+        # PPU registers are mirrored every 8 bytes
+        # e.g. address 0x3210 => 0x3210 % 8 = 0 => read 0x2000
+        self.map_handlers(0x2000, 0x2000, self._read_ppu, self._write_ppu)
+        self.map_handlers(0x4000, 0x1000, self._read_io, self._write_io)
+        # TODO: implement expansion modules
+        self.map_handlers(0x5000, 0x1000, self._read_expansion, self._write_expansion)
+        self._console.mapper.map_prg(self)
 
     def reset(self):
-        self._RAM = np.zeros(CPUMemory.RAM_SIZE, dtype='uint8')
+        self._RAM[:] = bytes(CPUMemory.RAM_SIZE)
+        for address in range(0x0000, 0x2000, CPUMemory.RAM_SIZE):
+            self._remapped(address, CPUMemory.RAM_SIZE)
 
-    def read(self, address):
-        if address <= 0x1FFF:
-            # 2kb, mirrored 4 times
-            return self._RAM[address % 0x800]
-        elif address <= 0x3FFF:
-            # PPU registers are mirrored every 8 bytes
-            # e.g. address 0x3210 => 0x3210 % 8 = 0 => read 0x2000
-            return self._console.ppu.read_register(0x2000 + address % 8)
-        elif address == 0x4014:
-            return self._console.ppu.read_register(address)
-        elif address <= 0x4FFF:
-            return self._console.apu.read_register(address)
-        elif address <= 0x5FFF:
-            # TODO: implement expansion modules
-            raise NotImplementedError(
-                'Read not implemented at address={}'.format(hex(address))
+    def map_buffer(self, address, buffer, writable=False):
+        """Maps the given buffer (a memoryview of a whole number of pages) at
+        address."""
+        size = CPUMemory.PAGE_SIZE
+        first_page = address >> 8
+        count = len(buffer) // size
+        views = [buffer[i * size:(i + 1) * size] for i in range(count)]
+        origin = as_array(buffer).ctypes.data
+        self._read_pages[first_page:first_page + count] = views
+        self._page_origins[first_page:first_page + count] = range(origin, origin + count * size, size)
+        if writable:
+            for i, view in enumerate(views):
+                callback = self._watches.get(origin + i * size)
+                if callback is not None:
+                    view = _WatchedPage(view, (first_page + i) << 8, callback)
+                self._write_pages[first_page + i] = view
+        self._remapped(address, len(buffer))
+
+    def map_handlers(self, address, size, read, write):
+        """Maps size bytes at address to the given read(address) and
+        write(address, value) functions."""
+        first_page = address >> 8
+        for i in range(size // CPUMemory.PAGE_SIZE):
+            page = _IOPage((first_page + i) << 8, read, write)
+            self._read_pages[first_page + i] = page
+            self._write_pages[first_page + i] = page
+            self._page_origins[first_page + i] = None
+        self._remapped(address, size)
+
+    def map_write_handler(self, address, size, write):
+        """Maps the writes of size bytes at address to the given
+        write(address, value) function, leaving reads untouched."""
+        first_page = address >> 8
+        for i in range(size // CPUMemory.PAGE_SIZE):
+            self._write_pages[first_page + i] = _IOPage(
+                (first_page + i) << 8, self._read_unmapped, write
             )
-        elif address <= 0xFFFF:
-            return self._console.mapper.read_prg(address)
-        else:
+
+    def _remapped(self, address, size):
+        self._mirror_bases = {}
+        if self.remap_callback is not None:
+            self.remap_callback(address, size)
+
+    def is_buffer_page(self, page):
+        """Returns whether reads of the given page number hit a buffer, whose
+        content can only change through writes (or remapping)."""
+        return self._page_origins[page] is not None
+
+    def mirrors(self, address):
+        """Returns the addresses mapped on the same byte as address, itself
+        included."""
+        bases = self._mirror_bases.get(address >> 8)
+        if bases is None:
+            origin = self._page_origins[address >> 8]
+            bases = self._mirror_bases[address >> 8] = [
+                page << 8 for page, page_origin in enumerate(self._page_origins)
+                if page_origin is not None and page_origin == origin
+            ] or [address & 0xFF00]
+        offset = address & 0xFF
+        return [base | offset for base in bases]
+
+    def watch_writes(self, page, callback):
+        """Calls callback(address) after each write to the memory mapped at the
+        given page number, through that page or any of its mirrors. Does
+        nothing if the page is not writable."""
+        origin = self._page_origins[page]
+        if origin is None or origin in self._watches:
+            return
+        if not isinstance(self._write_pages[page], memoryview):
+            return
+        self._watches[origin] = callback
+        for mirror, mirror_origin in enumerate(self._page_origins):
+            view = self._write_pages[mirror]
+            if mirror_origin == origin and isinstance(view, memoryview):
+                self._write_pages[mirror] = _WatchedPage(view, mirror << 8, callback)
+
+    def read(self, address):
+        try:
+            return self._read_pages[address >> 8][address & 0xFF]
+        except IndexError:
             raise CPUMemoryError('Unknown address: {}'.format(hex(address)))
 
     def read_page(self, address):
-        if address <= 0x1F:
-            address_begin = (address % 0x800) << 8
-            address_end = address_begin | 0x00FF
-            data = self._RAM[address_begin:address_end + 1]
-            return data
-        elif address <= 0x3F:
-            raise NotImplementedError(
-                'You should not read a page of PPU registers'
-            )
-        elif address <= 0x4F:
-            raise NotImplementedError(
-                'You should not read a page at address={}'.format(hex(address))
-            )
-        elif address <= 0x5F:
-            raise NotImplementedError(
-                'You should not read a page at address={}'.format(hex(address))
-            )
-        elif address <= 0xFF:
-            raise NotImplementedError(
-                'We need a way to batch read from the cartdrige at address={}'.format(hex(address))
-            )
-        else:
+        page = self._read_pages[address]
+        if isinstance(page, _IOPage):
             raise NotImplementedError(
                 'You should not read a page at address={}'.format(hex(address))
             )
+        return page
 
+    def write(self, address, value):
+        try:
+            self._write_pages[address >> 8][address & 0xFF] = value
+        except IndexError:
+            raise CPUMemoryError('Unknown address: {}'.format(hex(address)))
 
+    def _read_ppu(self, address):
+        self._console.catch_up()
+        return self._console.ppu.read_register(0x2000 + address % 8)
 
-    def write(self, address, value):
-        if address < 0x2000:
-            self._RAM[address % 0x800] = value
-        elif address < 0x4000:
-            # PPU registers are mirrored every 8 bytes
-            # e.g. address 0x3210 => 0x3210 % 8 = 0 => write 0x2000
-            self._console.ppu.write_register(0x2000 + address % 8, value)
-        elif address == 0x4014:
+    def _write_ppu(self, address, value):
+        self._console.catch_up()
+        self._console.ppu.write_register(0x2000 + address % 8, value)
+        # The write may have scheduled an NMI
+        self._console.catch_up()
+
+    def _read_io(self, address):
+        if address == 0x4014:
+            self._console.catch_up()
+            return self._console.ppu.read_register(address)
+        return self._console.apu.read_register(address)
+
+    def _write_io(self, address, value):
+        if address == 0x4014:
+            self._console.catch_up()
             self._console.ppu.write_register(address, value)
-        elif address < 0x5000:
-            self._console.apu.write_register(address, value)
-        elif address < 0x6000:
-            # TODO: implement expansion modules
-            raise NotImplementedError(
-                'Read not implemented at address={}'.format(hex(address))
-            )
-        elif address < 0x10000:
-            self._console.mapper.write_prg(address, value)
         else:
-            raise CPUMemoryError('Unknown address: {}'.format(hex(address)))
+            self._console.apu.write_register(address, value)
+
+    def _read_expansion(self, address):
+        raise NotImplementedError(
+            'Read not implemented at address={}'.format(hex(address))
+        )
+
+    def _write_expansion(self, address, value):
+        raise NotImplementedError(
+            'Write not implemented at address={}'.format(hex(address))
+        )
+
+    def _read_unmapped(self, address):
+        raise CPUMemoryError('Unknown address: {}'.format(hex(address)))
 
     @staticmethod
     def get_stack_address(address):
         return 0x1A0 | address
 
 
+class FlatMemory(object):
+    """Plain 64kB of RAM, without any I/O or mirroring, to run the CPU alone
+    (e.g. on 6502 test images): CPU(None, memory=FlatMemory(data)).
+
+    The stack is at $0100-$01FF as on a stock 6502.
+    """
+    SIZE = 0x10000
+
+    def __init__(self, data=b''):
+        self._data = bytearray(FlatMemory.SIZE)
+        self._data[:len(data)] = data
+        # Callback of each page watched by watch_writes, or None
+        self._watches = [None] * CPUMemory.PAGE_COUNT
+        self.remap_callback = None
+
+    def read(self, address):
+        return self._data[address]
+
+    def write(self, address, value):
+        self._data[address] = value
+        callback = self._watches[address >> 8]
+        if callback is not None:
+            callback(address)
+
+    def read_page(self, address):
+        return memoryview(self._data)[address << 8:(address + 1) << 8]
+
+    def is_buffer_page(self, page):
+        return True
+
+    def mirrors(self, address):
+        return [address]
+
+    def watch_writes(self, page, callback):
+        self._watches[page] = callback
+
+    @staticmethod
+    def get_stack_address(address):
+        return 0x100 | address
+
+
+class _IOPage:
+    """Page of the CPU address space handled by functions (I/O registers,
+    mapper registers...). Indexed like the buffer views of the page table."""
+    __slots__ = ('_base', '_read', '_write')
+
+    def __init__(self, base, read, write):
+        self._base = base
+        self._read = read
+        self._write = write
+
+    def __getitem__(self, offset):
+        return self._read(self._base | offset)
+
+    def __setitem__(self, offset, value):
+        self._write(self._base | offset, value)
+
+
+class _WatchedPage:
+    """Writable page of the CPU address space calling a function after each
+    write, see CPUMemory.watch_writes."""
+    __slots__ = ('_view', '_base', '_callback')
+
+    def __init__(self, view, base, callback):
+        self._view = view
+        self._base = base
+        self._callback = callback
+
+    def __getitem__(self, offset):
+        return self._view[offset]
+
+    def __setitem__(self, offset, value):
+        self._view[offset] = value
+        self._callback(self._base | offset)
+
+
+# Index of the palette entry read at each of the addresses $3F00 - $3FFF: the
+# palette is mirrored every 32 bytes, and the sprite background colors mirror
+# the background ones
+_PALETTE_INDEXES = [
+    pointer % 32 - 16 if pointer % 32 >= 16 and pointer % 4 == 0 else pointer % 32
+    for pointer in range(0x100)
+]
+_PALETTE_MIRRORS = np.array(_PALETTE_INDEXES[:0x20])
+
+
 class PPUMemory:
     """PPU Memory structure:
     $0000
@@ -134,48 +319,124 @@ class PPUMemory:
     $2000
         (Name table (30 * 32) + Attribut table (64)) * 4
     $3000
-        Empty
+        Mirror of $2000 - $2EFF
     $3F00
         Image Palette
     $3F10
         Sprite Palette
     $3F20
-        Empty
+        Mirrors of $3F00 - $3F1F
     $4000
     """
     # Includes both sprite and image palette
     PALETTE_SIZE = 0x0020
     NAME_TABLE_SIZE = 0x1000
+    PAGE_SIZE = 0x0100
+    PAGE_COUNT = 0x0040
 
     def __init__(self, console):
         self._console =  console
-        self._palette = np.zeros(PPUMemory.PALETTE_SIZE, dtype='uint8')
-        self._name_table = np.zeros(PPUMemory.NAME_TABLE_SIZE, dtype='uint8')
+        self._palette = bytearray(PPUMemory.PALETTE_SIZE)
+        self._name_table = bytearray(PPUMemory.NAME_TABLE_SIZE)
+        # Page tables: for each of the 64 pages of the address space, an
+        # object indexed by the 8 lowest bits of the address: a view of the
+        # CHR memory or of the VRAM, or the palette page
+        self._read_pages = [None] * PPUMemory.PAGE_COUNT
+        self._write_pages = [None] * PPUMemory.PAGE_COUNT
+        palette = _PalettePage(self._palette)
+        self._read_pages[0x3F] = self._write_pages[0x3F] = palette
+        # Offsets in _name_table of the tables shown at $2000, $2400, $2800
+        # and $2C00, see set_mirroring
+        self.name_table_offsets = [0] * 4
+        self.mirroring = None
+        # Offsets in _name_table written to, see watch_name_tables
+        self.name_table_writes = None
+
+    def power_on(self):
+        """Lets the mapper install the pattern tables and name tables, it
+        keeps them up to date when switching CHR banks or the mirroring."""
+        self._console.mapper.map_ppu(self)
+
+    def map_chr(self, address, buffer, offset):
+        """Maps the given view of the CHR memory (a whole number of pages),
+        starting at offset in it, at the given pattern table address. Writes
+        are reported to the tile cache."""
+        first_page = address >> 8
+        invalidate = self.tiles.invalidate
+        for i in range(len(buffer) // PPUMemory.PAGE_SIZE):
+            view = buffer[i * PPUMemory.PAGE_SIZE:(i + 1) * PPUMemory.PAGE_SIZE]
+            self._read_pages[first_page + i] = view
+            self._write_pages[first_page + i] = _WatchedPage(
+                view, offset + i * PPUMemory.PAGE_SIZE, invalidate
+            )
+
+    def set_mirroring(self, mirroring):
+        """Shows the 1kB tables of VRAM given by the mirroring (see
+        mirror.Mirroring) at the four name table positions, and their mirrors
+        at $3000 - $3EFF."""
+        name_table = memoryview(self._name_table)
+        self.name_table_offsets = [table * TABLE_SIZE for table in mirror_map(mirroring)]
+        self.mirroring = mirroring
+        for page in range(0x20, 0x3F):
+            offset = self.name_table_offsets[(page >> 2) & 0x3] | (page & 0x3) << 8
+            view = name_table[offset:offset + PPUMemory.PAGE_SIZE]
+            self._read_pages[page] = view
+            if self.name_table_writes is not None:
+                view = _WatchedPage(view, offset, self.name_table_writes.add)
+            self._write_pages[page] = view
+
+    def watch_name_tables(self):
+        """Starts recording the offsets in VRAM written to, in
+        name_table_writes (e.g. for background.py)."""
+        if self.name_table_writes is None:
+            self.name_table_writes = set()
+            if self.mirroring is not None:
+                self.set_mirroring(self.mirroring)
 
     def read(self, address):
-        if address < 0x2000:
-            return self._console.mapper.read_chr(address)
-        elif address < 0x3000:
-            mirroring = self._console.mapper.mirror_id
-            return self._name_table[mirrored_address(address, mirroring) - 0x2000]
-        elif 0x3F00 <= address < 0x4000:
-            pointer = address % 32
-            if pointer >= 16 and pointer % 4 == 0:
-                pointer -= 16
-            return self._palette[pointer]
-        else:
+        try:
+            return self._read_pages[address >> 8][address & 0xFF]
+        except (IndexError, TypeError):
             raise PPUMemoryError('Unknown address: {}'.format(hex(address)))
 
+    @property
+    def tiles(self):
+        """Decoded tiles of the pattern tables, see tiles.py."""
+        return self._console.mapper.tiles
+
+    def palette_table(self):
+        """Returns the 32 palette entries as read at $3F00 - $3F1F, in a NumPy
+        array."""
+        palette = np.frombuffer(self._palette, dtype='uint8')
+        return palette[_PALETTE_MIRRORS]
+
+    def name_table_row(self, address):
+        """Returns the 32 tile indexes of the name table row starting at
+        address ($2000 - $2FFF), and the 8 attribute bytes covering it, as
+        NumPy views."""
+        row = self.name_table_offsets[(address >> 10) & 0x3] | address & 0x3FF
+        table = row & 0xC00
+        attributes = table | 0x3C0 | (row >> 4) & 0x38
+        name_table = np.frombuffer(self._name_table, dtype='uint8')
+        return name_table[row:row + 32], name_table[attributes:attributes + 8]
+
     def write(self, address, value):
-        if address < 0x2000:
-            self._console.mapper.write_chr(address, value)
-        elif address < 0x3000:
-            mirroring = self._console.mapper.mirror_id
-            self._name_table[mirrored_address(address, mirroring) - 0x2000] = value
-        elif 0x3F00 <= address < 0x4000:
-            pointer = address % 32
-            if pointer >= 16 and pointer % 4 == 0:
-                pointer -= 16
-            self._palette[pointer] = value
-        else:
+        try:
+            self._write_pages[address >> 8][address & 0xFF] = value
+        except (IndexError, TypeError):
             raise PPUMemoryError('Unknown address: {}'.format(hex(address)))
+
+
+class _PalettePage:
+    """Page $3F00 - $3FFF of the PPU address space, indexed like the views
+    of the other pages, with the palette mirrors folded in."""
+    __slots__ = ('_palette',)
+
+    def __init__(self, palette):
+        self._palette = palette
+
+    def __getitem__(self, offset):
+        return self._palette[_PALETTE_INDEXES[offset]]
+
+    def __setitem__(self, offset, value):
+        self._palette[_PALETTE_INDEXES[offset]] = value
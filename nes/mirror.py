@@ -3,25 +3,29 @@ from enum import IntEnum
 
 # Size of one name table (including its attribute table)
 TABLE_SIZE = 0x0400
-# Corresponds to the 0 of the name tables
-OFFSET = 0x2000
 
 
 class Mirroring(IntEnum):
     """Controls the mirroring for the PPU nametables."""
     horizontal = 0
     vertical = 1
+    single_screen_lower = 2
+    single_screen_upper = 3
+    four_screen = 4
 
 def mirror_map(mirroring):
+    """Returns the table of the 4kB of VRAM shown at each of the four name
+    table positions ($2000, $2400, $2800, $2C00)."""
     if mirroring == Mirroring.horizontal:
         # Then table 1 = table 0 and table 3 = table 2
         return [0, 0, 2, 2]
     if mirroring == Mirroring.vertical:
         # Then table 3 == table 0 and table 3 == table 1
         return [0, 1, 0, 1]
-
-def mirrored_address(address, mirroring):
-    pointer = address - OFFSET
-    table_number, r = pointer // TABLE_SIZE, pointer % TABLE_SIZE
-    return OFFSET + mirror_map(mirroring)[table_number] * TABLE_SIZE + r
-
+    if mirroring == Mirroring.single_screen_lower:
+        return [0, 0, 0, 0]
+    if mirroring == Mirroring.single_screen_upper:
+        return [1, 1, 1, 1]
+    if mirroring == Mirroring.four_screen:
+        # The cartridge provides the memory of tables 2 and 3
+        return [0, 1, 2, 3]
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 COLORS = [
 		0x666666, 0x002A88, 0x1412A7, 0x3B00A4, 0x5C007E, 0x6E0040, 0x6C0600, 0x561D00,
 		0x333500, 0x0B4800, 0x005200, 0x004F08, 0x00404D, 0x000000, 0x000000, 0x000000,
@@ -12,3 +15,18 @@ COLORS = [
 PALETTE = [
     ((c >> 16) & 0xFF, (c >> 8) & 0xFF, c & 0xFF, 0xFF) for c in COLORS
 ]
+
+# Lookup tables from the 6-bit palette indexes, see to_rgb and to_rgba
+RGBA = np.array(PALETTE, dtype='uint8')
+RGB = np.ascontiguousarray(RGBA[:, :3])
+
+
+def to_rgb(indexes, out=None):
+    """Converts an array of palette indexes (e.g. a frame from
+    PPU.frame_buffer) to RGB, in a single lookup."""
+    return np.take(RGB, indexes, axis=0, out=out)
+
+
+def to_rgba(indexes, out=None):
+    """Same as to_rgb, to RGBA."""
+    return np.take(RGBA, indexes, axis=0, out=out)
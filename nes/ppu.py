@@ -1,11 +1,39 @@
 import numpy as np
-from nes.memory import PPUMemory
+from enum import IntEnum
+from nes.memory import PPUMemory, as_array
 import logging
-from nes.palette import PALETTE
+from nes.palette import to_rgb, to_rgba
 
 
 log = logging.getLogger('nes.' + __name__)
 
+# Shift of the palette of each tile of a name table row in its attribute byte,
+# for even coarse Y scrolls (see PPU.fetch_attribute_table_byte)
+_ATTRIBUTE_SHIFTS = np.array([0, 0, 2, 2] * 8, dtype='uint8')
+
+
+def _tile_row_table():
+    """Returns the 8 2-bit pixels of a tile row, packed on 4 bits each (the
+    leftmost pixel in the highest bits, see PPU.load_background_data), for
+    each (higher tile byte << 8 | lower tile byte)."""
+    index = np.arange(0x10000)
+    low, high = index & 0xFF, index >> 8
+    data = np.zeros(0x10000, dtype='int64')
+    for bit in range(8):
+        data |= ((low >> bit) & 1 | ((high >> bit) & 1) << 1) << 4 * bit
+    return data.tolist()
+
+
+_TILE_ROWS = _tile_row_table()
+
+
+class RenderLevel(IntEnum):
+    """What the PPU produces for each rendered frame."""
+    none = 0      # Nothing, only the state the CPU can observe is updated
+    indices = 1   # Palette indexes, in PPU.frame_buffer
+    rgb = 2       # Palette indexes, and RGB colors in PPU.rgb_frame_buffer
+
+
 class PPUError(Exception):
     """Base error class"""
 
@@ -19,7 +47,8 @@ class PPURegisterError(PPUError):
 
 class Register:
     def read(self):
-        return '-1'
+        # Write only register: return the value left on the bus
+        return self.ppu.latch_value
         # raise PPURegisterError('Read is not supported.', self)
 
     def write(self, value):
@@ -92,15 +121,20 @@ class PPUSTATUS(Register):
         self.sprite_zero_flag = 0
         self.vertical_blank_started_flag = 0
 
-    def read(self):
+    def peek(self):
+        """Returns the value read() would return, without side effects."""
         val = self.vertical_blank_started_flag << 7
         val |= self.sprite_zero_flag << 6
         val |= self.sprite_overflow_flag << 5
         if self.ppu.nmi_occured:
             val |= 1 << 7
+        val |= self.ppu.latch_value & 0x00011111
+        return val
+
+    def read(self):
+        val = self.peek()
         self.ppu.nmi_occured = False
         self.ppu.nmi_change()
-        val |= self.ppu.latch_value & 0x00011111
 
         # Should start an NMI interrupt
         self.vertical_blank_started_flag = False
@@ -129,7 +163,14 @@ class OAMDATA(Register):
     """
     def __init__(self, ppu):
         self.ppu = ppu
-        self.data = np.zeros(256, dtype='uint8')
+        self.data = bytearray(256)
+        # NumPy view of data, for bulk operations
+        self.array = as_array(self.data)
+        # Sprites shown on each line, see visible_sprites. Rebuilt when OAM
+        # changes.
+        self._visible = None
+        self._overflows = None
+        self._height = 0
 
     def read(self):
         oam_address = self.ppu.OAMADDR.address
@@ -139,9 +180,31 @@ class OAMDATA(Register):
         oam_address = self.ppu.OAMADDR.address
         self.data[oam_address] = value
         self.ppu.OAMADDR.increment()
+        self._visible = None
 
     def upload_from_cpu(self, data):
-        self.data = data
+        self.data[:] = data
+        self._visible = None
+
+    def invalidate(self):
+        """Drops the sprite index, after data was written directly."""
+        self._visible = None
+
+    def visible_sprites(self, scan_line, height):
+        """Returns the indexes of the (up to 8) first sprites of the given
+        height showing on the given line, and whether more sprites show
+        there.
+        """
+        if self._visible is None or self._height != height:
+            # rows[line, i]: row of the sprite i shown on that line
+            lines = np.arange(PPU.PRE_RENDER_SCAN_LINE + 1)[:, np.newaxis]
+            rows = lines - self.array[0::4].astype(int)
+            visible = (rows >= 0) & (rows < height)
+            counts = visible.cumsum(axis=1)
+            self._visible = visible & (counts <= 8)
+            self._overflows = counts[:, -1] > 8
+            self._height = height
+        return np.flatnonzero(self._visible[scan_line]), self._overflows[scan_line]
 
 
 class PPUSCROLL(Register):
@@ -228,6 +291,11 @@ class PPU:
     VISIBLE_CLOCK_CYCLE = 256
     PRE_RENDER_SCAN_LINE = 261
     POST_RENDER_SCAN_LINE = 240
+    WIDTH = 256
+    HEIGHT = 240
+    # Flags of the sprite line pixels
+    SPRITE_BEHIND = 0x20
+    SPRITE_ZERO = 0x40
 
     def __init__(self, console):
         self.memory = PPUMemory(console)
@@ -271,20 +339,37 @@ class PPU:
         self.scan_line = 0
         self.is_even_screen = True
         self.frame = 0 # frame counter
+        # Palette index of each rendered pixel, row by row
+        self._frame_buffer = bytearray(PPU.WIDTH * PPU.HEIGHT)
+        self.frame_buffer = as_array(self._frame_buffer).reshape(PPU.HEIGHT, PPU.WIDTH)
+        # Pre-rendered name tables used by render_line, see background.py
+        self.background_layer = None
+        # Frames are rendered up to render_level, one in frameskip + 1. The
+        # other ones only update PPUSTATUS and the NMI timing.
+        self.render_level = RenderLevel.indices
+        self.frameskip = 0
+        # Scan line counter of the mapper, see clock_scan_line_counter
+        self.scan_line_counter = None
+        # Called at the end of each frame, when the vertical blank starts
+        self.frame_callback = None
+        self.rgb_frame_buffer = np.zeros((PPU.HEIGHT, PPU.WIDTH, 3), dtype='uint8')
 
         # BACKGROUND TEMP VARS
         self.name_table_byte = 0
         self.attribute_table_byte = 0
-        self.lower_tile_byte = 0
-        self.higher_tile_byte = 0
+        self.low_tile_byte = 0
+        self.high_tile_byte = 0
         self.background_data = 0 # 64 bits!
 
         # SPRITE TEMP VARS
         self.sprite_count = 0
-        self.sprite_graphics = np.zeros(8, dtype='uint32')
-        self.sprite_positions = np.zeros(8, dtype='uint8')
-        self.sprite_priorities = np.zeros(8, dtype='uint8')
-        self.sprite_indexes = np.zeros(8, dtype='uint8')
+        # Sprite pixel at each X position of the current line (0 if none):
+        # its palette address ($3F00 + address) in the 5 lowest bits, and
+        # the SPRITE_BEHIND and SPRITE_ZERO flags
+        self._sprite_line = bytearray(PPU.WIDTH)
+        self.sprite_line = as_array(self._sprite_line)
+        # Whether sprite 0 is in the sprite line buffer
+        self.sprite_zero_line = False
 
     def reset(self):
         self.clock = 340
@@ -320,6 +405,88 @@ class PPU:
                 self.is_even_screen = not self.is_even_screen
 
 
+    def dots_until(self, scan_line, clock):
+        """Returns the number of calls to step() until the PPU reaches the
+        given position, the step reaching it included.
+        """
+        frame_dots = PPU.CLOCK_CYCLE * (PPU.PRE_RENDER_SCAN_LINE + 1)
+        position = self.scan_line * PPU.CLOCK_CYCLE + self.clock
+        target = scan_line * PPU.CLOCK_CYCLE + clock
+        if target > position:
+            return target - position
+        dots = frame_dots - position + target
+        rendering_enabled = self.PPUMASK.background_flag or self.PPUMASK.sprites_flag
+        skip_position = PPU.PRE_RENDER_SCAN_LINE * PPU.CLOCK_CYCLE + 339
+        if rendering_enabled and not self.is_even_screen and position <= skip_position:
+            # Odd frames skip the last clock of the prerender line
+            dots -= 1
+        return dots
+
+    def idle_dots(self):
+        """Returns the number of next calls to step() that only move the PPU
+        forward: all of them when rendering is disabled, the ones of the
+        vertical blank otherwise. Stops before the steps changing the vertical
+        blank flag or raising an NMI.
+        """
+        rendering_enabled = self.PPUMASK.background_flag or self.PPUMASK.sprites_flag
+        if rendering_enabled:
+            # From the vertical blank flag set to the start of the prerender line
+            position = self.scan_line * PPU.CLOCK_CYCLE + self.clock
+            if not PPU.POST_RENDER_SCAN_LINE * PPU.CLOCK_CYCLE < position \
+                    <= PPU.PRE_RENDER_SCAN_LINE * PPU.CLOCK_CYCLE:
+                return 0
+            dots = self.dots_until(PPU.PRE_RENDER_SCAN_LINE, 1) - 1
+        else:
+            dots = min(
+                self.dots_until(PPU.POST_RENDER_SCAN_LINE, 1),
+                self.dots_until(PPU.PRE_RENDER_SCAN_LINE, 1),
+            ) - 1
+        if self.nmi_delay > 0:
+            dots = min(dots, self.nmi_delay - 1)
+        return dots
+
+    def skip(self, dots):
+        """Calls step() dots times, computing the new position directly. At
+        most idle_dots() steps can be skipped."""
+        if self.nmi_delay > 0:
+            self.nmi_delay -= dots
+        position = self.scan_line * PPU.CLOCK_CYCLE + self.clock + dots
+        frames, position = divmod(position, PPU.CLOCK_CYCLE * (PPU.PRE_RENDER_SCAN_LINE + 1))
+        self.scan_line, self.clock = divmod(position, PPU.CLOCK_CYCLE)
+        self.frame += frames
+        if frames % 2:
+            self.is_even_screen = not self.is_even_screen
+
+    def clock_scan_line_counter(self):
+        """Clocks the scan line counter of the mapper, at clock 257 of the
+        lines fetching tiles with rendering enabled, and raises the IRQ it
+        may request. Boards like the MMC3 count the rises of the PPU address
+        line A12 when the sprite tiles are fetched: only the resulting clock
+        per line is emulated, instead of watching every PPU memory access."""
+        if self.scan_line_counter():
+            self.cpu.triggerIRQ()
+
+    def dots_until_counter(self, clocks):
+        """Returns the number of calls to step() until the scan line counter
+        is clocked for the clocks-th time, that step included, if rendering
+        stays enabled. Can be early by a dot per frame after the first one.
+        """
+        fetch_lines = PPU.POST_RENDER_SCAN_LINE + 1
+        # Index of the next clocked line, counting from line 0 with the
+        # prerender line last
+        if self.scan_line < PPU.POST_RENDER_SCAN_LINE:
+            index = self.scan_line + (self.clock >= 257)
+        elif self.scan_line == PPU.PRE_RENDER_SCAN_LINE:
+            index = PPU.POST_RENDER_SCAN_LINE + (self.clock >= 257)
+        else:
+            index = PPU.POST_RENDER_SCAN_LINE
+        scan_line = (index + clocks - 1) % fetch_lines
+        if scan_line == PPU.POST_RENDER_SCAN_LINE:
+            scan_line = PPU.PRE_RENDER_SCAN_LINE
+        frames = (clocks - 1) // fetch_lines
+        frame_dots = PPU.CLOCK_CYCLE * (PPU.PRE_RENDER_SCAN_LINE + 1)
+        return self.dots_until(scan_line, 257) + frames * (frame_dots - 1)
+
     def nmi_change(self):
         nmi = self.PPUCTRL.nmi_flag and self.nmi_occured
         if nmi and not self.nmi_previous:
@@ -334,37 +501,184 @@ class PPU:
         self.nmi_occured = False
         self.nmi_change()
 
+    def renders_frame(self, frame):
+        """Returns whether the given frame produces pixels."""
+        return self.render_level != RenderLevel.none and frame % (self.frameskip + 1) == 0
+
     def render_pixel(self):
         x, y = self.clock - 1, self.scan_line
-        background = self.get_background_pixel()
-        i, sprite = self.get_sprite_pixel()
+        color = self.mix_pixel(x, self.get_background_pixel())
+        if not self.renders_frame(self.frame):
+            # Only the sprite zero hit matters
+            return
+        palette_info = self.memory.read(0x3F00 + color % 64)
+        if self.PPUMASK.greyscale_flag:
+            palette_info &= 0x30
+        self._frame_buffer[y * PPU.WIDTH + x] = palette_info & 0x3F
+
+    def mix_pixel(self, x, background):
+        """Returns the palette address ($3F00 + address) of the pixel x of the
+        current line, given its background pixel. Sets the sprite zero hit
+        flag."""
+        sprite = self._sprite_line[x] if self.PPUMASK.sprites_flag else 0
         if x < 8 and not self.PPUMASK.left_background_flag:
             background = 0
         if x < 8 and not self.PPUMASK.left_sprites_flag:
             sprite = 0
         # Transparency checks
-        b, s = background % 4 != 0, sprite % 4 != 0
-        if not b and not s:
-            color = 0
-        elif not b and s:
-            color = sprite | 0x10
-        elif not s and b:
-            color = background
+        if background % 4 == 0:
+            return sprite & 0x1F
+        if not sprite:
+            return background
+        if sprite & PPU.SPRITE_ZERO and x < 255:
+            self.PPUSTATUS.sprite_zero_flag = 1
+        if sprite & PPU.SPRITE_BEHIND:
+            return background
+        return sprite & 0x1F
+
+    def render_line(self):
+        """Performs the 341 steps of a visible line with rendering enabled,
+        from its clock 0, at once: the background pixels are computed with
+        NumPy, the scroll and fetch state is updated as step() would.
+
+        The background data loaded during the previous line gives the first
+        two tiles, the other ones are fetched with the current VRAM address,
+        or cropped out of the background layer if there is one.
+        The CPU must not access the PPU in the meantime, and no NMI may be
+        pending.
+        """
+        v = self.v
+        if self.renders_frame(self.frame):
+            self.render_line_pixels(v)
+        elif self.PPUMASK.background_flag and self.PPUMASK.sprites_flag \
+                and self.sprite_zero_line and not self.PPUSTATUS.sprite_zero_flag:
+            # Only the sprite zero hit matters
+            self.mix_line_sprites(self.line_background(v))
+
+        # Clocks 8, 16... 256 incremented the coarse X 32 times
+        self.v = v ^ 0x0400
+        self.increment_vertical_scroll()
+        self.copy_horizontal_scroll()
+        self.load_sprite_data()
+        if self.scan_line_counter is not None:
+            self.clock_scan_line_counter()
+        # Clocks 321 - 336: fetch the first two tiles of the next line
+        for _ in range(2):
+            self.fetch_name_table_byte()
+            self.fetch_attribute_table_byte()
+            self.fetch_lower_tile_byte()
+            self.fetch_higher_tile_byte()
+            self.background_data = (self.background_data << 32) & 0xFFFFFFFFFFFFFFFF
+            self.increment_horizontal_scroll()
+            self.load_background_data()
+        self.scan_line += 1
+
+    def render_line_pixels(self, v):
+        """Renders the current line in the frame buffer, see render_line."""
+        if self.PPUMASK.background_flag:
+            background = self.line_background(v)
+            colors = np.where(background & 0x3, background, 0)
         else:
-            if self.sprite_indexes[i] == 0 and x < 255:
-                self.PPUSTATUS.sprite_zero_flag = 1
-            if self.sprite_priorities[i] == 0:
-                color = sprite | 0x10
-            else:
-                color = background
+            background = np.zeros(PPU.WIDTH, dtype='uint8')
+            colors = np.zeros(PPU.WIDTH, dtype='uint8')
+        if self.PPUMASK.sprites_flag and self.sprite_count:
+            colors = self.mix_line_sprites(background, colors)
+        palette = self.memory.palette_table() & 0x3F
+        if self.PPUMASK.greyscale_flag:
+            palette &= 0x30
+        self.frame_buffer[self.scan_line] = palette[colors]
+
+    def line_background(self, v):
+        """Returns the 256 background pixels of the current line, see
+        render_line."""
+        # 4-bit pixels of the 16 first pixels, already in the shift register
+        background_data = self.background_data
+        pixels = [(background_data >> shift) & 0xF for shift in range(60, -4, -4)]
+        tiles = None
+        if self.background_layer is not None:
+            tiles = self.background_layer.line(v)
+        if tiles is None:
+            tiles = self.fetch_line_tiles(v)
+        background = np.concatenate((np.array(pixels, dtype='uint8'), tiles))
+        background = background[self.x:self.x + PPU.WIDTH]
+        if not self.PPUMASK.left_background_flag:
+            background[:8] = 0
+        return background
+
+    def mix_line_sprites(self, background, colors=None):
+        """Same as mix_pixel, for the whole line: returns the given palette
+        addresses of the background pixels with the sprites mixed in. Only
+        sets the sprite zero hit flag when they are not given."""
+        sprites = self.sprite_line
+        if not self.PPUMASK.left_sprites_flag:
+            sprites = sprites.copy()
+            sprites[:8] = 0
+        opaque = background & 0x3 != 0
+        hits = opaque & (sprites & PPU.SPRITE_ZERO != 0)
+        if hits[:255].any():
+            self.PPUSTATUS.sprite_zero_flag = 1
+        if colors is None:
+            return None
+        front = (sprites != 0) & ~(opaque & (sprites & PPU.SPRITE_BEHIND != 0))
+        return np.where(front, sprites & 0x1F, colors)
+
+    def fetch_line_tiles(self, v):
+        """Returns the pixels of the tiles 2 to 32 of a line starting with the
+        given VRAM address, from the two horizontal name tables it goes
+        through."""
+        coarse_x, coarse_y = v & 0x1F, (v >> 5) & 0x1F
+        # 2 bits per quadrant of 2x2 tiles
+        shifts = _ATTRIBUTE_SHIFTS | (coarse_y & 2) << 1
+        names, palettes = [], []
+        for table in (v & 0xC00, v & 0xC00 ^ 0x400):
+            row, attributes = self.memory.name_table_row(0x2000 | table | coarse_y << 5)
+            names.append(row)
+            palettes.append((np.repeat(attributes, 4) >> shifts) & 0x3)
+        names = np.concatenate(names)[coarse_x:coarse_x + 31]
+        attributes = np.concatenate(palettes)[coarse_x:coarse_x + 31]
+        tile_numbers = names.astype(int) | self.PPUCTRL.background_table_flag << 8
+        tiles = self.memory.tiles.rows(tile_numbers, (v >> 12) & 0x7).ravel()
+        tiles |= np.repeat(attributes << 2, 8)
+        return tiles
+
+    def run(self, dots):
+        """Calls step() dots times, rendering the visible lines run from start
+        to end at once (see render_line), and skipping the idle steps at once
+        (see idle_dots)."""
+        step = self.step
+        while dots > 0:
+            idle_dots = self.idle_dots()
+            if idle_dots:
+                idle_dots = min(dots, idle_dots)
+                self.skip(idle_dots)
+                dots -= idle_dots
+                continue
+            rendering_enabled = self.PPUMASK.background_flag or self.PPUMASK.sprites_flag
+            if not rendering_enabled or PPU.POST_RENDER_SCAN_LINE <= self.scan_line \
+                    < PPU.PRE_RENDER_SCAN_LINE:
+                # The next step raises an event, the following ones are idle
+                step()
+                dots -= 1
+                continue
+            if dots >= PPU.CLOCK_CYCLE and self.clock == 0 \
+                    and self.scan_line < PPU.POST_RENDER_SCAN_LINE and self.nmi_delay <= 0:
+                self.render_line()
+                dots -= PPU.CLOCK_CYCLE
+                continue
+            # Up to the start of the next line
+            line_dots = min(dots, self.dots_until((self.scan_line + 1) % (PPU.PRE_RENDER_SCAN_LINE + 1), 0))
+            for _ in range(line_dots):
+                step()
+            dots -= line_dots
 
-        palette_info = self.memory.read(0x3F00 + color % 64)
-        c = PALETTE[palette_info]
-        # TODO: finish this
-        # define a palette with all colors
-        # c = palette[palette_info]
-        # render pixel on scren
-        # self._console.screen.setRGB(x, y, c)
+    def rgb_frame(self, out=None):
+        """Returns the current frame as a (240, 256, 3) RGB array. Best called
+        once per frame, e.g. when the frame counter changes."""
+        return to_rgb(self.frame_buffer, out)
+
+    def rgba_frame(self, out=None):
+        """Returns the current frame as a (240, 256, 4) RGBA array."""
+        return to_rgba(self.frame_buffer, out)
 
     def increment_horizontal_scroll(self):
         """increment hori(v)"""
@@ -406,99 +720,49 @@ class PPU:
         """vert(v) = vert(t)"""
         self.v = (self.v & 0x841F) | (self.t & 0x7BE0)
 
-    def get_sprite_pixel(self):
-        """Returns the sprite pixel that will be considered for rendering, as
-        well as the sprite index."""
-        if not self.PPUMASK.sprites_flag:
-            return 0, 0
-        for i in range(self.sprite_count):
-            # relative X position compared to beginning of sprite
-            offset = (self.clock - 1) - self.sprite_positions[i]
-            if offset < 0 or offset > 7:
-                continue
-            color = (self.sprite_graphics[i] >> (7 - offset) * 4) & 0xF
-            if color % 4 == 0:
-                # sprite is transparent
-                continue
-            # Even if other sprites were to be set at this coordinate, we only
-            # render the first one anyway.
-            return i, color
-        return 0, 0
-
-    def fetch_sprite_graphics(self, i, row):
-        """Gets the 8 pixel's worth of graphical data for the given sprite.
-        Args:
-            row: the row WITHIN the sprite (0 == top of sprite)
+    def load_sprite_data(self):
+        """Gets all sprite data for the current scan line, into the sprite
+        line buffer.
         """
-        tile_index = self.OAMDATA.data[i * 4 + 1]
-        attributes = self.OAMDATA.data[i * 4 + 2]
-        vertical_flip = attributes & 0x80 == 0x80
-        horizontal_flip = attributes & 0x40 == 0x40
+        h = 16 if self.PPUCTRL.sprite_size_flag else 8
+        indexes, overflow = self.OAMDATA.visible_sprites(self.scan_line, h)
+        if overflow:
+            # no rendering of more than 8 sprites on this line, but set the
+            # overflow flag in that case
+            self.PPUSTATUS.sprite_overflow_flag = 1
+        self.sprite_count = count = len(indexes)
+        self.sprite_zero_line = bool(count) and bool(indexes[0] == 0)
+        self.sprite_line[:] = 0
+        if not count:
+            return
+        # The sprites of the line after the prerender one are the first of
+        # the next frame
+        frame = self.frame + (self.scan_line == PPU.PRE_RENDER_SCAN_LINE)
+        if not self.renders_frame(frame) and not self.sprite_zero_line:
+            # Only the sprite zero hit matters
+            return
+        oam = self.OAMDATA.array.reshape(64, 4)[indexes].astype(int)
+        y, tiles, attributes, x = oam.T
+        rows = self.scan_line - y
+        # Flip vertically
+        rows = np.where(attributes & 0x80, h - 1 - rows, rows)
         if not self.PPUCTRL.sprite_size_flag:
-            # sprite of size 8
-            if vertical_flip:
-                row = 7 - row
-            table = self.PPUCTRL.sprite_table_flag
+            tiles = tiles | self.PPUCTRL.sprite_table_flag << 8
         else:
-            if vertical_flip:
-                row = 15 - row
             # In that case, the lowest byte gives the table number and the
             # highest 7 the tile number
-            table = tile_index & 1
-            tile_index &= 0xFE
-            if row > 7:
-                tile_index += 1
-                row -= 8
-        address = 0x1000 * table + 0x10 * tile_index + row
-        low_tile_byte = self.memory.read(address)
-        high_tile_byte = self.memory.read(address + 8)
-        # We now combine together the data for 8 pixels, similar to
-        # load_background_data
-        a = (attributes & 0x3) << 2
-        data = 0
-        for i in range(8):
-            if horizontal_flip:
-                b = (high_tile_byte & 1) << 1
-                c = (high_tile_byte & 1) << 0
-                low_tile_byte >>= 1
-                high_tile_byte >>= 1
-            else:
-                b = (high_tile_byte & 0x80) >> 6
-                c = (low_tile_byte & 0x80) >> 7
-                low_tile_byte <<= 1
-                high_tile_byte <<= 1
-            data <<= 4
-            data |= (a | b | c)
-        return data
-
-    def load_sprite_data(self):
-        """Gets all sprite data for the current scan line.
-        """
-        h = 16 if self.PPUCTRL.sprite_size_flag else 8
-        data = self.OAMDATA.data
-        count = 0
-        for i in range(64):
-            # get x, y and attribute data
-            y, a, x = data[i * 4], data[i * 4 + 2], data[i * 4 + 3]
-            top, bottom = y, y + h
-            # top is the smallest, bottom the biggest row number
-            if self.scan_line < top or self.scan_line > bottom:
-                # this sprite does not appear on this line
-                continue
-            count += 1
-            if count <= 8:
-                self.sprite_graphics[count - 1] = self.fetch_sprite_graphics(
-                    i, self.scan_line - top
-                )
-                self.sprite_positions[count - 1] = x
-                self.sprite_priorities[count - 1] = (a >> 5) & 1
-                self.sprite_indexes[count - 1] = i
-        if count > 8:
-            # no rendering if we hit more than 8 sprites on this line, but
-            # set the overflow flag in that case
-            count = 8
-            self.PPUSTATUS.sprite_overflow_flag = 1
-        self.sprite_count = count
+            tiles = (tiles & 1) << 8 | tiles & 0xFE | rows >> 3
+            rows &= 0x7
+        pixels = self.memory.tiles.sprite_rows(tiles, rows, attributes & 0x40 != 0)
+        flags = 0x10 | (attributes & 0x3) << 2
+        flags |= np.where(attributes & 0x20, PPU.SPRITE_BEHIND, 0)
+        flags |= np.where(indexes == 0, PPU.SPRITE_ZERO, 0)
+        columns = (x[:, np.newaxis] + np.arange(8)).ravel()
+        pixels = (pixels | flags[:, np.newaxis]).ravel()
+        shown = (pixels & 0x3 != 0) & (columns < PPU.WIDTH)
+        # The first sprite with an opaque pixel at a position is rendered
+        columns, first = np.unique(columns[shown], return_index=True)
+        self.sprite_line[columns] = pixels[shown][first]
 
     def get_background_pixel(self):
         """Returns the background pixel that will be considered for rendering.
@@ -527,18 +791,11 @@ class PPU:
         | | | a bit from the lower tile byte
         | | a bit from the higher tile byte
         what palette to use (a.k.a the attribute table byte)
+        The pixels come from a precomputed table, the palette is repeated in
+        each of them.
         """
-        data = 0
-        a = self.attribute_table_byte
-        for i in range(8):
-            b = (self.high_tile_byte & 0x80) >> 6
-            c = (self.low_tile_byte & 0x80) >> 7
-            data <<= 4
-            self.high_tile_byte <<= 1
-            self.low_tile_byte <<= 1
-            data |= (a | b | c)
-        self.background_data |= data
-
+        data = _TILE_ROWS[self.high_tile_byte << 8 | self.low_tile_byte]
+        self.background_data |= data | self.attribute_table_byte * 0x11111111
 
     def fetch_name_table_byte(self):
         """The name table address is given by a $2000 offset combined with the
@@ -553,12 +810,16 @@ class PPU:
             - the three highest bits of the coarse Y scroll,
             - the three highest bits of the coarse X scroll
         With a #23C0 offset.
+        Each byte holds the palettes of 4 quadrants of 2x2 tiles, selected by
+        the second lowest bits of the coarse X and Y scroll. The palette is
+        kept in bits 2 and 3, as expected by load_background_data.
         """
         address = 0x23C0
         address |= self.v & 0xC00
         address |= (self.v & 0x380) >> 4
         address |= (self.v & 0x1C) >> 2
-        self.attribute_table_byte = self.memory.read(address)
+        shift = ((self.v >> 4) & 4) | (self.v & 2)
+        self.attribute_table_byte = ((self.memory.read(address) >> shift) & 0x3) << 2
 
     def fetch_lower_tile_byte(self):
         """To fetch a tile byte, combine:
@@ -600,7 +861,7 @@ class PPU:
                     # LINES: 0 - 239, 261; CLOCK: 1 - 256, 321 - 336
                     switch = self.clock % 8
                     # Make sure that we have 8 new bits every 2 ticks:
-                    self.background_data <<= 4
+                    self.background_data = (self.background_data << 4) & 0xFFFFFFFFFFFFFFFF
                     if switch == 0:
                         self.increment_horizontal_scroll()
                         # load some new data
@@ -624,6 +885,8 @@ class PPU:
                     # In a real NES, this would be performed over several
                     # cycles. Here, we do it at once
                     self.load_sprite_data()
+                    if self.scan_line_counter is not None:
+                        self.clock_scan_line_counter()
 
                 # TODO: implement 2 last cycle logic?
 
@@ -640,6 +903,10 @@ class PPU:
 
         if is_postrender_line and self.clock == 1:
             self.set_vertical_blank()
+            if self.render_level == RenderLevel.rgb and self.renders_frame(self.frame):
+                self.rgb_frame(self.rgb_frame_buffer)
+            if self.frame_callback is not None:
+                self.frame_callback()
 
     def read_register(self, address):
         """CPU and PPU communicate through the PPU's registers.
@@ -0,0 +1,121 @@
+from collections import deque
+import time
+import zlib
+
+import numpy as np
+
+
+class _Group:
+    """A keyframe and the deltas of the next frames against it."""
+    __slots__ = ('keyframe', 'deltas', 'size')
+
+    def __init__(self, keyframe):
+        self.keyframe = keyframe
+        self.deltas = []
+        self.size = len(keyframe)
+
+    def __len__(self):
+        return 1 + len(self.deltas)
+
+
+class Rewind:
+    """Ring buffer of the savestates of the last frames (see
+    Console.save_state), to go back in time.
+
+    Call record once per frame, and step_back to load the state of a previous
+    frame. States are stored compressed with zlib: one keyframe every
+    keyframe_interval frames, the other ones as the XOR of their state with
+    the keyframe, mostly zeros.
+
+    The buffer keeps at most capacity frames, and at most max_bytes of
+    compressed states if given. The oldest keyframe is dropped with its
+    deltas: up to keyframe_interval - 1 frames fewer can be kept.
+
+    Memory use (size), the number of frames kept and the time spent in
+    record are reported by stats.
+    """
+    def __init__(self, console, capacity=3600, keyframe_interval=60, max_bytes=None,
+                 level=1):
+        self._console = console
+        self.capacity = capacity
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+        self.level = level
+        self._groups = deque()
+        self.frames = 0
+        self.size = 0
+        # Uncompressed state of the last keyframe, and a buffer for the new
+        # states and their deltas
+        self._keyframe = None
+        self._state = None
+        self._delta = None
+        self.records = 0
+        self.record_time = 0
+
+    def record(self):
+        """Saves the state of the console, at the end of a frame."""
+        t = time.perf_counter()
+        if self._state is None:
+            self._state = bytearray(self._console.save_state())
+            self._delta = np.empty(len(self._state), dtype='uint8')
+        else:
+            self._console.save_state(self._state)
+        state = np.frombuffer(self._state, dtype='uint8')
+        groups = self._groups
+        if not groups or len(groups[-1]) >= self.keyframe_interval:
+            self._keyframe = state.copy()
+            groups.append(_Group(zlib.compress(self._state, self.level)))
+            blob = groups[-1].keyframe
+        else:
+            np.bitwise_xor(state, self._keyframe, out=self._delta)
+            blob = zlib.compress(self._delta, self.level)
+            groups[-1].deltas.append(blob)
+            groups[-1].size += len(blob)
+        self.frames += 1
+        self.size += len(blob)
+        while len(groups) > 1 and (
+            self.frames > self.capacity
+            or self.max_bytes is not None and self.size > self.max_bytes
+        ):
+            group = groups.popleft()
+            self.frames -= len(group)
+            self.size -= group.size
+        self.records += 1
+        self.record_time += time.perf_counter() - t
+
+    def step_back(self, frames=1):
+        """Loads the state recorded the given number of frames before the last
+        one (at most the oldest one), dropping the newer ones. Returns the
+        number of frames gone back."""
+        frames = min(frames, self.frames - 1)
+        if frames < 0:
+            return 0
+        groups = self._groups
+        for _ in range(frames):
+            group = groups[-1]
+            if group.deltas:
+                blob = group.deltas.pop()
+            else:
+                blob = groups.pop().keyframe
+            group.size -= len(blob)
+            self.size -= len(blob)
+            self.frames -= 1
+        group = groups[-1]
+        keyframe = np.frombuffer(zlib.decompress(group.keyframe), dtype='uint8')
+        self._keyframe = keyframe.copy()
+        if group.deltas:
+            delta = np.frombuffer(zlib.decompress(group.deltas[-1]), dtype='uint8')
+            state = np.bitwise_xor(delta, keyframe)
+        else:
+            state = keyframe
+        self._console.load_state(state)
+        return frames
+
+    def stats(self):
+        """Returns the number of frames kept, the size of the compressed
+        states in bytes, and the average time spent in record, in ms."""
+        return {
+            'frames': self.frames,
+            'bytes': self.size,
+            'ms_per_record': self.record_time * 1000 / self.records if self.records else 0,
+        }
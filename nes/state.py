@@ -0,0 +1,140 @@
+import struct
+import zlib
+
+from nes.cpu import InterruptType
+
+
+class StateError(Exception):
+    """Base error class"""
+
+
+class StateLayout:
+    """Fixed binary layout of the whole state of a console, for savestates.
+
+    A savestate is a single buffer:
+        - a header: MAGIC, VERSION, the size of the savestate and the CRC32
+          of the PRG and CHR ROM,
+        - the registers and counters of the CPU, PPU, APU and mapper, packed
+          with one struct,
+        - the memories, copied as is: CPU RAM, PRG RAM, CHR RAM, name tables,
+          palette, OAM, sprite line buffer, APU registers and the buffers of
+          the mapper.
+    Saving and loading are a struct pack and a few bulk copies. The layout
+    only depends on the cartridge: savestates of one console can be loaded in
+    any console running the same ROM.
+
+    What the CPU cannot observe is not saved: the frame buffers, and the
+    caches (decoded instructions, translated blocks, tiles, background
+    layer), which are invalidated on load.
+
+    Bump VERSION when changing the layout.
+    """
+    MAGIC = b'NESS'
+    VERSION = 2
+    _HEADER = struct.Struct('<4sHII')
+
+    def __init__(self, console):
+        self._console = console
+        cpu, ppu, mapper = console.cpu, console.ppu, console.mapper
+        cartridge = mapper._cartridge
+        # (object, attribute, struct format) of the scalars
+        fields = [
+            (cpu, 'pc', 'H'), (cpu, 'sp', 'B'), (cpu, 'A', 'B'), (cpu, 'X', 'B'),
+            (cpu, 'Y', 'B'), (cpu, 'C', 'B'), (cpu, 'zn', 'H'), (cpu, 'I', 'B'),
+            (cpu, 'D', 'B'), (cpu, 'B', 'B'), (cpu, 'U', 'B'), (cpu, 'O', 'B'),
+            (cpu, 'wait_cycles', 'I'), (cpu, 'interrupt_status', 'B'),
+            (ppu, 'latch_value', 'B'), (ppu, 'nmi_occured', 'B'),
+            (ppu, 'nmi_previous', 'B'), (ppu, 'nmi_delay', 'i'),
+            (ppu, 'v', 'H'), (ppu, 't', 'H'), (ppu, 'x', 'B'), (ppu, 'w', 'B'),
+            (ppu, 'clock', 'H'), (ppu, 'scan_line', 'H'),
+            (ppu, 'is_even_screen', 'B'), (ppu, 'frame', 'Q'),
+            (ppu, 'name_table_byte', 'B'), (ppu, 'attribute_table_byte', 'B'),
+            (ppu, 'low_tile_byte', 'B'), (ppu, 'high_tile_byte', 'B'),
+            (ppu, 'background_data', 'Q'), (ppu, 'sprite_count', 'B'),
+            (ppu, 'sprite_zero_line', 'B'),
+            (ppu.OAMADDR, 'address', 'B'), (ppu.PPUDATA, 'buffered_data', 'B'),
+            (mapper, 'mirror_id', 'B'),
+            (console.apu, 'status', 'B'), (console.apu, 'frame_counter', 'B'),
+        ]
+        for register in (ppu.PPUCTRL, ppu.PPUMASK, ppu.PPUSTATUS):
+            fields += [(register, name, 'B') for name in vars(register) if name.endswith('_flag')]
+        fields += [(mapper, name, 'B') for name in mapper.STATE]
+        self._fields = [(obj, name) for obj, name, _ in fields]
+        self._struct = struct.Struct('<' + ''.join(f for _, _, f in fields))
+        # Memories, as byte views
+        memories = [
+            console.cpu.memory._RAM,
+            cartridge.PRG_RAM if cartridge.prg_ram_size else bytearray(),
+            cartridge.CHR_RAM if cartridge.chr_ram_size else bytearray(),
+            ppu.memory._name_table, ppu.memory._palette, ppu.OAMDATA.data,
+            ppu._sprite_line, console.apu.registers,
+        ] + [getattr(mapper, name) for name in mapper.STATE_BUFFERS]
+        self._sections = []
+        offset = StateLayout._HEADER.size + self._struct.size
+        for memory in memories:
+            view = memoryview(memory).cast('B')
+            self._sections.append((view, offset, offset + len(view)))
+            offset += len(view)
+        self.size = offset
+        self._rom_crc = zlib.crc32(cartridge.CHR_ROM, zlib.crc32(cartridge.PRG_ROM))
+        self._header = StateLayout._HEADER.pack(
+            StateLayout.MAGIC, StateLayout.VERSION, self.size, self._rom_crc
+        )
+        # Memories whose changes invalidate caches. Comparing bytearrays is
+        # a memcmp, unlike comparing memoryviews.
+        self._chr_ram, self._name_table, self._oam = (memories[i] for i in (2, 3, 5))
+
+    def save(self, out=None):
+        """Returns the state of the console, in out if given (a writable
+        buffer of size bytes)."""
+        state = bytearray(self.size) if out is None else out
+        state[:StateLayout._HEADER.size] = self._header
+        self._struct.pack_into(
+            state, StateLayout._HEADER.size,
+            *[getattr(obj, name) for obj, name in self._fields]
+        )
+        for view, start, end in self._sections:
+            state[start:end] = view
+        return state
+
+    def load(self, state):
+        """Restores the console to the given state, see save."""
+        state = memoryview(state).cast('B')
+        if len(state) < StateLayout._HEADER.size or state[:4] != StateLayout.MAGIC:
+            raise StateError('Not a savestate.')
+        _, version, size, rom_crc = StateLayout._HEADER.unpack_from(state)
+        if version != StateLayout.VERSION:
+            raise StateError('Unsupported savestate version: {}'.format(version))
+        if size != self.size or len(state) != size or rom_crc != self._rom_crc:
+            raise StateError('Not a savestate of this cartridge.')
+        console = self._console
+        cpu, ppu, mapper = console.cpu, console.ppu, console.mapper
+        chr_changed = self._chr_ram != self._section(state, 2)
+        name_table_changed = self._name_table != self._section(state, 3)
+        oam_changed = self._oam != self._section(state, 5)
+        values = self._struct.unpack_from(state, StateLayout._HEADER.size)
+        for (obj, name), value in zip(self._fields, values):
+            setattr(obj, name, value)
+        for view, start, end in self._sections:
+            view[:] = state[start:end]
+        cpu.interrupt_status = InterruptType(cpu.interrupt_status)
+        # The state already accounts for the PPU debt
+        console._ppu_debt = 0
+        # Caches
+        mapper.set_mirroring(mapper.mirror_id)
+        mapper.map_banks()
+        cpu.invalidate_code(0x0000, 0x2000)
+        cpu.invalidate_code(0x6000, 0x2000)
+        if chr_changed:
+            mapper.tiles.invalidate_all()
+        if oam_changed:
+            ppu.OAMDATA.invalidate()
+        if ppu.background_layer is not None and (chr_changed or name_table_changed):
+            ppu.background_layer.invalidate()
+        if console.idle_loops is not None:
+            console.idle_loops.forget()
+        console.catch_up()
+
+    def _section(self, state, index):
+        _, start, end = self._sections[index]
+        return state[start:end]
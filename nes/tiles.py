@@ -0,0 +1,83 @@
+import numpy as np
+
+from nes.memory import as_array
+
+
+class TileCache:
+    """Tiles of a CHR memory (ROM or RAM), decoded once into 8x8 arrays of
+    2-bit pixels, for the renderers to slice rows out of instead of combining
+    the two bitplanes of each tile row.
+
+    A tile is 16 bytes: the 8 rows of its low bitplane then the 8 rows of its
+    high one, the leftmost pixel in the highest bit. Tiles are decoded as is
+    (pixels) and flipped horizontally (flipped).
+
+    The pattern tables ($0000 - $1FFF) show 512 tiles, which the mapper maps
+    to tiles of the CHR memory with map_chr when switching banks. Writes to
+    the CHR memory must be reported through invalidate.
+    """
+    TILE_SIZE = 0x10
+    PATTERN_TABLE_TILES = 0x200
+
+    def __init__(self, memory):
+        self._memory = memory
+        count = max(len(memory) // TileCache.TILE_SIZE, 1)
+        self.pixels = np.zeros((count, 8, 8), dtype='uint8')
+        self.flipped = np.zeros((count, 8, 8), dtype='uint8')
+        # Tiles to decode again before the next use
+        self._dirty = set()
+        # Incremented when decoded or mapped tiles change, for the users
+        # keeping data derived from them
+        self.generation = 0
+        self._decode(np.arange(len(memory) // TileCache.TILE_SIZE))
+        # Tile of the CHR memory shown at each tile of the pattern tables
+        self.bank_tiles = np.arange(TileCache.PATTERN_TABLE_TILES) % count
+
+    def _decode(self, tiles):
+        data = as_array(self._memory)
+        data = data[:len(data) // TileCache.TILE_SIZE * TileCache.TILE_SIZE]
+        planes = data.reshape(-1, 2, 8)[tiles]
+        pixels = np.unpackbits(planes[:, 0, :, np.newaxis], axis=2)
+        pixels |= np.unpackbits(planes[:, 1, :, np.newaxis], axis=2) << 1
+        self.pixels[tiles] = pixels
+        self.flipped[tiles] = pixels[:, :, ::-1]
+
+    def invalidate(self, address):
+        """Marks the tile holding the given CHR memory address for decoding."""
+        self._dirty.add(address // TileCache.TILE_SIZE)
+
+    def invalidate_all(self):
+        """Marks all the tiles for decoding."""
+        self._dirty.update(range(len(self.pixels)))
+
+    def refresh(self):
+        """Decodes the tiles written to since the last call."""
+        if self._dirty:
+            self._decode(np.array(sorted(self._dirty)))
+            self._dirty.clear()
+            self.generation += 1
+
+    def map_chr(self, address, offset, size):
+        """Shows size bytes of the CHR memory, from offset, at the given
+        pattern table address."""
+        first = address // TileCache.TILE_SIZE
+        count = size // TileCache.TILE_SIZE
+        start = offset // TileCache.TILE_SIZE
+        self.bank_tiles[first:first + count] = np.arange(start, start + count)
+        self.generation += 1
+
+    def rows(self, tiles, row, flip=False):
+        """Returns the 8 pixels of the given row of each of the given pattern
+        table tiles (a NumPy array of numbers 0 - 511)."""
+        self.refresh()
+        pixels = self.flipped if flip else self.pixels
+        return pixels[self.bank_tiles[tiles], row]
+
+    def sprite_rows(self, tiles, rows, flips):
+        """Returns the 8 pixels of a row of each of the given pattern table
+        tiles, given the row and whether to flip it horizontally for each."""
+        self.refresh()
+        tiles = self.bank_tiles[tiles]
+        return np.where(
+            flips[:, np.newaxis], self.flipped[tiles, rows], self.pixels[tiles, rows]
+        )
@@ -0,0 +1,445 @@
+import re
+import logging
+
+from nes.cpu import (
+    AddressingMode, InterruptType, INSTRUCTION_NAMES, INSTRUCTION_MODES,
+    INSTRUCTION_SIZES, INSTRUCTION_CYCLES, INSTRUCTION_PAGE_CYCLES
+)
+from nes.ppu import PPU
+
+
+log = logging.getLogger('nes.' + __name__)
+
+
+# Value returned by Translator._blocks for addresses that cannot be compiled
+_NOT_COMPILABLE = False
+# CPU registers a block may keep in local variables
+_REGISTERS = ['A', 'X', 'Y', 'sp', 'C', 'zn', 'I', 'D', 'O']
+_REGISTERS_REGEX = {r: re.compile(r'\b{}\b'.format(r)) for r in _REGISTERS}
+
+# Condition (on local flags) of each branch instruction, Z and N being
+# evaluated from the last result zn (see cpu.zn_flags)
+_BRANCH_CONDITIONS = {
+    'BCC': 'not C', 'BCS': 'C', 'BEQ': 'not zn & 0xFF', 'BNE': 'zn & 0xFF',
+    'BMI': 'zn & 0x180', 'BPL': 'not zn & 0x180', 'BVC': 'not O', 'BVS': 'O',
+}
+
+# Instructions reading their operand and updating registers
+_LOADS = {
+    'LDA': ['A = v'],
+    'LDX': ['X = v'],
+    'LDY': ['Y = v'],
+    'AND': ['A = A & v'],
+    'ORA': ['A = A | v'],
+    'EOR': ['A = A ^ v'],
+    'ADC': [
+        't = A + v + C',
+        'r = t & 0xFF',
+        'O = (A ^ v) & 0x80 == 0 and (A ^ r) & 0x80 != 0',
+        'C = t > 255',
+        'A = r',
+    ],
+    'SBC': [
+        't = A - v - (1 - C)',
+        'r = t & 0xFF',
+        'O = (A ^ v) & 0x80 != 0 and (A ^ r) & 0x80 != 0',
+        'C = 1 if t >= 0 else 0',
+        'A = r',
+    ],
+}
+# Register whose value sets the Z and N flags after a _LOADS instruction
+_LOADS_RESULT = {
+    'LDA': 'A', 'LDX': 'X', 'LDY': 'Y', 'AND': 'A', 'ORA': 'A', 'EOR': 'A',
+    'ADC': 'A', 'SBC': 'A',
+}
+_COMPARES = {'CMP': 'A', 'CPX': 'X', 'CPY': 'Y'}
+_STORES = {'STA': 'A', 'STX': 'X', 'STY': 'Y'}
+# Read-modify-write instructions, computing r from the value v
+_SHIFTS = {
+    'ASL': ['C = (v >> 7) & 1', 'r = (v << 1) & 0xFF'],
+    'LSR': ['C = v & 1', 'r = v >> 1'],
+    'ROL': ['r = ((v << 1) & 0xFF) | C', 'C = (v & 0x80) >> 7'],
+    'ROR': ['r = (v >> 1) | (C << 7)', 'C = v & 1'],
+    'INC': ['r = (v + 1) & 0xFF'],
+    'DEC': ['r = (v - 1) & 0xFF'],
+}
+# Instructions working on registers only
+_IMPLIED = {
+    'INX': ['X = (X + 1) & 0xFF'], 'INY': ['Y = (Y + 1) & 0xFF'],
+    'DEX': ['X = (X - 1) & 0xFF'], 'DEY': ['Y = (Y - 1) & 0xFF'],
+    'TAX': ['X = A'], 'TAY': ['Y = A'], 'TXA': ['A = X'], 'TYA': ['A = Y'],
+    'TSX': ['X = sp'], 'TXS': ['sp = X'],
+    'CLC': ['C = False'], 'SEC': ['C = True'], 'CLI': ['I = False'],
+    'SEI': ['I = True'], 'CLD': ['D = False'], 'SED': ['D = True'],
+    'CLV': ['O = False'],
+}
+_IMPLIED_RESULT = {
+    'INX': 'X', 'INY': 'Y', 'DEX': 'X', 'DEY': 'Y', 'TAX': 'X', 'TAY': 'Y',
+    'TXA': 'A', 'TYA': 'A', 'TSX': 'X',
+}
+
+
+class Translator:
+    """Optional execution engine compiling straight-line 6502 code into Python
+    functions.
+
+    A block starts at the current program counter and ends with the first
+    branch, jump or return, or right before any instruction that is not
+    supported (interrupts, stack flag operations, unofficial opcodes...) or
+    that accesses I/O registers at a static address. Registers are kept in
+    local variables for the whole block and flag updates are inlined.
+
+    Only code from PRG ROM is compiled: blocks are cached by address and by
+    the PRG bank mapped at that address, code running from RAM always goes
+    through the interpreter, so that self-modifying code never runs a stale
+    block. Indexed and indirect accesses hitting I/O registers at run time
+    leave the block before the instruction, which is then executed by the
+    interpreter. Interrupts are only serviced between blocks, so the
+    interpreter is used when the PPU is about to raise an NMI.
+    """
+    MAX_BLOCK_SIZE = 32
+    MAX_BLOCK_CYCLES = MAX_BLOCK_SIZE * 7
+    # A block lasts at most MAX_BLOCK_CYCLES, i.e. less than 3 scan lines
+    NMI_GUARD_LINE = PPU.POST_RENDER_SCAN_LINE - 2
+    IRQ_GUARD_CLOCKS = 3
+    # Blocks never cross the boundary of an 8kB PRG window
+    WINDOW_SIZE = 0x2000
+
+    def __init__(self, console):
+        self._console = console
+        self._cpu = console.cpu
+        self._blocks = {}
+
+    def step(self):
+        """Executes a block of instructions starting at the current program
+        counter, or a single instruction through the interpreter. Returns the
+        number of CPU cycles executed."""
+        cpu = self._cpu
+        pc = cpu.pc
+        if cpu.wait_cycles > 0 or pc < 0x8000 or \
+                cpu.interrupt_status is not InterruptType.interruptNone:
+            return cpu.step()
+        ppu = self._console.ppu
+        if ppu.nmi_delay > 0 or \
+                Translator.NMI_GUARD_LINE <= ppu.scan_line <= PPU.POST_RENDER_SCAN_LINE:
+            # An NMI may be raised before the end of the block, which would
+            # delay it compared to the interpreter
+            return cpu.step()
+        irq_clocks = self._console.mapper.irq_clocks()
+        if irq_clocks is not None and irq_clocks <= Translator.IRQ_GUARD_CLOCKS:
+            # Same for an IRQ of the mapper, counted once per scan line
+            return cpu.step()
+
+        key = (pc, self._console.mapper.prg_bank(pc))
+        block = self._blocks.get(key)
+        if block is None:
+            block = self._blocks[key] = self.compile(pc)
+        if block is _NOT_COMPILABLE:
+            return cpu.step()
+        cycles = block(cpu)
+        if cycles == 0:
+            # The first instruction of the block accessed I/O registers
+            return cpu.step()
+        return cycles
+
+    def invalidate(self):
+        """Drops all the compiled blocks."""
+        self._blocks = {}
+
+    @property
+    def block_count(self):
+        return sum(1 for b in self._blocks.values() if b is not _NOT_COMPILABLE)
+
+    def compile(self, address):
+        """Compiles the block starting at the given address. Returns a function
+        executing it on a CPU, or _NOT_COMPILABLE."""
+        source = self.generate(address)
+        if source is None:
+            return _NOT_COMPILABLE
+        memory = self._cpu.memory
+        namespace = {'read': memory.read, 'write': memory.write}
+        code = compile(source, '<block ${0:04X}>'.format(address), 'exec')
+        exec(code, namespace)
+        return namespace['block']
+
+    def generate(self, address):
+        """Returns the Python source of the block starting at address, or None
+        if its first instruction cannot be compiled."""
+        read_uint8 = self._cpu.read_uint8
+        window = address // Translator.WINDOW_SIZE
+        body = []
+        cycles = 0
+        dynamic_cycles = False
+        pc = address
+        terminator = None
+        for _ in range(Translator.MAX_BLOCK_SIZE):
+            if pc // Translator.WINDOW_SIZE != window:
+                break
+            opcode = read_uint8(pc)
+            size = INSTRUCTION_SIZES[opcode]
+            if (pc + size - 1) // Translator.WINDOW_SIZE != window:
+                break
+            operand = [read_uint8(pc + i) for i in range(1, size)]
+            instruction = _Instruction(pc, opcode, operand, cycles)
+            lines = instruction.generate()
+            if lines is None:
+                break
+            body.append('    # ${0:04X} {1}'.format(pc, INSTRUCTION_NAMES[opcode]))
+            body.extend('    ' + line for line in lines)
+            dynamic_cycles = dynamic_cycles or instruction.dynamic_cycles
+            cycles += INSTRUCTION_CYCLES[opcode]
+            pc += size
+            if instruction.terminator is not None:
+                terminator = instruction.terminator
+                break
+
+        if pc == address:
+            return None
+
+        if terminator is None:
+            terminator = [
+                'WRITEBACK',
+                'cpu.pc = {}'.format(pc),
+                'return {} + extra'.format(cycles),
+            ]
+        registers = [
+            r for r in _REGISTERS
+            if any(
+                _REGISTERS_REGEX[r].search(line.split('#')[0])
+                for line in body + terminator
+            )
+        ]
+
+        source = ['def block(cpu):']
+        source.extend('    {0} = cpu.{0}'.format(r) for r in registers)
+        source.append('    extra = 0')
+        writeback = '; '.join('cpu.{0} = {0}'.format(r) for r in registers) or 'pass'
+        for line in body + ['    ' + line for line in terminator]:
+            source.append(line.replace('WRITEBACK', writeback))
+        source = '\n'.join(source) + '\n'
+        if not dynamic_cycles:
+            source = source.replace(' + extra', '').replace('    extra = 0\n', '')
+        return source
+
+
+class _Instruction:
+    """Generates the code of one instruction of a block."""
+    def __init__(self, pc, opcode, operand, cycles_before):
+        self.pc = pc
+        self.opcode = opcode
+        self.name = INSTRUCTION_NAMES[opcode]
+        self.mode = INSTRUCTION_MODES[opcode]
+        self.size = INSTRUCTION_SIZES[opcode]
+        self.page_cycles = INSTRUCTION_PAGE_CYCLES[opcode]
+        self.operand = operand
+        # Number of cycles spent in the block before this instruction
+        self.cycles_before = cycles_before
+        self.dynamic_cycles = False
+        self.terminator = None
+
+    def exit(self):
+        """Leaves the block before executing this instruction."""
+        return [
+            '    WRITEBACK',
+            '    cpu.pc = {}'.format(self.pc),
+            '    return {} + extra'.format(self.cycles_before),
+        ]
+
+    def address(self, write):
+        """Returns the lines computing the effective address into the local
+        variable a (or None if this instruction cannot be compiled)."""
+        mode, operand = self.mode, self.operand
+        if mode == AddressingMode.modeZeroPage:
+            return ['a = {}'.format(operand[0])]
+        elif mode == AddressingMode.modeZeroPageX:
+            return ['a = ({} + X) & 0xFF'.format(operand[0])]
+        elif mode == AddressingMode.modeZeroPageY:
+            return ['a = ({} + Y) & 0xFF'.format(operand[0])]
+        elif mode == AddressingMode.modeAbsolute:
+            address = operand[0] | operand[1] << 8
+            if not _is_static_access(address, write):
+                return None
+            return ['a = {}'.format(address)]
+
+        if mode == AddressingMode.modeAbsoluteX:
+            base = operand[0] | operand[1] << 8
+            lines = ['a = {} + X'.format(base)]
+            if self.page_cycles:
+                lines.append('if a & 0xFF00 != {}: extra += {}'.format(
+                    base & 0xFF00, self.page_cycles
+                ))
+        elif mode == AddressingMode.modeAbsoluteY:
+            base = operand[0] | operand[1] << 8
+            lines = ['a = ({} + Y) & 0xFFFF'.format(base)]
+            if self.page_cycles:
+                lines.append('if a & 0xFF00 != {}: extra += {}'.format(
+                    base & 0xFF00, self.page_cycles
+                ))
+        elif mode == AddressingMode.modeIndexedIndirect:
+            lines = [
+                'p = ({} + X) & 0xFF'.format(operand[0]),
+                'a = read(p) | read((p + 1) & 0xFF) << 8',
+            ]
+        elif mode == AddressingMode.modeIndirectIndexed:
+            lines = [
+                'a = (read({}) | read({}) << 8) + Y'.format(
+                    operand[0], (operand[0] + 1) & 0xFF
+                ),
+                'a &= 0xFFFF',
+            ]
+            if self.page_cycles:
+                lines.append('if (a - Y) & 0xFF00 != a & 0xFF00: extra += {}'.format(
+                    self.page_cycles
+                ))
+        else:
+            return None
+        self.dynamic_cycles = self.dynamic_cycles or bool(self.page_cycles)
+        # The page crossing penalty only applies once the access happens
+        guard = lines[:-1] if self.page_cycles else lines
+        if write:
+            guard.append('if 0x2000 <= a < 0x6000 or a >= 0x8000:')
+        else:
+            guard.append('if 0x2000 <= a < 0x6000 or a > 0xFFFF:')
+        guard.extend(self.exit())
+        if self.page_cycles:
+            guard.append(lines[-1])
+        return guard
+
+    def value(self):
+        """Returns the lines reading the operand value into the local
+        variable v."""
+        if self.mode == AddressingMode.modeImmediate:
+            return ['v = {}'.format(self.operand[0])]
+        lines = self.address(write=False)
+        if lines is None:
+            return None
+        return lines + ['v = read(a)']
+
+    def generate(self):
+        """Returns the lines of code of this instruction, or None if the
+        instruction cannot be part of a block."""
+        name, mode = self.name, self.mode
+        next_pc = self.pc + self.size
+        if name in _LOADS:
+            lines = self.value()
+            if lines is None:
+                return None
+            return lines + _LOADS[name] + _set_zn(_LOADS_RESULT[name])
+        elif name in _COMPARES:
+            lines = self.value()
+            if lines is None:
+                return None
+            register = _COMPARES[name]
+            return lines + [
+                'C = {} >= v'.format(register),
+                'zn = ({} - v) & 0xFF'.format(register),
+            ]
+        elif name == 'BIT':
+            lines = self.value()
+            if lines is None:
+                return None
+            return lines + [
+                'zn = (A & v) | (v & 0x80) << 1',
+                'O = (v >> 6) & 1',
+            ]
+        elif name in _STORES:
+            lines = self.address(write=True)
+            if lines is None:
+                return None
+            return lines + ['write(a, {})'.format(_STORES[name])]
+        elif name in _SHIFTS:
+            if mode == AddressingMode.modeAccumulator:
+                return ['v = A'] + _SHIFTS[name] + ['A = r'] + _set_zn('A')
+            lines = self.address(write=True)
+            if lines is None:
+                return None
+            return lines + ['v = read(a)'] + _SHIFTS[name] + \
+                ['write(a, r)'] + _set_zn('r')
+        elif name == 'NOP':
+            # Unofficial NOPs do not access memory but pay for page crossings
+            if mode == AddressingMode.modeAbsoluteX and self.page_cycles:
+                base = self.operand[0] | self.operand[1] << 8
+                self.dynamic_cycles = True
+                return [
+                    'if ({} + X) & 0xFF00 != {}: extra += {}'.format(
+                        base, base & 0xFF00, self.page_cycles
+                    )
+                ]
+            return []
+        elif name in _IMPLIED:
+            lines = list(_IMPLIED[name])
+            if name in _IMPLIED_RESULT:
+                lines += _set_zn(_IMPLIED_RESULT[name])
+            return lines
+        elif name == 'PHA':
+            return ['write(0x1A0 | sp, A)', 'sp = (sp - 1) & 0xFF']
+        elif name == 'PLA':
+            return ['sp = (sp + 1) & 0xFF', 'A = read(0x1A0 | sp)'] + _set_zn('A')
+        elif name in _BRANCH_CONDITIONS:
+            offset = self.operand[0]
+            if offset & 0x80:
+                offset -= 256
+            target = next_pc + offset
+            cycles = self.cycles_before + INSTRUCTION_CYCLES[self.opcode]
+            if name == 'BEQ':
+                taken = 1 + (next_pc & 0xFF00 != target & 0xFF00)
+            else:
+                taken = 1 + 2*(next_pc & 0xFF00 != target & 0xFF00)
+            self.terminator = [
+                'WRITEBACK',
+                'if {}:'.format(_BRANCH_CONDITIONS[name]),
+                '    cpu.pc = {}'.format(target),
+                '    return {} + extra'.format(cycles + taken),
+                'cpu.pc = {}'.format(next_pc),
+                'return {} + extra'.format(cycles),
+            ]
+            return []
+        elif name == 'JMP' and mode == AddressingMode.modeAbsolute:
+            cycles = self.cycles_before + INSTRUCTION_CYCLES[self.opcode]
+            self.terminator = [
+                'WRITEBACK',
+                'cpu.pc = {}'.format(self.operand[0] | self.operand[1] << 8),
+                'return {} + extra'.format(cycles),
+            ]
+            return []
+        elif name == 'JSR':
+            cycles = self.cycles_before + INSTRUCTION_CYCLES[self.opcode]
+            self.terminator = [
+                'WRITEBACK',
+                'cpu.pc = {}'.format(self.operand[0] | self.operand[1] << 8),
+                'return {} + extra'.format(cycles),
+            ]
+            return [
+                'write(0x1A0 | sp, {})'.format((next_pc - 1) >> 8),
+                'sp = (sp - 1) & 0xFF',
+                'write(0x1A0 | sp, {})'.format((next_pc - 1) & 0xFF),
+                'sp = (sp - 1) & 0xFF',
+            ]
+        elif name == 'RTS':
+            cycles = self.cycles_before + INSTRUCTION_CYCLES[self.opcode]
+            self.terminator = [
+                'WRITEBACK',
+                'cpu.pc = t + 1',
+                'return {} + extra'.format(cycles),
+            ]
+            return [
+                'sp = (sp + 1) & 0xFF',
+                't = read(0x1A0 | sp)',
+                'sp = (sp + 1) & 0xFF',
+                't = read(0x1A0 | sp) << 8 | t',
+            ]
+        return None
+
+
+def _set_zn(register):
+    return ['zn = {}'.format(register)]
+
+
+def _is_static_access(address, write):
+    """Returns whether the given static address can be accessed from a block,
+    i.e. it does not hit I/O registers nor the mapper registers."""
+    if 0x2000 <= address < 0x6000:
+        return False
+    if write and address >= 0x8000:
+        return False
+    return True
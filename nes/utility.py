@@ -1,20 +1,24 @@
-import numpy as np
 from collections import namedtuple
 import logging
 
+from nes.mirror import Mirroring
+
 log = logging.getLogger('nes.' + __name__)
 
 
 PRG_ROM_UNIT = 0x4000
 CHR_ROM_UNIT = 0x2000
 PRG_RAM_UNIT = 0x2000
+CHR_RAM_SIZE = 0x2000
+TRAINER_SIZE = 0x200
 HEADER_SIZE = 16
 # This defines the NES format
 CONSTANT = [0x4e, 0x45, 0x53, 0x1a]
 
 
 INESHeader = namedtuple('INESHEADER', [
-    'prg_rom_size', 'chr_rom_size', 'f6', 'f7', 'prg_ram_size', 'f9', 'f10'
+    'prg_rom_size', 'chr_rom_size', 'f6', 'f7', 'f8', 'f9', 'f10',
+    'f11', 'f12', 'f13', 'f14', 'f15'
 ])
 
 
@@ -24,7 +28,10 @@ class NESParserError(Exception):
 
 def parse_nes_file(f):
     """Takes an open file (as read bytes) and parses it according to
-    https://wiki.nesdev.com/w/index.php/INES.
+    https://wiki.nesdev.com/w/index.php/INES, or
+    https://wiki.nesdev.com/w/index.php/NES_2.0 for NES 2.0 files.
+
+    PRG and CHR ROM are read at once, each into a bytearray.
 
     Returns:
         some header metadata,
@@ -33,61 +40,105 @@ def parse_nes_file(f):
         the PRG_RAM size,
         the CHR_RAM size
     """
-    _next = lambda: f.read(1)[0]
-
     header = _extract_header(f)
     log.debug(header)
-    prg_rom = _extract_chunk(f, header.prg_rom_size * PRG_ROM_UNIT)
-    chr_rom = _extract_chunk(f, header.chr_rom_size * CHR_ROM_UNIT)
-    # FIXME: This is for debug purposes. Alert if we missed some data
-    assert f.read(1) == b''
-    prg_ram_size = header.prg_ram_size * PRG_RAM_UNIT
-    # TODO: enable the use of CHR RAM
-    chr_ram_size = 0
+    if header.f6 & 0b100:
+        # The trainer is not supported, skip it
+        _extract_chunk(f, TRAINER_SIZE)
+    prg_rom = _extract_chunk(f, _prg_rom_size(header))
+    chr_rom = _extract_chunk(f, _chr_rom_size(header))
+    if f.read(1) != b'':
+        log.warning('Ignoring the data after the CHR ROM.')
+    prg_ram_size, chr_ram_size = _ram_sizes(header)
     # Useful header data
     header_data = {
         'mapper_id': _mapper_id(header),
-        'mirror_id': _mirror_id(header)
+        'submapper_id': header.f8 >> 4 if _is_nes2(header) else 0,
+        'mirror_id': _mirror_id(header),
+        'battery': bool(header.f6 & 0b10)
     }
     return header_data, prg_rom, chr_rom, prg_ram_size, chr_ram_size
 
 
 def _extract_header(f):
-    _next = lambda: f.read(1)[0]
-    i = 0
-    h = np.zeros(HEADER_SIZE, dtype='uint8')
-    for i in range(HEADER_SIZE):
-        b = _next()
-        h[i] = b
-        # Check that this is indeed a NES file
-        if i < len(CONSTANT) and b != CONSTANT[i]:
-            raise NESParserError('Not a NES file.')
-
-    # A value 0 of prg_ram in fact means 1
-    h[8] = h[8] or 1
+    h = f.read(HEADER_SIZE)
+    # Check that this is indeed a NES file
+    if len(h) < HEADER_SIZE or list(h[:len(CONSTANT)]) != CONSTANT:
+        raise NESParserError('Not a NES file.')
     # Populate the header (minus the constant)
-    return INESHeader(
-        h[4], h[5], h[6], h[7], h[8], h[9], h[10]
-    )
+    return INESHeader(*h[len(CONSTANT):])
+
 
 def _extract_chunk(f, size):
     """Extracts size bytes from the file and returns the data as a
-    numpy array.
+    bytearray.
     """
     log.debug('Extracting chunk of size %s', size)
-    _next = lambda: f.read(1)[0]
-    data = np.zeros(size, dtype='uint8')
-    for i in range(size):
-        data[i] = _next()
+    data = bytearray(size)
+    if f.readinto(data) != size:
+        raise NESParserError('Truncated file.')
     return data
 
+
+def _is_nes2(header):
+    return header.f7 & 0b1100 == 0b1000
+
+
+def _has_garbage(header):
+    """Old dumping tools wrote their name in bytes 7 - 15 of iNES headers,
+    which must then be ignored."""
+    return not _is_nes2(header) and any(header[-4:])
+
+
+def _rom_size(lsb, msb, unit):
+    """Decodes a NES 2.0 ROM size."""
+    if msb == 0xF:
+        # Exponent-multiplier notation: 2^E * (MM*2+1) bytes
+        return (1 << (lsb >> 2)) * ((lsb & 0b11) * 2 + 1)
+    return (msb << 8 | lsb) * unit
+
+
+def _prg_rom_size(header):
+    if _is_nes2(header):
+        return _rom_size(header.prg_rom_size, header.f9 & 0x0F, PRG_ROM_UNIT)
+    return header.prg_rom_size * PRG_ROM_UNIT
+
+
+def _chr_rom_size(header):
+    if _is_nes2(header):
+        return _rom_size(header.chr_rom_size, header.f9 >> 4, CHR_ROM_UNIT)
+    return header.chr_rom_size * CHR_ROM_UNIT
+
+
+def _ram_sizes(header):
+    """Returns the PRG RAM and CHR RAM sizes, battery-backed RAM included."""
+    if _is_nes2(header):
+        # Shift counts, 0 meaning no RAM
+        shift_size = lambda shift: 64 << shift if shift else 0
+        prg_ram_size = shift_size(header.f10 & 0x0F) + shift_size(header.f10 >> 4)
+        chr_ram_size = shift_size(header.f11 & 0x0F) + shift_size(header.f11 >> 4)
+        return prg_ram_size, chr_ram_size
+    prg_ram_units = header.f8 if not _has_garbage(header) else 0
+    # A value 0 of prg_ram in fact means 1
+    prg_ram_size = (prg_ram_units or 1) * PRG_RAM_UNIT
+    # Without CHR ROM, the board has CHR RAM
+    chr_ram_size = 0 if header.chr_rom_size else CHR_RAM_SIZE
+    return prg_ram_size, chr_ram_size
+
+
 def _mapper_id(header):
     """Returns the mapper number. See
     https://wiki.nesdev.com/w/index.php/Mapper."""
-    # TODO: Add support for more than the 255 mappers encoded on flag6
-    return header.f6 >> 4
+    mapper_id = header.f6 >> 4
+    if not _has_garbage(header):
+        mapper_id |= header.f7 & 0xF0
+    if _is_nes2(header):
+        mapper_id |= (header.f8 & 0x0F) << 8
+    return mapper_id
+
 
 def _mirror_id(header):
-    """Determines the mirroring number."""
-    # TODO: Add support for more mirroring options.
+    """Determines the mirroring number, see mirror.Mirroring."""
+    if header.f6 & 0x08:
+        return Mirroring.four_screen
     return header.f6 & 1
@@ -0,0 +1,213 @@
+from nes.cartridge import SaveFlush
+from nes.console import Console
+from nes.cpu import InterruptType
+from nes.mirror import Mirroring
+
+
+def _nes_file(tmp_path, mapper_id, prg_banks, chr_banks, battery=False,
+              prg_ram_shift=None):
+    """Writes an iNES file whose 16kB PRG ROM banks are filled with their
+    number, and whose 1kB CHR ROM windows are filled with their number. With
+    prg_ram_shift, writes a NES 2.0 header with 64 << prg_ram_shift bytes of
+    PRG RAM (none for 0)."""
+    header = bytes([
+        0x4e, 0x45, 0x53, 0x1a, prg_banks, chr_banks,
+        (mapper_id & 0x0F) << 4 | battery << 1, mapper_id & 0xF0,
+    ]) + bytes(8)
+    if prg_ram_shift is not None:
+        header = header[:7] + bytes([mapper_id & 0xF0 | 0x08, 0, 0, prg_ram_shift]) + bytes(5)
+    prg_rom = b''.join(bytes([bank]) * 0x4000 for bank in range(prg_banks))
+    chr_rom = b''.join(bytes([window]) * 0x400 for window in range(chr_banks * 8))
+    path = tmp_path / 'mapper_{}.nes'.format(mapper_id)
+    path.write_bytes(header + prg_rom + chr_rom)
+    return str(path)
+
+
+def _banks(console):
+    """Returns the PRG banks at $8000 and $C000 and the CHR windows."""
+    cpu_memory, ppu_memory = console.cpu.memory, console.ppu.memory
+    return (
+        (cpu_memory.read(0x8000), cpu_memory.read(0xC000)),
+        tuple(ppu_memory.read(address) for address in range(0x0000, 0x2000, 0x400)),
+    )
+
+
+def _write_mmc1(console, address, value):
+    for i in range(5):
+        console.cpu.memory.write(address, (value >> i) & 1)
+
+
+def test_nrom_prg_ram(tmp_path):
+    """NES 2.0 NROM and CNROM dumps often declare no PRG RAM: $6000 - $7FFF
+    is then open bus. Smaller PRG RAM is mirrored."""
+    for mapper_id in [0, 3]:
+        memory = Console(_nes_file(tmp_path, mapper_id, 2, 1, prg_ram_shift=0)).cpu.memory
+        memory.write(0x6000, 0x42)
+        assert memory.read(0x6000) == 0x60
+        assert memory.read(0x7FFF) == 0x7F
+        # 2kB of PRG RAM, mirrored over the 8kB window
+        memory = Console(_nes_file(tmp_path, mapper_id, 2, 1, prg_ram_shift=5)).cpu.memory
+        memory.write(0x6001, 0x42)
+        assert memory.read(0x6801) == memory.read(0x7801) == 0x42
+
+
+def test_uxrom(tmp_path):
+    console = Console(_nes_file(tmp_path, 2, 8, 0))
+    assert _banks(console)[0] == (0, 7)
+    console.cpu.memory.write(0x8000, 5)
+    assert _banks(console)[0] == (5, 7)
+    assert console.mapper.prg_bank(0x8000) == 5 * 0x4000
+    assert console.mapper.prg_bank(0xC000) == 7 * 0x4000
+    # PRG RAM and CHR RAM
+    console.cpu.memory.write(0x6000, 0x42)
+    console.ppu.memory.write(0x0010, 0x24)
+    assert console.cpu.memory.read(0x6000) == 0x42
+    assert console.ppu.memory.read(0x0010) == 0x24
+
+
+def test_cnrom(tmp_path):
+    console = Console(_nes_file(tmp_path, 3, 1, 4))
+    assert _banks(console) == ((0, 0), tuple(range(8)))
+    console.cpu.memory.write(0xFFFF, 2)
+    assert _banks(console) == ((0, 0), tuple(range(16, 24)))
+    assert console.mapper.tiles.bank_tiles[0] == 2 * 0x2000 // 16
+
+
+def test_axrom(tmp_path):
+    console = Console(_nes_file(tmp_path, 7, 8, 0))
+    assert _banks(console)[0] == (0, 1)
+    assert console.ppu.memory.mirroring == Mirroring.single_screen_lower
+    console.cpu.memory.write(0x8000, 0x13)
+    assert _banks(console)[0] == (6, 7)
+    assert console.ppu.memory.mirroring == Mirroring.single_screen_upper
+
+
+def test_mmc1(tmp_path):
+    console = Console(_nes_file(tmp_path, 1, 8, 4))
+    # PRG mode 3 at power on
+    assert _banks(console) == ((0, 7), tuple(range(8)))
+    _write_mmc1(console, 0xE000, 3)
+    assert _banks(console)[0] == (3, 7)
+    # PRG mode 2, 4kB CHR banks, horizontal mirroring
+    _write_mmc1(console, 0x8000, 0b11011)
+    assert _banks(console)[0] == (0, 3)
+    assert console.ppu.memory.mirroring == Mirroring.horizontal
+    _write_mmc1(console, 0xA000, 5)
+    _write_mmc1(console, 0xC000, 2)
+    assert _banks(console)[1] == (20, 21, 22, 23, 8, 9, 10, 11)
+    # 32kB PRG and 8kB CHR banks, the low bit of the banks is ignored
+    _write_mmc1(console, 0x8000, 0b00010)
+    assert _banks(console) == ((2, 3), tuple(range(16, 24)))
+    assert console.ppu.memory.mirroring == Mirroring.vertical
+    # A write with bit 7 set resets the shift register and the PRG mode
+    console.cpu.memory.write(0x8000, 1)
+    console.cpu.memory.write(0x8000, 0x80)
+    assert _banks(console)[0] == (3, 7)
+    _write_mmc1(console, 0xE000, 1)
+    assert _banks(console)[0] == (1, 7)
+
+
+def test_bank_switch_invalidates_decoded(tmp_path):
+    console = Console(_nes_file(tmp_path, 2, 8, 0))
+    cpu = console.cpu
+    cpu.decode(0x8000)
+    console.cpu.memory.write(0x8000, 0)
+    assert cpu.decoded[0x8000] is not None
+    console.cpu.memory.write(0x8000, 1)
+    assert cpu.decoded[0x8000] is None
+
+
+def test_mmc3(tmp_path):
+    console = Console(_nes_file(tmp_path, 4, 8, 8))
+    memory = console.cpu.memory
+    # 8kB windows: banks 0, 1, second last, last
+    assert [memory.read(address) for address in range(0x8000, 0x10000, 0x2000)] == [0, 0, 7, 7]
+    assert console.mapper.prg_bank(0xA000) == 0x2000
+    assert console.mapper.prg_bank(0xC000) == 14 * 0x2000
+    assert _banks(console)[1] == (0, 1, 2, 3, 4, 5, 6, 7)
+    for register, value in enumerate([8, 13, 20, 21, 22, 23, 4, 5]):
+        memory.write(0x8000, register)
+        memory.write(0x8001, value)
+    assert [memory.read(address) for address in range(0x8000, 0x10000, 0x2000)] == [2, 2, 7, 7]
+    assert console.mapper.prg_bank(0xA000) == 5 * 0x2000
+    assert _banks(console)[1] == (8, 9, 12, 13, 20, 21, 22, 23)
+    # Swapped PRG windows and pattern tables
+    memory.write(0x8000, 0xC0)
+    assert [memory.read(address) for address in range(0x8000, 0x10000, 0x2000)] == [7, 2, 2, 7]
+    assert _banks(console)[1] == (20, 21, 22, 23, 8, 9, 12, 13)
+    memory.write(0xA000, 1)
+    assert console.ppu.memory.mirroring == Mirroring.horizontal
+    memory.write(0xA000, 0)
+    assert console.ppu.memory.mirroring == Mirroring.vertical
+
+
+def _mmc3_irq_console(tmp_path, latch, **kwargs):
+    console = Console(_nes_file(tmp_path, 4, 8, 8), **kwargs)
+    console.ppu.PPUMASK.write(0x18)
+    console.cpu.I = 0
+    memory = console.cpu.memory
+    memory.write(0xC000, latch)
+    memory.write(0xC001, 0)
+    memory.write(0xE001, 0)
+    return console
+
+
+def test_mmc3_irq(tmp_path):
+    """Tests that the IRQ is raised at the step predicted by the console,
+    whether the PPU steps, renders whole lines or skips idle dots."""
+    for latch in [0, 1, 20, 239, 255]:
+        expected = _mmc3_irq_console(tmp_path, latch, exact_timing=True)
+        ppu = expected.ppu
+        dots = expected.dots_until_irq()
+        for _ in range(dots - 1):
+            ppu.step()
+        assert expected.cpu.interrupt_status == InterruptType.interruptNone
+        ppu.step()
+        assert expected.cpu.interrupt_status == InterruptType.interruptIRQ
+        assert ppu.clock == 257
+
+        console = _mmc3_irq_console(tmp_path, latch)
+        assert console.dots_until_irq() == dots
+        console.ppu.run(dots - 1)
+        assert console.cpu.interrupt_status == InterruptType.interruptNone
+        console.ppu.run(1)
+        assert console.cpu.interrupt_status == InterruptType.interruptIRQ
+        assert (console.ppu.scan_line, console.ppu.clock) == (ppu.scan_line, ppu.clock)
+        assert console.mapper.irq_counter == expected.mapper.irq_counter
+
+
+def test_mmc3_irq_acknowledge(tmp_path):
+    """Tests that disabling the IRQ acknowledges a pending one, but not an
+    NMI."""
+    console = _mmc3_irq_console(tmp_path, 10)
+    cpu = console.cpu
+    console.ppu.run(console.dots_until_irq())
+    assert cpu.interrupt_status == InterruptType.interruptIRQ
+    cpu.memory.write(0xE000, 0)
+    assert cpu.interrupt_status == InterruptType.interruptNone
+    assert console.dots_until_irq() is None
+    cpu.triggerNMI()
+    cpu.memory.write(0xE000, 0)
+    assert cpu.interrupt_status == InterruptType.interruptNMI
+
+
+def test_battery(tmp_path):
+    nes_file = _nes_file(tmp_path, 1, 8, 4, battery=True)
+    save_file = tmp_path / 'mapper_1.sav'
+    console = Console(nes_file)
+    assert save_file.stat().st_size == 0x2000
+    for address in range(0x6000, 0x8000):
+        console.cpu.memory.write(address, address >> 8)
+    console.close()
+    expected = bytes(i >> 8 for i in range(0x6000, 0x8000))
+    assert save_file.read_bytes() == expected
+    # The next console starts from the saved data
+    console = Console(nes_file, save_flush=SaveFlush.frame)
+    assert bytes(console.cpu.memory.read(i) for i in range(0x6000, 0x8000)) == expected
+    assert console.ppu.frame_callback is not None
+    # Explicit save file, carts without a battery have none
+    console = Console(nes_file, save_file=str(tmp_path / 'other.sav'))
+    assert console.cpu.memory.read(0x6000) == 0
+    assert (tmp_path / 'other.sav').exists()
+    Console(_nes_file(tmp_path, 2, 8, 0))
+    assert not (tmp_path / 'mapper_2.sav').exists()
@@ -1,5 +1,9 @@
 from nes.console import Console
+from nes.mirror import Mirroring
+from nes.ppu import PPU, RenderLevel
+import numpy as np
 import os
+import random
 import time
 import cProfile
 
@@ -17,3 +21,225 @@ def test_ppu():
         if time.time() - t > 10:
             console.debugger.dump(_abs_path('cpu_ops.txt'))
             assert False
+
+
+def _state(console):
+    cpu, ppu = console.cpu, console.ppu
+    return (
+        cpu.pc, cpu.A, cpu.X, cpu.Y, cpu.getFlags(), cpu.sp,
+        ppu.scan_line, ppu.clock, ppu.frame, ppu.v, ppu.t, ppu.nmi_delay,
+        bytes(ppu.OAMDATA.data), bytes(ppu.memory._name_table),
+        ppu.frame_buffer.tobytes(), ppu.background_data, ppu.PPUSTATUS.peek(),
+    )
+
+
+def test_catch_up():
+    """Tests that the PPU catching up with the CPU gives the same results as
+    stepping it after every instruction."""
+    console = Console(_abs_path('color_test.nes'), exact_timing=True)
+    expected = []
+    for _ in range(20000):
+        expected.append(_state(console))
+        console.step()
+
+    console = Console(_abs_path('color_test.nes'))
+    for i in range(20000):
+        if i % 100 == 0:
+            console.catch_up()
+            assert _state(console) == expected[i]
+        assert _state(console)[:6] == expected[i][:6]
+        console.step()
+
+
+def test_frame_buffer():
+    console = Console(_abs_path('color_test.nes'))
+    while console.ppu.frame < 60:
+        console.step()
+    frame_buffer = console.ppu.frame_buffer
+    assert frame_buffer.shape == (240, 256)
+    # The background color and the palette entries of the test pattern
+    assert set(frame_buffer.flat) == {0x00, 0x16, 0x2D, 0x30}
+    rgb = console.ppu.rgb_frame()
+    assert rgb.shape == (240, 256, 3)
+    assert tuple(rgb[0, 0]) == (0x66, 0x66, 0x66)
+
+
+def _randomize(console, seed, control):
+    """Fills the name tables, palettes, OAM and CHR ROM with random data, sets
+    a random scroll and enables rendering."""
+    rng = random.Random(seed)
+    ppu = console.ppu
+    ppu.memory._name_table[:] = bytes(rng.randrange(256) for _ in range(0x1000))
+    ppu.memory._palette[:] = bytes(rng.randrange(64) for _ in range(0x20))
+    ppu.OAMDATA.data[:] = bytes(rng.randrange(256) for _ in range(256))
+    for address in range(0x2000):
+        ppu.memory.write(address, rng.randrange(256))
+    ppu.PPUCTRL.write(control)
+    ppu.PPUMASK.write(0x1E)
+    ppu.t = rng.randrange(0x8000)
+    ppu.x = rng.randrange(8)
+
+
+def test_render_line():
+    """Tests that rendering whole lines at once gives the same frames as
+    rendering them dot by dot."""
+    for seed, control in enumerate([0x00, 0x18, 0x20, 0x33]):
+        consoles = [Console(_abs_path('color_test.nes')) for _ in range(2)]
+        for console in consoles:
+            while console.ppu.frame < 2:
+                console.step()
+            console.catch_up()
+            _randomize(console, seed, control)
+        dots = 3 * PPU.CLOCK_CYCLE * (PPU.PRE_RENDER_SCAN_LINE + 1)
+        step = consoles[0].ppu.step
+        for _ in range(dots):
+            step()
+        consoles[1].ppu.run(dots)
+        assert _state(consoles[0])[6:] == _state(consoles[1])[6:]
+
+
+def test_tile_cache():
+    """Tests that the decoded tiles follow writes to the pattern tables."""
+    console = Console(_abs_path('color_test.nes'))
+    memory = console.ppu.memory
+    # Tile $101: the low bitplane of row 2 set, the high one of its 4 first
+    # pixels
+    memory.write(0x1012, 0xFF)
+    memory.write(0x101A, 0xF0)
+    tiles = np.array([0x101])
+    assert memory.tiles.rows(tiles, 2).tolist() == [[3, 3, 3, 3, 1, 1, 1, 1]]
+    assert memory.tiles.rows(tiles, 2, flip=True).tolist() == [[1, 1, 1, 1, 3, 3, 3, 3]]
+    memory.write(0x1012, 0x0F)
+    assert memory.tiles.rows(tiles, 2).tolist() == [[2, 2, 2, 2, 1, 1, 1, 1]]
+
+
+def test_visible_sprites():
+    console = Console(_abs_path('color_test.nes'))
+    oam = console.ppu.OAMDATA
+    oam.upload_from_cpu(bytes([0xF0, 0, 0, 0] * 64))
+    for i in range(1, 10):
+        console.ppu.OAMADDR.write(4 * i)
+        oam.write(100 + i % 2)
+    indexes, overflow = oam.visible_sprites(101, 8)
+    assert indexes.tolist() == [1, 2, 3, 4, 5, 6, 7, 8] and overflow
+    indexes, overflow = oam.visible_sprites(100, 8)
+    assert indexes.tolist() == [2, 4, 6, 8] and not overflow
+    indexes, overflow = oam.visible_sprites(108, 8)
+    assert indexes.tolist() == [1, 3, 5, 7, 9] and not overflow
+    indexes, overflow = oam.visible_sprites(109, 16)
+    assert indexes.tolist() == [1, 2, 3, 4, 5, 6, 7, 8] and overflow
+
+
+def test_skip_idle_dots():
+    """Tests that skipping the idle steps gives the same results as stepping
+    the PPU, with rendering disabled and during the vertical blank."""
+    for mask in [0x00, 0x1E]:
+        consoles = [Console(_abs_path('color_test.nes')) for _ in range(2)]
+        for console in consoles:
+            while console.ppu.frame < 2:
+                console.step()
+            console.catch_up()
+            console.ppu.PPUMASK.write(mask)
+            console.ppu.PPUCTRL.write(0x80)
+        step = consoles[0].ppu.step
+        for dots in [5, 1000, 30000, 100000, 200000]:
+            for _ in range(dots):
+                step()
+            consoles[1].ppu.run(dots)
+            states = [_state(console) + (console.cpu.interrupt_status,) for console in consoles]
+            assert states[0] == states[1]
+
+
+def test_background_layer():
+    """Tests that the background layer gives the same frames as fetching the
+    tiles of each line, through name table, CHR and control changes."""
+    consoles = [
+        Console(_abs_path('color_test.nes'), background_layer=layer) for layer in (False, True)
+    ]
+    for console in consoles:
+        while console.ppu.frame < 2:
+            console.step()
+        console.catch_up()
+        _randomize(console, 0, 0x00)
+    rng = random.Random(0)
+    dots = PPU.CLOCK_CYCLE * (PPU.PRE_RENDER_SCAN_LINE + 1)
+    for control in [0x00, 0x10, 0x10, 0x00]:
+        writes = [
+            (rng.choice([0x2000, 0x23C0, 0x2800, 0x2FC0, 0x1000]) + rng.randrange(0x40),
+             rng.randrange(256))
+            for _ in range(10)
+        ]
+        scroll = rng.randrange(0x8000)
+        for console in consoles:
+            console.ppu.PPUCTRL.write(control)
+            console.ppu.t = scroll
+            for address, value in writes:
+                console.ppu.memory.write(address, value)
+            console.ppu.run(dots)
+        assert _state(consoles[0])[6:] == _state(consoles[1])[6:]
+    assert consoles[1].ppu.background_layer.rendered_tiles < 5 * 64 * 60
+
+
+def test_render_levels():
+    """Tests that skipped frames produce no pixels, but the same PPUSTATUS
+    and NMI timing as rendered ones."""
+    options = [
+        dict(),
+        dict(render_level=RenderLevel.none),
+        dict(render_level=RenderLevel.rgb, frameskip=2),
+    ]
+    consoles = [Console(_abs_path('color_test.nes'), **option) for option in options]
+    rng = random.Random(1)
+    sprite_rows = [rng.randrange(64) for _ in range(64)]
+    for console in consoles:
+        while console.ppu.frame < 2:
+            console.step()
+        console.catch_up()
+        _randomize(console, 1, 0x80)
+        # Sprites on few lines, to overflow
+        console.ppu.OAMDATA.data[::4] = bytes(sprite_rows)
+    frame_buffer = consoles[1].ppu.frame_buffer.copy()
+    flags = 0
+    for _ in range(6 * (PPU.PRE_RENDER_SCAN_LINE + 1)):
+        for console in consoles:
+            console.ppu.run(PPU.CLOCK_CYCLE)
+        states = [
+            (console.ppu.PPUSTATUS.peek(), console.cpu.interrupt_status) + _state(console)[6:14]
+            for console in consoles
+        ]
+        assert states[0] == states[1] == states[2]
+        flags |= states[0][0]
+        ppu = consoles[2].ppu
+        if ppu.scan_line == PPU.POST_RENDER_SCAN_LINE + 1 and ppu.frame % 3 == 0:
+            assert (ppu.frame_buffer == consoles[0].ppu.frame_buffer).all()
+            assert (ppu.rgb_frame_buffer == ppu.rgb_frame()).all()
+    assert (consoles[1].ppu.frame_buffer == frame_buffer).all()
+    # Sprite zero hits and overflows happened
+    assert flags & 0x60 == 0x60
+
+
+def test_mirroring():
+    console = Console(_abs_path('color_test.nes'))
+    memory = console.ppu.memory
+    tables = [0x2000, 0x2400, 0x2800, 0x2C00]
+    for mirroring, expected in [
+        (Mirroring.horizontal, [2, 2, 4, 4]),
+        (Mirroring.vertical, [3, 4, 3, 4]),
+        (Mirroring.single_screen_lower, [4, 4, 4, 4]),
+        (Mirroring.single_screen_upper, [4, 4, 4, 4]),
+        (Mirroring.four_screen, [1, 2, 3, 4]),
+    ]:
+        console.mapper.set_mirroring(mirroring)
+        for value, table in enumerate(tables, 1):
+            memory.write(table + 0x123, value)
+        assert [memory.read(table + 0x123) for table in tables] == expected
+
+
+def test_ppu_memory_mirrors():
+    memory = Console(_abs_path('color_test.nes')).ppu.memory
+    memory.write(0x3123, 0x42)
+    assert memory.read(0x2123) == 0x42
+    memory.write(0x3F10, 0x21)
+    assert memory.read(0x3F00) == memory.read(0x3FE0) == 0x21
+    memory.write(0x3F31, 0x22)
+    assert memory.read(0x3F11) == 0x22 and memory.read(0x3F01) != 0x22
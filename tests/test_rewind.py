@@ -0,0 +1,53 @@
+from nes.console import Console
+from nes.rewind import Rewind
+import os
+
+
+def _abs_path(path):
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(_dir, path)
+
+
+def _run_frame(console):
+    frame = console.ppu.frame
+    while console.ppu.frame == frame:
+        console.step()
+
+
+def test_rewind():
+    console = Console(_abs_path('color_test.nes'))
+    rewind = Rewind(console, keyframe_interval=8)
+    states = []
+    for _ in range(30):
+        _run_frame(console)
+        rewind.record()
+        states.append(bytes(console.save_state()))
+    assert rewind.stats()['frames'] == 30
+    assert rewind.step_back(10) == 10
+    assert bytes(console.save_state()) == states[19]
+    # Recording goes on from there
+    _run_frame(console)
+    rewind.record()
+    assert bytes(console.save_state()) == states[20]
+    assert rewind.step_back(0) == 0
+    assert bytes(console.save_state()) == states[20]
+    assert rewind.step_back(100) == 20
+    assert bytes(console.save_state()) == states[0]
+    assert rewind.stats()['frames'] == 1
+
+
+def test_rewind_limits():
+    console = Console(_abs_path('nestest.nes'))
+    rewind = Rewind(console, capacity=20, keyframe_interval=8)
+    for _ in range(50):
+        _run_frame(console)
+        rewind.record()
+    # Whole groups are dropped
+    assert 13 <= rewind.stats()['frames'] <= 20
+    assert rewind.stats()['bytes'] == sum(group.size for group in rewind._groups)
+    rewind = Rewind(console, keyframe_interval=4, max_bytes=2000)
+    for _ in range(50):
+        _run_frame(console)
+        rewind.record()
+    assert rewind.stats()['bytes'] <= 2000
+    assert rewind.stats()['ms_per_record'] > 0
@@ -0,0 +1,92 @@
+from nes.console import Console
+from nes.state import StateError, StateLayout
+from tests.test_mapper import _nes_file
+import os
+import pytest
+
+
+def _abs_path(path):
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(_dir, path)
+
+
+def _run(console, frames):
+    end = console.ppu.frame + frames
+    while console.ppu.frame < end:
+        console.step()
+    return console.cpu.pc, console.ppu.frame_buffer.tobytes(), bytes(console.save_state())
+
+
+def test_save_load_state():
+    """Tests that running from a loaded savestate gives the same results as
+    running from the saved point, in the same console or in another one."""
+    for options in [{}, {'translate': True, 'skip_idle': True}, {'background_layer': True}]:
+        console = Console(_abs_path('color_test.nes'), **options)
+        _run(console, 5)
+        state = console.save_state()
+        assert len(state) == console._state_layout.size
+        expected = _run(console, 3)
+        console.load_state(state)
+        assert _run(console, 3) == expected
+        other = Console(_abs_path('color_test.nes'), **options)
+        _run(other, 1)
+        other.load_state(bytes(state))
+        assert _run(other, 3) == expected
+
+
+def test_state_out_buffer():
+    console = Console(_abs_path('nestest.nes'))
+    _run(console, 1)
+    out = bytearray(len(console.save_state()))
+    assert console.save_state(out) is out
+    assert out == console.save_state()
+
+
+def test_state_errors():
+    console = Console(_abs_path('nestest.nes'))
+    state = console.save_state()
+    with pytest.raises(StateError):
+        console.load_state(state[:-1])
+    with pytest.raises(StateError):
+        console.load_state(b'XXXX' + state[4:])
+    state[4] = StateLayout.VERSION + 1
+    with pytest.raises(StateError):
+        console.load_state(state)
+    # CHR ROM instead of CHR RAM: another layout
+    with pytest.raises(StateError):
+        Console(_abs_path('color_test.nes')).load_state(console.save_state())
+
+
+def test_mapper_state(tmp_path):
+    console = Console(_nes_file(tmp_path, 4, 8, 8))
+    memory = console.cpu.memory
+    memory.write(0x8000, 6)
+    memory.write(0x8001, 3)
+    memory.write(0x8000, 2)
+    memory.write(0x8001, 17)
+    memory.write(0xA000, 1)
+    state = console.save_state()
+    memory.write(0x8000, 0xC6)
+    memory.write(0x8001, 5)
+    memory.write(0xA000, 0)
+    console.load_state(state)
+    assert memory.read(0x8000) == 1
+    assert console.mapper.prg_bank(0x8000) == 3 * 0x2000
+    assert console.ppu.memory.read(0x1000) == 17
+    assert console.ppu.memory.mirroring == 0
+
+
+def test_state_between_tile_fetch_and_load():
+    """Tests a savestate taken after the tile bytes are fetched, before they
+    are loaded into the background data."""
+    console = Console(_abs_path('color_test.nes'), exact_timing=True)
+    _run(console, 5)
+    ppu = console.ppu
+    while not (ppu.scan_line == 100 and ppu.clock == 103):
+        ppu.step()
+    state = console.save_state()
+    expected = _run(console, 1)
+    ppu.low_tile_byte ^= 0xFF
+    ppu.high_tile_byte ^= 0xFF
+    console.load_state(state)
+    assert _run(console, 1) == expected